@@ -1,8 +1,19 @@
-from django.contrib import admin
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.db import DatabaseError
+from django.http import HttpResponseRedirect
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
 
 # Register your models here.
 
-from .models import Author, Genre, Book, BookInstance, Language, Loan
+from .models import Author, Genre, Book, BookInstance, Language, Loan, LoanReminder
+from .circulation import CirculationError, check_out_copies, return_copies
+from .forms import ManifestUploadForm
+from .importer import ImportResult, import_manifest
+from .pagination import EstimatedCountPaginator
 
 admin.site.register(Genre)
 admin.site.register(Language)
@@ -14,6 +25,24 @@ class BooksInline(admin.TabularInline):
     model = Book
 
 
+class CachedAllValuesFieldListFilter(admin.AllValuesFieldListFilter):
+    """AllValuesFieldListFilter reading the distinct values of the column from the cache.
+
+    New values show up in the sidebar after at most LOOKUP_TIMEOUT seconds.
+    """
+
+    LOOKUP_TIMEOUT = 60 * 10
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        super().__init__(field, request, params, model, model_admin, field_path)
+        key = 'catalog:admin-filter:{}:{}'.format(model._meta.label_lower, field_path)
+        lookup_choices = cache.get(key)
+        if lookup_choices is None:
+            lookup_choices = list(self.lookup_choices)
+            cache.set(key, lookup_choices, self.LOOKUP_TIMEOUT)
+        self.lookup_choices = lookup_choices
+
+
 class LoanReservationFilter(admin.SimpleListFilter):
 
     title = "Type"
@@ -35,8 +64,22 @@ class LoanReservationFilter(admin.SimpleListFilter):
 
 @admin.register(Loan)
 class LoanAdmin(admin.ModelAdmin):
-    list_display = [field.name for field in Loan._meta.get_fields()]
+    list_display = ("id", "book_instance", "borrower", "reserved_date", "loan_date", "due_date", "return_date")
     list_filter = (LoanReservationFilter,)
+    # BookInstance.__str__ shows the title of the book
+    list_select_related = ("book_instance__book", "borrower")
+    # Select widgets would list every copy and every user
+    raw_id_fields = ("book_instance", "borrower")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(LoanReminder)
+class LoanReminderAdmin(admin.ModelAdmin):
+    list_display = ("loan", "kind", "due_date", "sent_at")
+    list_filter = ("kind",)
+    list_select_related = ("loan__book_instance__book", "loan__borrower")
+    raw_id_fields = ("loan",)
 
 
 @admin.register(Author)
@@ -67,7 +110,45 @@ class BookAdmin(admin.ModelAdmin):
     """
 
     list_display = ("title", "author", "display_genre")
+    list_select_related = ("author",)
     inlines = [BooksInstanceInline]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # Book.display_genre slices the prefetched genres
+        return super().get_queryset(request).prefetch_related("genre")
+
+    def get_urls(self):
+        return [
+            path("import/", self.admin_site.admin_view(self.import_view), name="catalog_book_import"),
+        ] + super().get_urls()
+
+    def import_view(self, request):
+        """Upload a manifest of books, copies and covers, imported by catalog/importer.py."""
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        if request.method == "POST":
+            form = ManifestUploadForm(request.POST, request.FILES)
+            if form.is_valid():
+                manifest = form.cleaned_data["manifest"]
+                result = ImportResult()
+                try:
+                    import_manifest(manifest, fmt=form.cleaned_data["format"] or None, result=result,
+                                    cover_dir=settings.CATALOG_IMPORT_COVER_DIR)
+                except (DatabaseError, OSError) as error:
+                    # The chunks before the failing one are committed
+                    self.message_user(request, "Import stopped after row {}: {}".format(result.rows, error),
+                                      messages.ERROR)
+                for row_number, message in result.errors:
+                    self.message_user(request, "Row {}: {}".format(row_number, message), messages.WARNING)
+                self.message_user(request, "Imported {}.".format(result))
+                return HttpResponseRedirect(reverse("admin:catalog_book_changelist"))
+        else:
+            form = ManifestUploadForm()
+        context = dict(self.admin_site.each_context(request), opts=self.model._meta, form=form,
+                       title="Import books")
+        return TemplateResponse(request, "admin/catalog/book/import.html", context)
 
 
 admin.site.register(Book, BookAdmin)
@@ -83,6 +164,10 @@ class BookInstanceAdmin(admin.ModelAdmin):
     """
 
     list_display = ("book", "id")
+    list_select_related = ("book",)
+    actions = ["check_out_reserved", "mark_returned"]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     # list_filter = ('status', 'due_back')
 
     # fieldsets = (
@@ -94,14 +179,36 @@ class BookInstanceAdmin(admin.ModelAdmin):
     #    }),
     # )
 
+    @admin.action(description="Check out the reservations of selected copies")
+    def check_out_reserved(self, request, queryset):
+        try:
+            result = check_out_copies(list(queryset.values_list("pk", flat=True)))
+        except CirculationError as error:
+            self.message_user(request, str(error), messages.ERROR)
+        else:
+            self.message_user(request, "Checked out: {}.".format(result))
+
+    @admin.action(description="Mark selected copies as returned")
+    def mark_returned(self, request, queryset):
+        result = return_copies(list(queryset.values_list("pk", flat=True)))
+        self.message_user(request, "Returned: {}.".format(result))
+
 
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 from .models import User
 
-UserAdmin.list_display += ("students_at_Italian_school", "supporter", "library_card_until")  # don't forget the commas
-UserAdmin.list_filter += ("students_at_Italian_school", "supporter", "library_card_until")
-UserAdmin.fieldsets += (
-    ("Library card", {"fields": ("students_at_Italian_school", "supporter", "library_card_until")}),
-)
-admin.site.register(User, UserAdmin)
+
+class LibraryUserAdmin(UserAdmin):
+    list_display = UserAdmin.list_display + ("students_at_Italian_school", "supporter", "library_card_until")  # don't forget the commas
+    # library_card_until uses the date ranges of DateFieldListFilter, which need no query
+    list_filter = UserAdmin.list_filter + (
+        ("students_at_Italian_school", CachedAllValuesFieldListFilter), "supporter", "library_card_until")
+    fieldsets = UserAdmin.fieldsets + (
+        ("Library card", {"fields": ("students_at_Italian_school", "supporter", "library_card_until")}),
+    )
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+admin.site.register(User, LibraryUserAdmin)
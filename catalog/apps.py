@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class CatalogConfig(AppConfig):
     name = 'catalog'
+
+    def ready(self):
+        # Connect the signal handlers that keep denormalized data in sync
+        from . import signals  # noqa: F401
+        # Tune the SQLite connections and record their queries (InstrumentationMiddleware)
+        from . import database, middleware  # noqa: F401
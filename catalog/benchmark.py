@@ -0,0 +1,246 @@
+"""Synthetic library and per-view query budgets used by the benchmark commands and tests."""
+import datetime
+import random
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from urllib.parse import urlsplit
+
+from django.contrib.auth.hashers import make_password
+from django.db import OperationalError, connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from .circulation import reserve_copy
+from .models import Author, Book, BookInstance, Genre, Language, Loan, User, refresh_availability
+from .search import index_books
+
+BENCHMARK_PASSWORD = 'benchmark-password'
+
+
+def seed_library(books=2000, copies_per_book=2, users=300, loans=3000, seed=0):
+    """Fill the database with a synthetic library, using bulk inserts.
+
+    Returns a dict with the objects the benchmarked views are pointed at.
+    """
+    rng = random.Random(seed)
+    today = datetime.date.today()
+
+    Language.objects.bulk_create([Language(name=name) for name in ('Italian', 'English', 'Spanish')])
+    languages = list(Language.objects.order_by('pk'))
+    Genre.objects.bulk_create([Genre(name='Genre {0:03d}'.format(i)) for i in range(20)])
+    genres = list(Genre.objects.order_by('pk'))
+    Author.objects.bulk_create([
+        Author(first_name='First {0:05d}'.format(i), last_name='Last {0:05d}'.format(i))
+        for i in range(max(books // 5, 1))
+    ])
+    authors = list(Author.objects.order_by('pk'))
+
+    Book.objects.bulk_create([
+        Book(title='Book {0:06d}'.format(i), summary='Summary of book {0}'.format(i),
+             author=authors[i % len(authors)], language=languages[i % len(languages)],
+             cover='covers/book-{0}.jpg'.format(i))
+        for i in range(books)
+    ], batch_size=500)
+    book_ids = list(Book.objects.order_by('pk').values_list('pk', flat=True))
+
+    Book.genre.through.objects.bulk_create([
+        Book.genre.through(book_id=book_id, genre_id=genre.pk)
+        for book_id in book_ids
+        for genre in rng.sample(genres, 2)
+    ], batch_size=1000)
+
+    copies = [BookInstance(book_id=book_id, imprint='Imprint {0}'.format(copy))
+              for book_id in book_ids for copy in range(copies_per_book)]
+    BookInstance.objects.bulk_create(copies, batch_size=1000)
+
+    password = make_password(BENCHMARK_PASSWORD)
+    User.objects.bulk_create([
+        User(username='family{0:05d}'.format(i), email='family{0}@example.com'.format(i), password=password,
+             library_card_until=today + datetime.timedelta(days=365))
+        for i in range(users)
+    ], batch_size=500)
+    borrowers = list(User.objects.filter(username__startswith='family').order_by('pk'))
+
+    # Every copy gets at most one open loan, the rest of the history is returned loans
+    open_copies = rng.sample(copies, min(len(copies) // 4, loans))
+    history = []
+    for number, copy in enumerate(open_copies):
+        borrower = borrowers[number % len(borrowers)]
+        if number % 3:
+            loan_date = today - datetime.timedelta(days=rng.randint(0, 30))
+            history.append(Loan(book_instance=copy, borrower=borrower, loan_date=loan_date,
+                                due_date=loan_date + Loan.DEFAULT_LOAN_DURATION))
+        else:
+            history.append(Loan(book_instance=copy, borrower=borrower, reserved_date=today))
+    for number in range(loans - len(open_copies)):
+        loan_date = today - datetime.timedelta(days=rng.randint(30, 3 * 365))
+        history.append(Loan(book_instance=rng.choice(copies), borrower=borrowers[number % len(borrowers)],
+                            loan_date=loan_date, due_date=loan_date + Loan.DEFAULT_LOAN_DURATION,
+                            return_date=loan_date + datetime.timedelta(days=rng.randint(1, 20))))
+    Loan.objects.bulk_create(history, batch_size=1000)
+    # bulk_create sends no signals
+    refresh_availability()
+    index_books()
+
+    # The catalog.can_mark_returned permission is only granted to superusers
+    librarian = User.objects.create_superuser(username='librarian', email='librarian@example.com',
+                                              password=BENCHMARK_PASSWORD)
+
+    return {
+        'book': Book.objects.order_by('pk').first(),
+        'author': authors[0],
+        'genre': genres[0],
+        'borrower': borrowers[0],
+        'librarian': librarian,
+    }
+
+
+# (name, URL name, URL args key, logged in user key, query parameters, query budget)
+# No view loads related rows one by one: budgets do not depend on the size of the library.
+# Pages of logged in users include the loan summary of the navigation (cold cache), and the
+# permissions of the user for the loan desk link (superusers need no query).
+# The list views are cursor paginated: one query per page and no COUNT(*).
+VIEW_BUDGETS = [
+    ('index', 'index', None, None, {}, 4),
+    ('BookListView', 'books', None, None, {}, 1),
+    ('BookListView available_only', 'books', None, None, {'available_only': '1'}, 1),
+    ('BookDetailView', 'book-detail', 'book', None, {}, 4),
+    ('AuthorListView', 'authors', None, None, {}, 1),
+    ('AuthorDetailView', 'author-detail', 'author', None, {}, 2),
+    ('GenreListView', 'genres', None, None, {}, 1),
+    ('GenreDetailView', 'genre-detail', 'genre', None, {}, 2),
+    ('LoanedBooksByUserListView', 'my-borrowed', None, 'borrower', {}, 7),
+    ('LoanedBooksAllListView', 'all-borrowed', None, 'librarian', {}, 9),
+]
+
+
+def measure_views(client, targets, repeat=5):
+    """Request every view of VIEW_BUDGETS and return one result dict per view."""
+    results = []
+    for name, url_name, arg, user, params, budget in VIEW_BUDGETS:
+        client.logout()
+        if user is not None:
+            client.force_login(targets[user])
+        url = reverse(url_name, args=[targets[arg].pk] if arg else None)
+        if params:
+            url += '?' + urlencode(params)
+
+        timings = []
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - start) * 1000)
+        results.append({
+            'view': name,
+            'url': url,
+            'status_code': response.status_code,
+            'queries': len(queries),
+            'query_budget': budget,
+            'over_budget': len(queries) > budget,
+            'wall_ms_median': round(statistics.median(timings), 2),
+            'wall_ms_max': round(max(timings), 2),
+            'response_bytes': len(response.content),
+        })
+    return results
+
+
+def seed_reservations(reservations):
+    """A copy and a family with a valid library card for every reservation of measure_reservations."""
+    book = Book.objects.create(title='Reserved book', summary='Reserved by every family',
+                               language=Language.objects.get_or_create(name='Italian')[0])
+    BookInstance.objects.bulk_create([BookInstance(book=book, imprint='Copy {0}'.format(number))
+                                      for number in range(reservations)], batch_size=500)
+    User.objects.bulk_create([
+        User(username='reserver{0:05d}'.format(number),
+             library_card_until=datetime.date.today() + datetime.timedelta(days=365))
+        for number in range(reservations)
+    ], batch_size=500)
+    copies = BookInstance.objects.filter(book=book).values_list('pk', flat=True)
+    families = User.objects.filter(username__startswith='reserver').order_by('pk')
+    return list(zip(families, copies))
+
+
+def measure_reservations(pairs, workers):
+    """Reserve the copy of every (family, copy pk) pair from workers threads, return a result dict.
+
+    Every thread has its own database connection, like the gunicorn workers.
+    """
+    def reserve_all(pairs):
+        timings, locked = [], 0
+        try:
+            for family, copy in pairs:
+                start = time.perf_counter()
+                try:
+                    reserve_copy(family, copy)
+                except OperationalError:
+                    locked += 1
+                else:
+                    timings.append((time.perf_counter() - start) * 1000)
+        finally:
+            connection.close()
+        return timings, locked
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(reserve_all, [pairs[number::workers] for number in range(workers)]))
+    seconds = time.perf_counter() - start
+    timings = [timing for worker_timings, locked in results for timing in worker_timings]
+    return {
+        'workers': workers,
+        'reservations': len(pairs),
+        'succeeded': len(timings),
+        'locked': sum(locked for worker_timings, locked in results),
+        'seconds': round(seconds, 3),
+        'per_second': round(len(timings) / seconds, 1) if seconds else 0.0,
+        'latency_ms_median': round(statistics.median(timings), 2) if timings else None,
+        'latency_ms_max': round(max(timings), 2) if timings else None,
+    }
+
+
+def measure_load(base_url, paths, concurrency, duration):
+    """GET paths in turn from concurrency threads for duration seconds, return a result dict.
+
+    Every request opens a new connection, like browsers behind a proxy without keep-alive.
+    """
+    host, port = urlsplit(base_url).hostname, urlsplit(base_url).port
+    deadline = time.perf_counter() + duration
+
+    def load(offset):
+        timings, errors = [], 0
+        number = offset
+        while time.perf_counter() < deadline:
+            path = paths[number % len(paths)]
+            number += 1
+            start = time.perf_counter()
+            try:
+                client = HTTPConnection(host, port, timeout=30)
+                client.request('GET', path)
+                response = client.getresponse()
+                response.read()
+                client.close()
+            except OSError:
+                errors += 1
+                continue
+            if response.status >= 400:
+                errors += 1
+            else:
+                timings.append((time.perf_counter() - start) * 1000)
+        return timings, errors
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(load, range(concurrency)))
+    seconds = time.perf_counter() - start
+    timings = sorted(timing for worker_timings, errors in results for timing in worker_timings)
+    return {
+        'concurrency': concurrency,
+        'requests': len(timings),
+        'errors': sum(errors for worker_timings, errors in results),
+        'per_second': round(len(timings) / seconds, 1),
+        'latency_ms_median': round(statistics.median(timings), 2) if timings else None,
+        'latency_ms_p99': round(timings[min(len(timings) - 1, int(len(timings) * 0.99))], 2) if timings else None,
+    }
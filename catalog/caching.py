@@ -0,0 +1,196 @@
+"""Cached catalog data, invalidated by the model signals in catalog/signals.py."""
+import time
+import uuid
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+from django.template.loader import render_to_string
+
+from .models import Author, Book, BookInstance, Loan
+
+HOMEPAGE_STATS_KEY = 'catalog:homepage-stats'
+HOMEPAGE_STATS_TIMEOUT = 60 * 60
+
+PER_WORKER_TIMEOUT = 60 * 5
+
+
+def cache_timeout(timeout):
+    """Return timeout with a cache shared by every worker, at most PER_WORKER_TIMEOUT otherwise.
+
+    A per-process cache (CATALOG_SHARED_CACHE unset) only sees the invalidations of its
+    own worker, so what the others cached is kept for minutes only.
+    """
+    return timeout if settings.CATALOG_SHARED_CACHE else min(timeout, PER_WORKER_TIMEOUT)
+
+
+def get_homepage_stats():
+    """Return the record counts shown on the home page, from the cache when possible."""
+    stats = cache.get(HOMEPAGE_STATS_KEY)
+    if stats is None:
+        num_instances = BookInstance.objects.count()
+        stats = {
+            'num_books': Book.objects.count(),
+            'num_instances': num_instances,
+            # Available copies of books
+            'num_instances_available': num_instances - Loan.objects.filter(return_date__isnull=True).count(),
+            'num_authors': Author.objects.count(),
+        }
+        cache.set(HOMEPAGE_STATS_KEY, stats, cache_timeout(HOMEPAGE_STATS_TIMEOUT))
+    return stats
+
+
+def invalidate_homepage_stats():
+    """Delete the cached counts once the current transaction commits (at once outside of one).
+
+    Deleted before the commit, a concurrent request could cache the counts of before the change.
+    """
+    transaction.on_commit(lambda: cache.delete(HOMEPAGE_STATS_KEY))
+
+
+LOAN_SUMMARY_TIMEOUT = 60 * 60 * 24
+
+
+class LoanSummary:
+    """Counts of the open loans and reservations of a user, cached by get_loan_summary()."""
+
+    def __init__(self, open_loans, open_reservations, overdue, quota_used, max_books):
+        self.open_loans = open_loans
+        self.open_reservations = open_reservations
+        self.overdue = overdue
+        self.quota_used = quota_used
+        self.max_books = max_books
+
+    @classmethod
+    def for_user(cls, user):
+        today = date.today()
+        counts = user.loan_set.filter(return_date__isnull=True).aggregate(
+            open_loans=Count('pk', filter=Q(loan_date__isnull=False)),
+            open_reservations=Count('pk', filter=Q(loan_date__isnull=True, reserved_date__isnull=False)),
+            overdue=Count('pk', filter=Q(loan_date__isnull=False, due_date__lt=today)),
+            quota_used=Count('pk', filter=Loan.COUNTS_AGAINST_QUOTA),
+        )
+        return cls(max_books=user.max_books, **counts)
+
+    @property
+    def remaining_quota(self):
+        """Number of books the user can still reserve, as reserve_copy counts them."""
+        return max(self.max_books - self.quota_used, 0)
+
+    @property
+    def open_total(self):
+        return self.open_loans + self.open_reservations
+
+
+def _loan_summary_version_key(user_pk):
+    return 'catalog:loan-summary-version:{}'.format(user_pk)
+
+
+def get_loan_summary_version(user):
+    """Opaque version of the LoanSummary of a user, changed by bump_loan_summary."""
+    version_key = _loan_summary_version_key(user.pk)
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, uuid.uuid4().hex, None)
+        version = cache.get(version_key)
+    return version
+
+
+def get_loan_summary(user):
+    """Return the LoanSummary of a user, costing no query on a cache hit.
+
+    Keys are versioned per user (see bump_loan_summary) and per day, since
+    overdue loans and an expired library card depend on the date.
+    """
+    version = get_loan_summary_version(user)
+    key = 'catalog:loan-summary:{}:{}:{}'.format(user.pk, version, date.today().isoformat())
+    summary = cache.get(key)
+    if summary is None:
+        summary = LoanSummary.for_user(user)
+        cache.set(key, summary, cache_timeout(LOAN_SUMMARY_TIMEOUT))
+    return summary
+
+
+def bump_loan_summary(*user_pks):
+    """Make the cached LoanSummary of the given users stale once the current transaction commits."""
+    transaction.on_commit(lambda: cache.set_many(
+        {_loan_summary_version_key(user_pk): uuid.uuid4().hex for user_pk in user_pks}, None))
+
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+
+def _catalog_version_key(model_name, pk):
+    return 'catalog:version:{}:{}'.format(model_name, pk)
+
+
+def get_catalog_version(model_name=None, pk=None):
+    """Timestamp of the last change of the catalog, or of what the page of one book, author or genre shows.
+
+    Used as ETag and Last-Modified of the catalog pages (see catalog/views.py) when the cache
+    is shared by every worker (CATALOG_CONDITIONAL_GET). A version missing from the cache
+    starts now, which can only cause an unneeded 200.
+    """
+    key = CATALOG_VERSION_KEY if model_name is None else _catalog_version_key(model_name, pk)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_catalog_version(books=(), authors=(), genres=()):
+    """Mark the whole catalog and the pages of the given book, author and genre ids as changed.
+
+    The stamps move when the current transaction commits: moved before, a concurrent
+    request could render the rows of before the change under the new version.
+    """
+    keys = [CATALOG_VERSION_KEY]
+    for model_name, pks in (('book', books), ('author', authors), ('genre', genres)):
+        # Querysets of ids are evaluated now, in the transaction that sees the change
+        keys.extend(_catalog_version_key(model_name, pk) for pk in pks if pk is not None)
+
+    def bump():
+        now = time.time()
+        cache.set_many({key: now for key in keys}, None)
+    transaction.on_commit(bump)
+
+
+BOOK_TILE_TIMEOUT = 60 * 60 * 24 * 7
+
+
+def _book_tile_version_key(book_pk):
+    return 'catalog:book-tile-version:{}'.format(book_pk)
+
+
+def get_book_tiles(books):
+    """Return the rendered grid tile of every book, in order, rendering only those missing from the cache.
+
+    Tiles are keyed on the book and a version changed by bump_book_tiles, and cost
+    two cache round trips for the whole grid on a hit.
+    """
+    books = list(books)
+    version_keys = {book.pk: _book_tile_version_key(book.pk) for book in books}
+    versions = cache.get_many(version_keys.values())
+    missing_versions = {key: uuid.uuid4().hex for key in version_keys.values() if key not in versions}
+    if missing_versions:
+        cache.set_many(missing_versions, None)
+        versions.update(missing_versions)
+
+    tile_keys = {book.pk: 'catalog:book-tile:{}:{}'.format(book.pk, versions[version_keys[book.pk]])
+                 for book in books}
+    tiles = cache.get_many(tile_keys.values())
+    rendered = {tile_keys[book.pk]: render_to_string('catalog/includes/book_tile.html', {'book': book})
+                for book in books if tile_keys[book.pk] not in tiles}
+    if rendered:
+        cache.set_many(rendered, cache_timeout(BOOK_TILE_TIMEOUT))
+        tiles.update(rendered)
+    return [tiles[tile_keys[book.pk]] for book in books]
+
+
+def bump_book_tiles(*book_pks):
+    """Make the cached grid tiles of the given books stale once the current transaction commits."""
+    transaction.on_commit(lambda: cache.set_many(
+        {_book_tile_version_key(book_pk): uuid.uuid4().hex for book_pk in book_pks}, None))
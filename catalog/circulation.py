@@ -0,0 +1,140 @@
+"""Circulation operations (reservations, loans and returns) that must stay consistent under concurrency."""
+from datetime import date
+
+from django.db import IntegrityError, transaction
+from django.shortcuts import get_object_or_404
+
+from .caching import bump_catalog_version, bump_loan_summary, invalidate_homepage_stats
+from .database import retry_on_locked
+from .models import BookInstance, Loan, User, refresh_availability
+
+
+class CirculationError(Exception):
+    """A circulation operation was refused, the message is shown to the user."""
+
+
+@retry_on_locked
+def reserve_copy(borrower, book_instance_pk):
+    """Reserve a copy for a borrower in a single transaction and return the new Loan.
+
+    The borrower and copy rows are locked, so concurrent reservations by the same family
+    cannot exceed User.max_books and two families cannot both get the same copy. The
+    catalog_loan_one_open_per_copy constraint is the last line of defence on databases
+    without row locks (SQLite).
+    """
+    with transaction.atomic():
+        borrower = User.objects.select_for_update().get(pk=borrower.pk)
+        max_books = borrower.max_books
+        if borrower.loan_set.filter(Loan.COUNTS_AGAINST_QUOTA).count() >= max_books:
+            raise CirculationError('Already reached the maximum number of {} Reserved books.'.format(max_books))
+
+        book_instance = get_object_or_404(BookInstance.objects.select_for_update(), pk=book_instance_pk)
+        if book_instance.loan_set.filter(return_date__isnull=True).exists():
+            raise CirculationError('Book not available')
+        try:
+            with transaction.atomic():
+                return Loan.objects.create(book_instance=book_instance, borrower=borrower,
+                                           reserved_date=date.today())
+        except IntegrityError:
+            raise CirculationError('Book not available')
+
+
+@retry_on_locked
+def cancel_copy_reservation(borrower, loan_pk):
+    """Cancel a reservation of the borrower, return False when loan_pk is not one of their open reservations."""
+    with transaction.atomic():
+        loan = get_object_or_404(Loan.objects.select_for_update(), pk=loan_pk)
+        if loan.borrower_id != borrower.pk or not loan.is_reservation:
+            return False
+        loan.return_date = date.today()
+        loan.save()
+        return True
+
+
+class DeskResult:
+    """Outcome of a bulk loan desk operation, copies are listed by UUID."""
+
+    def __init__(self):
+        self.processed = []
+        self.skipped = []
+        self.not_found = []
+
+    def __str__(self):
+        parts = ['{} processed'.format(len(self.processed))]
+        if self.skipped:
+            parts.append('{} skipped'.format(len(self.skipped)))
+        if self.not_found:
+            parts.append('{} not found'.format(len(self.not_found)))
+        return ', '.join(parts)
+
+
+def _locked_copies_and_loans(book_instance_pks, result):
+    """Lock the copies and their open loans, recording the unknown UUIDs in result."""
+    copies = {copy.pk: copy for copy in BookInstance.objects.select_for_update().filter(pk__in=book_instance_pks)}
+    result.not_found = [pk for pk in book_instance_pks if pk not in copies]
+    open_loans = {loan.book_instance_id: loan for loan in
+                  Loan.objects.select_for_update().filter(book_instance__in=list(copies), return_date__isnull=True)}
+    return copies, open_loans
+
+
+def _loans_changed(loans):
+    """Side effects of Loan.save() that bulk operations skip, see catalog/signals.py."""
+    book_ids = set(BookInstance.objects.filter(pk__in={loan.book_instance_id for loan in loans})
+                   .values_list('book_id', flat=True))
+    refresh_availability(book_ids)
+    invalidate_homepage_stats()
+    bump_catalog_version(books=book_ids)
+    bump_loan_summary(*{loan.borrower_id for loan in loans})
+
+
+@retry_on_locked
+def check_out_copies(book_instance_pks, borrower=None, loan_date=None):
+    """Check out many copies at once, in one transaction and a handful of queries.
+
+    Reservations of the copies are converted into loans. Copies that are not reserved
+    are lent to borrower when given, otherwise they are skipped like copies already on loan.
+    """
+    loan_date = loan_date or date.today()
+    due_date = loan_date + Loan.DEFAULT_LOAN_DURATION
+    result = DeskResult()
+    with transaction.atomic():
+        copies, open_loans = _locked_copies_and_loans(book_instance_pks, result)
+
+        reservations = []
+        new_loans = []
+        for pk in copies:
+            loan = open_loans.get(pk)
+            if loan is not None and loan.loan_date is None:
+                loan.loan_date = loan_date
+                loan.due_date = due_date
+                reservations.append(loan)
+            elif loan is None and borrower is not None:
+                new_loans.append(Loan(book_instance_id=pk, borrower=borrower, loan_date=loan_date, due_date=due_date))
+            else:
+                result.skipped.append(pk)
+                continue
+            result.processed.append(pk)
+
+        try:
+            Loan.objects.bulk_update(reservations, ['loan_date', 'due_date'])
+            Loan.objects.bulk_create(new_loans)
+        except IntegrityError:
+            raise CirculationError('Some copies were reserved while checking out, please try again.')
+        _loans_changed(reservations + new_loans)
+    return result
+
+
+@retry_on_locked
+def return_copies(book_instance_pks, return_date=None):
+    """Close the open loans (or reservations) of many copies at once."""
+    return_date = return_date or date.today()
+    result = DeskResult()
+    with transaction.atomic():
+        copies, open_loans = _locked_copies_and_loans(book_instance_pks, result)
+        result.skipped = [pk for pk in copies if pk not in open_loans]
+        result.processed = list(open_loans)
+        for loan in open_loans.values():
+            loan.return_date = return_date
+        Loan.objects.bulk_update(open_loans.values(), ['return_date'])
+        _loans_changed(list(open_loans.values()))
+    return result
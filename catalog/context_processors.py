@@ -0,0 +1,16 @@
+from django.utils.functional import SimpleLazyObject
+
+from .caching import get_loan_summary
+
+
+def loan_summary(request):
+    """Add the cached LoanSummary of the logged in user (None for anonymous users) as loan_summary.
+
+    It is only looked up when a template uses it.
+    """
+    def summary():
+        if request.user.is_authenticated:
+            return get_loan_summary(request.user)
+        return None
+
+    return {'loan_summary': SimpleLazyObject(summary)}
@@ -0,0 +1,57 @@
+"""SQLite tuning of the single-box deployment.
+
+Every new SQLite connection gets the CATALOG_SQLITE_PRAGMAS: write-ahead logging so
+that readers never block the writer, synchronous=NORMAL (safe with WAL, one fsync per
+checkpoint instead of per commit), a busy timeout so that a writer waits for the lock
+instead of failing at once, and a larger page cache and memory map.
+
+SQLite still has a single writer: retry_on_locked retries the write transactions of
+catalog/circulation.py, with exponential backoff, when the lock could not be taken
+within the busy timeout ("database is locked").
+"""
+import functools
+import random
+import time
+
+from django.conf import settings
+from django.db import OperationalError, connection as default_connection
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.CATALOG_SQLITE_PRAGMAS.items():
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
+
+
+def is_locked_error(error):
+    return 'database is locked' in str(error) or 'database table is locked' in str(error)
+
+
+def retry_on_locked(func=None, attempts=None, delay=0.05):
+    """Decorator retrying a write transaction when SQLite reports that the database is locked.
+
+    Waits delay, then twice as long at every attempt, with jitter so that the workers do
+    not retry in lockstep. Calls made inside a transaction are not retried: the
+    transaction is already broken, the outermost decorated call retries it.
+    """
+    if func is None:
+        return functools.partial(retry_on_locked, attempts=attempts, delay=delay)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if default_connection.in_atomic_block:
+            return func(*args, **kwargs)
+        retries = settings.CATALOG_SQLITE_WRITE_RETRIES if attempts is None else attempts
+        for attempt in range(retries + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as error:
+                if attempt == retries or not is_locked_error(error):
+                    raise
+                time.sleep(delay * 2 ** attempt * random.uniform(0.5, 1.5))
+    return wrapper
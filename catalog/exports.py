@@ -0,0 +1,139 @@
+"""Streaming CSV and JSON Lines exports of the loan history.
+
+Loans are read with QuerySet.iterator(chunk_size) as flat tuples joined with their copy,
+book and borrower, and written out one chunk at a time, so memory only depends on the
+chunk size however many years are exported. The same generators feed the librarian
+download view (StreamingHttpResponse) and the export_loans command.
+"""
+import csv
+import datetime
+import json
+
+from django.db.models import Q
+from django.utils.text import compress_sequence
+
+from .models import Loan
+
+CHUNK_SIZE = 2000
+FORMATS = ('csv', 'jsonl')
+
+RESERVED = 'reserved'
+ON_LOAN = 'on_loan'
+OVERDUE = 'overdue'
+RETURNED = 'returned'
+STATUS_CHOICES = (
+    (RESERVED, 'Reserved'),
+    (ON_LOAN, 'On loan'),
+    (OVERDUE, 'Overdue'),
+    (RETURNED, 'Returned'),
+)
+
+# (column, lookup) of the exported rows, the status column is computed from the dates
+COLUMNS = (
+    ('loan_id', 'id'),
+    ('reserved_date', 'reserved_date'),
+    ('loan_date', 'loan_date'),
+    ('due_date', 'due_date'),
+    ('return_date', 'return_date'),
+    ('copy_id', 'book_instance_id'),
+    ('imprint', 'book_instance__imprint'),
+    ('book_id', 'book_instance__book_id'),
+    ('title', 'book_instance__book__title'),
+    ('borrower_id', 'borrower_id'),
+    ('borrower', 'borrower__username'),
+    ('borrower_email', 'borrower__email'),
+)
+HEADER = [column for column, lookup in COLUMNS] + ['status']
+
+
+def status_filter(status, today=None):
+    """Q of the loans with status, one of STATUS_CHOICES."""
+    today = today or datetime.date.today()
+    open_loans = Q(return_date__isnull=True)
+    if status == RESERVED:
+        return open_loans & Q(loan_date__isnull=True)
+    if status == ON_LOAN:
+        return open_loans & Q(loan_date__isnull=False) & (Q(due_date__gte=today) | Q(due_date__isnull=True))
+    if status == OVERDUE:
+        return open_loans & Q(loan_date__isnull=False, due_date__lt=today)
+    if status == RETURNED:
+        return Q(return_date__isnull=False)
+    raise ValueError('Unknown loan status: {}'.format(status))
+
+
+def loan_status(reserved_date, loan_date, due_date, return_date, today):
+    if return_date is not None:
+        return RETURNED
+    if loan_date is None:
+        return RESERVED
+    if due_date is not None and due_date < today:
+        return OVERDUE
+    return ON_LOAN
+
+
+def export_queryset(since=None, until=None, statuses=()):
+    """Loans that started (were lent, or reserved when never lent) between since and until included."""
+    loans = Loan.objects.all()
+    if since is not None:
+        loans = loans.filter(Q(loan_date__gte=since) | Q(loan_date__isnull=True, reserved_date__gte=since))
+    if until is not None:
+        loans = loans.filter(Q(loan_date__lte=until) | Q(loan_date__isnull=True, reserved_date__lte=until))
+    if statuses:
+        condition = Q(pk__in=[])
+        for status in statuses:
+            condition |= status_filter(status)
+        loans = loans.filter(condition)
+    return loans
+
+
+def export_rows(loans, chunk_size=CHUNK_SIZE):
+    """Yield the loans as lists of HEADER values, chunk_size rows fetched at a time."""
+    today = datetime.date.today()
+    rows = loans.order_by('pk').values_list(*[lookup for column, lookup in COLUMNS])
+    for row in rows.iterator(chunk_size=chunk_size):
+        yield list(row) + [loan_status(*row[1:5], today=today)]
+
+
+class Echo:
+    """File-like object returning what is written, lets csv.writer produce lines for a generator."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(HEADER)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def jsonl_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(HEADER, row)), default=str) + '\n'
+
+
+def export_chunks(loans, fmt='csv', compress=False, chunk_size=CHUNK_SIZE):
+    """Yield the export of loans as bytes, one chunk per chunk_size rows, gzipped when compress."""
+    if fmt not in FORMATS:
+        raise ValueError('Unknown export format: {}'.format(fmt))
+    lines = (csv_lines if fmt == 'csv' else jsonl_lines)(export_rows(loans, chunk_size))
+    chunks = _join(lines, chunk_size)
+    return compress_sequence(chunks) if compress else chunks
+
+
+def _join(lines, size):
+    """Group lines by size, a write per line would flush tiny chunks to the client."""
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if len(buffer) >= size:
+            yield ''.join(buffer).encode()
+            buffer = []
+    if buffer:
+        yield ''.join(buffer).encode()
+
+
+def export_filename(fmt, compress=False, since=None, until=None):
+    parts = ['loans'] + [day.isoformat() for day in (since, until) if day]
+    return '{}.{}{}'.format('_'.join(parts), fmt, '.gz' if compress else '')
@@ -57,3 +57,66 @@ class MyCustomUserForm(RegistrationFormUniqueEmail):
 MyCustomUserForm.Meta.fields  += ['students_at_Italian_school']
 #MyCustomUserForm.fields['username'].widget = forms.HiddenInput()
 #MyCustomUserForm.fields['username'].required = False
+
+
+import re
+import uuid
+
+
+class LoanDeskForm(forms.Form):
+    """Form for a librarian to check out or return many copies at once."""
+    CHECK_OUT = 'checkout'
+    RETURN = 'return'
+
+    action = forms.ChoiceField(choices=((CHECK_OUT, 'Check out'), (RETURN, 'Return')))
+    copies = forms.CharField(
+        widget=forms.Textarea(attrs={'rows': 10}),
+        help_text="Scan or paste the IDs of the copies, one per line (commas and spaces also work).")
+    borrower = forms.ModelChoiceField(
+        queryset=User.objects.order_by('username'), required=False,
+        help_text="Lend copies that are not reserved to this borrower (check out only).")
+
+    def clean_copies(self):
+        tokens = [token for token in re.split(r'[\s,;]+', self.cleaned_data['copies']) if token]
+        copies = []
+        invalid = []
+        for token in tokens:
+            try:
+                copy = uuid.UUID(token)
+            except ValueError:
+                invalid.append(token)
+                continue
+            if copy not in copies:
+                copies.append(copy)
+        if invalid:
+            raise ValidationError(_('Invalid copy IDs: %(ids)s'), params={'ids': ', '.join(invalid)})
+        if not copies:
+            raise ValidationError(_('Enter at least one copy ID'))
+        return copies
+
+
+class ManifestUploadForm(forms.Form):
+    """Manifest of books to import from the book admin, see catalog/importer.py."""
+    manifest = forms.FileField(help_text="CSV or JSON Lines file, one book per row.")
+    format = forms.ChoiceField(choices=(('', 'From the file extension'), ('csv', 'CSV'), ('jsonl', 'JSON Lines')),
+                               required=False)
+
+
+from .exports import STATUS_CHOICES
+
+
+class LoanExportForm(forms.Form):
+    """Filters of the loan history export, see catalog/exports.py."""
+    format = forms.ChoiceField(choices=(('csv', 'CSV'), ('jsonl', 'JSON Lines')))
+    since = forms.DateField(required=False, help_text="Loans started on or after this date.")
+    until = forms.DateField(required=False, help_text="Loans started on or before this date.")
+    status = forms.MultipleChoiceField(choices=STATUS_CHOICES, required=False,
+                                       widget=forms.CheckboxSelectMultiple, help_text="All loans when none is checked.")
+    gzip = forms.BooleanField(required=False, label="Gzip")
+
+    def clean(self):
+        cleaned_data = super().clean()
+        since, until = cleaned_data.get('since'), cleaned_data.get('until')
+        if since and until and since > until:
+            raise ValidationError(_('The start date is after the end date'))
+        return cleaned_data
@@ -0,0 +1,305 @@
+"""Streaming import of books, copies and covers from a CSV or JSON Lines manifest.
+
+Every row is a book:
+
+    title, summary, author_first_name, author_last_name, genres, language, url, cover, copies, imprint
+
+genres is a list in JSON Lines and separated by | in CSV, cover is a file name in the cover
+directory and copies (default 1) the number of BookInstance to create with imprint.
+
+Rows are read one at a time and written in chunks with bulk_create, so memory only depends on
+the chunk size and on the number of distinct authors, genres and languages. bulk_create sends
+no signals: the side effects of Book.save() (availability, search index, caches, thumbnails)
+are run explicitly for every chunk.
+"""
+import csv
+import io
+import itertools
+import json
+import os
+import time
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+
+from .caching import bump_catalog_version, invalidate_homepage_stats
+from .models import Author, Book, BookInstance, Genre, Language, refresh_availability
+from .search import index_books
+from .thumbnails import ensure_thumbnails
+
+CHUNK_SIZE = 500
+# Errors kept for the report, the others are only counted
+MAX_REPORTED_ERRORS = 100
+
+
+class ManifestError(Exception):
+    """A manifest row that cannot be imported."""
+
+
+class ImportResult:
+    """Counts of an import, with the first MAX_REPORTED_ERRORS errors as (row number, message)."""
+
+    def __init__(self):
+        self.rows = 0
+        self.books = 0
+        self.copies = 0
+        self.covers = 0
+        self.error_count = 0
+        self.errors = []
+        self.seconds = 0.0
+
+    def add_error(self, row_number, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((row_number, message))
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return '{} rows: {} books, {} copies, {} covers, {} errors in {:.1f} s ({:.0f} rows/s)'.format(
+            self.rows, self.books, self.copies, self.covers, self.error_count, self.seconds, self.rows_per_second)
+
+
+def read_manifest(stream, fmt):
+    """Yield the rows of a text stream as dicts, fmt is 'csv' or 'jsonl'.
+
+    A row that cannot be read is yielded as a ManifestError, reported by the importer
+    with its row number. Reading stops at the first bytes that are not UTF-8.
+    """
+    if fmt not in ('csv', 'jsonl'):
+        raise ValueError('Unknown manifest format: {}'.format(fmt))
+    try:
+        if fmt == 'csv':
+            for row in csv.DictReader(stream):
+                genres = row.get('genres') or ''
+                row['genres'] = genres.split('|')
+                yield row
+        else:
+            for line in stream:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError as error:
+                        yield ManifestError('Invalid JSON: {}.'.format(error))
+    except UnicodeDecodeError:
+        yield ManifestError('Not UTF-8 text, the rest of the manifest was not read.')
+    except csv.Error as error:
+        yield ManifestError('Invalid CSV, the rest of the manifest was not read: {}.'.format(error))
+
+
+def text_value(value, name):
+    """The stripped text of the value of the name column, numbers are accepted as text."""
+    if value is None:
+        return ''
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ManifestError('Invalid {}: {}.'.format(name, json.dumps(value)))
+    return str(value).strip()
+
+
+def manifest_format(name):
+    """'csv' or 'jsonl' from the extension of a manifest file name."""
+    extension = os.path.splitext(name)[1].lower()
+    return 'jsonl' if extension in ('.jsonl', '.ndjson', '.json') else 'csv'
+
+
+class LookupCache:
+    """Primary keys of the rows of model by natural key, created in bulk when missing."""
+
+    def __init__(self, model, key_fields):
+        self.model = model
+        self.key_fields = key_fields
+        self.pks = {}
+
+    def resolve(self, keys):
+        """Make sure every key of keys has a pk, with at most three queries."""
+        missing = {key for key in keys if key not in self.pks}
+        if not missing:
+            return
+        self._load(missing)
+        missing = [key for key in missing if key not in self.pks]
+        if missing:
+            self.model.objects.bulk_create([self.model(**dict(zip(self.key_fields, key))) for key in missing])
+            # bulk_create does not set the pks on every database, read them back
+            self._load(missing)
+
+    def _load(self, keys):
+        lookups = {'{}__in'.format(field): {key[index] for key in keys}
+                   for index, field in enumerate(self.key_fields)}
+        for row in self.model.objects.filter(**lookups).values_list('pk', *self.key_fields):
+            if tuple(row[1:]) in keys:
+                self.pks.setdefault(tuple(row[1:]), row[0])
+
+    def __getitem__(self, key):
+        return self.pks[key]
+
+
+class CatalogImporter:
+    """Import manifests in chunks of chunk_size rows, see the module docstring."""
+
+    def __init__(self, cover_dir=None, chunk_size=CHUNK_SIZE, thumbnails=True):
+        self.cover_dir = cover_dir
+        self.chunk_size = chunk_size
+        self.thumbnails = thumbnails
+        self.authors = LookupCache(Author, ('first_name', 'last_name'))
+        self.genres = LookupCache(Genre, ('name',))
+        self.languages = LookupCache(Language, ('name',))
+
+    def run(self, rows, result=None):
+        """Import an iterable of row dicts, return the ImportResult."""
+        result = result or ImportResult()
+        start = time.perf_counter()
+        numbered = enumerate(rows, start=1)
+        while True:
+            chunk = list(itertools.islice(numbered, self.chunk_size))
+            if not chunk:
+                break
+            self.import_chunk(chunk, result)
+            result.rows += len(chunk)
+        invalidate_homepage_stats()
+        result.seconds = time.perf_counter() - start
+        return result
+
+    def clean_row(self, row):
+        if isinstance(row, ManifestError):
+            raise row
+        if not isinstance(row, dict):
+            raise ManifestError('Not an object: {}.'.format(json.dumps(row)))
+
+        def text(name):
+            return text_value(row.get(name), name)
+
+        title = text('title')
+        if not title:
+            raise ManifestError('Missing title.')
+        try:
+            copies = int(row.get('copies') or 1)
+        except (TypeError, ValueError):
+            raise ManifestError('Invalid number of copies: {}.'.format(row.get('copies')))
+        first_name = text('author_first_name')
+        last_name = text('author_last_name')
+        language = text('language')
+        genres = row.get('genres') or []
+        if not isinstance(genres, list):
+            raise ManifestError('Invalid genres: {}.'.format(json.dumps(genres)))
+        cover = text('cover')
+        if cover:
+            cover = self.cover_path(cover)
+        return {
+            'title': title,
+            'summary': text('summary'),
+            'author': (first_name, last_name) if first_name or last_name else None,
+            'genres': [(name,) for name in (text_value(genre, 'genres') for genre in genres) if name],
+            'language': (language,) if language else None,
+            'url': text('url') or None,
+            'cover': cover,
+            'copies': max(copies, 0),
+            'imprint': text('imprint'),
+        }
+
+    def import_chunk(self, chunk, result):
+        cleaned = []
+        for row_number, row in chunk:
+            try:
+                cleaned.append(self.clean_row(row))
+            except ManifestError as error:
+                result.add_error(row_number, str(error))
+        if not cleaned:
+            return
+
+        with transaction.atomic():
+            self.authors.resolve({row['author'] for row in cleaned if row['author']})
+            self.genres.resolve({genre for row in cleaned for genre in row['genres']})
+            self.languages.resolve({row['language'] for row in cleaned if row['language']})
+
+            books = [Book(title=row['title'], summary=row['summary'], url=row['url'],
+                          author_id=self.authors[row['author']] if row['author'] else None,
+                          language_id=self.languages[row['language']] if row['language'] else None,
+                          cover=self.save_cover(row['cover']) if row['cover'] else '')
+                     for row in cleaned]
+            book_ids = self.create_books(books)
+
+            Book.genre.through.objects.bulk_create([
+                Book.genre.through(book_id=book_id, genre_id=self.genres[genre])
+                for book_id, row in zip(book_ids, cleaned) for genre in set(row['genres'])
+            ], batch_size=self.chunk_size)
+            copies = [BookInstance(book_id=book_id, imprint=row['imprint'])
+                      for book_id, row in zip(book_ids, cleaned) for _ in range(row['copies'])]
+            BookInstance.objects.bulk_create(copies, batch_size=self.chunk_size)
+
+            refresh_availability(book_ids)
+            index_books(book_ids)
+            bump_catalog_version(authors={book.author_id for book in books},
+                                 genres={self.genres[genre] for row in cleaned for genre in row['genres']})
+
+        if self.thumbnails:
+            for book in books:
+                if book.cover:
+                    ensure_thumbnails(book.cover.name)
+        result.books += len(books)
+        result.copies += len(copies)
+        result.covers += sum(1 for book in books if book.cover)
+
+    def create_books(self, books):
+        """bulk_create books and return their ids, in order."""
+        if connection.features.can_return_rows_from_bulk_insert:
+            Book.objects.bulk_create(books, batch_size=self.chunk_size)
+            return [book.pk for book in books]
+        if connection.vendor == 'sqlite':
+            # The ids are increasing and the transaction holds the write lock from
+            # the first insert, so the new books are the last len(books) ids
+            Book.objects.bulk_create(books, batch_size=self.chunk_size)
+            book_ids = list(Book.objects.order_by('-pk').values_list('pk', flat=True)[:len(books)])[::-1]
+            for book, book_id in zip(books, book_ids):
+                book.pk = book_id
+            return book_ids
+        # Elsewhere (MySQL) the ids of a bulk insert need not be consecutive: one INSERT
+        # per book, whose post_save side effects the chunk runs again anyway
+        for book in books:
+            book.save()
+        return [book.pk for book in books]
+
+    def cover_path(self, name):
+        """Path of the cover file name of cover_dir, ManifestError for a name outside of cover_dir.
+
+        The manifests are uploaded: an absolute name or a ../ name must not copy any other
+        file readable by the server to the public media storage.
+        """
+        if self.cover_dir is None:
+            raise ManifestError('Cover not found: {}.'.format(name))
+        if os.path.isabs(name) or '..' in name.replace('\\', '/').split('/'):
+            raise ManifestError('Invalid cover name: {}.'.format(name))
+        cover_dir = os.path.realpath(self.cover_dir)
+        # Symbolic links of cover_dir must not lead out of it either
+        path = os.path.realpath(os.path.join(cover_dir, name))
+        if not path.startswith(cover_dir + os.sep):
+            raise ManifestError('Invalid cover name: {}.'.format(name))
+        if not os.path.isfile(path):
+            raise ManifestError('Cover not found: {}.'.format(name))
+        return path
+
+    def save_cover(self, path):
+        """Copy a cover of cover_dir (see cover_path) to the storage, return its storage name."""
+        with open(path, 'rb') as cover:
+            return default_storage.save(Book.cover.field.generate_filename(None, os.path.basename(path)),
+                                        File(cover))
+
+
+def import_manifest(path_or_file, fmt=None, result=None, **options):
+    """Import a manifest from a path or an open binary file, see CatalogImporter for the options.
+
+    result is the ImportResult to fill, it keeps the counts of the chunks committed
+    before an exception.
+    """
+    if isinstance(path_or_file, str):
+        fmt = fmt or manifest_format(path_or_file)
+        with open(path_or_file, encoding='utf-8', newline='') as stream:
+            return CatalogImporter(**options).run(read_manifest(stream, fmt), result)
+    fmt = fmt or manifest_format(getattr(path_or_file, 'name', ''))
+    stream = io.TextIOWrapper(path_or_file, encoding='utf-8', newline='')
+    try:
+        return CatalogImporter(**options).run(read_manifest(stream, fmt), result)
+    finally:
+        stream.detach()
@@ -0,0 +1,112 @@
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from http.client import HTTPConnection
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from catalog.benchmark import measure_load, seed_library
+
+# The catalog pages a visitor browses
+PATHS = ['/', '/catalog/books/', '/catalog/books/?page=2', '/catalog/authors/', '/catalog/genres/']
+
+# Gunicorn command line of every deployment
+SERVERS = {
+    'wsgi': ['locallibrary.wsgi'],
+    'asgi': ['locallibrary.asgi', '--worker-class', 'uvicorn.workers.UvicornWorker'],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            client = HTTPConnection('127.0.0.1', port, timeout=5)
+            client.request('GET', '/')
+            client.getresponse().read()
+            client.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise CommandError('The server on port {} did not start within {} seconds.'.format(port, timeout))
+
+
+class Command(BaseCommand):
+    help = ("Measure the catalog pages under concurrent load, served by gunicorn with the WSGI "
+            "application and with the ASGI application (uvicorn workers), from a throwaway "
+            "SQLite database seeded with a large catalogue.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--servers', nargs='+', choices=sorted(SERVERS), default=['wsgi', 'asgi'],
+                            help="Deployments to measure.")
+        parser.add_argument('--workers', type=int, default=2, help="Gunicorn workers.")
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[8, 32],
+                            help="Concurrent clients of every run.")
+        parser.add_argument('--duration', type=float, default=10, help="Seconds of every run.")
+        parser.add_argument('--books', type=int, default=2000, help="Books of the seeded catalogue.")
+        parser.add_argument('--output', default='benchmark_load.json', help="Path of the JSON results file.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('benchmark_load seeds a throwaway SQLite database, run it with SQLite.')
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'benchmark.sqlite3')
+        connection.settings_dict['TEST']['NAME'] = path
+        setup_test_environment()
+        try:
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                seed_library(options['books'])
+                connection.close()
+                results = []
+                for server in options['servers']:
+                    results.extend(self.measure(server, path, options))
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+        finally:
+            teardown_test_environment()
+            shutil.rmtree(directory, ignore_errors=True)
+
+        with open(options['output'], 'w') as output:
+            json.dump({'workers': options['workers'], 'paths': PATHS, 'results': results}, output, indent=2)
+        for result in results:
+            self.stdout.write('{server:5s} {concurrency:4d} clients {requests:7d} requests {errors:4d} errors '
+                              '{per_second:8.1f} requests/s {latency_ms_median:8.2f} ms median '
+                              '{latency_ms_p99:8.2f} ms p99'.format(**result))
+        self.stdout.write(self.style.SUCCESS('Results written to {}'.format(options['output'])))
+
+    def measure(self, server, path, options):
+        port = free_port()
+        environment = dict(
+            os.environ,
+            DATABASE_URL='sqlite:///{}'.format(path),
+            # Not the slow-request log of every request of the run
+            CATALOG_SLOW_REQUEST_MS='60000',
+        )
+        command = [sys.executable, '-m', 'gunicorn', *SERVERS[server], '--workers', str(options['workers']),
+                   '--bind', '127.0.0.1:{}'.format(port), '--log-level', 'warning']
+        process = subprocess.Popen(command, cwd=settings.BASE_DIR, env=environment)
+        try:
+            wait_for(port)
+            results = []
+            for concurrency in options['concurrency']:
+                result = measure_load('http://127.0.0.1:{}'.format(port), PATHS, concurrency, options['duration'])
+                results.append(dict(result, server=server))
+            return results
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
@@ -0,0 +1,51 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from catalog.benchmark import measure_reservations, seed_reservations
+
+
+class Command(BaseCommand):
+    help = ("Measure the reservation throughput with several concurrent workers in a throwaway "
+            "test database (an SQLite file, so that the workers really share it).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reservations', type=int, default=200, help="Reservations per run.")
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8],
+                            help="Concurrent workers of every run.")
+        parser.add_argument('--no-tuning', action='store_true',
+                            help="Without the SQLite pragmas and retries of catalog/database.py, to compare.")
+        parser.add_argument('--output', default='benchmark_reservations.json', help="Path of the JSON results file.")
+
+    def handle(self, *args, **options):
+        tuning = {} if not options['no_tuning'] else {'CATALOG_SQLITE_PRAGMAS': {}, 'CATALOG_SQLITE_WRITE_RETRIES': 0}
+        directory = tempfile.mkdtemp()
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+        setup_test_environment()
+        try:
+            with override_settings(**tuning):
+                old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+                try:
+                    pairs = seed_reservations(options['reservations'] * len(options['workers']))
+                    results = []
+                    for run, workers in enumerate(options['workers']):
+                        run_pairs = pairs[run * options['reservations']:(run + 1) * options['reservations']]
+                        results.append(measure_reservations(run_pairs, workers))
+                finally:
+                    connection.creation.destroy_test_db(old_name, verbosity=0)
+        finally:
+            teardown_test_environment()
+            shutil.rmtree(directory, ignore_errors=True)
+
+        with open(options['output'], 'w') as output:
+            json.dump({'tuning': not options['no_tuning'], 'results': results}, output, indent=2)
+        for result in results:
+            self.stdout.write('{workers:3d} workers {succeeded:5d}/{reservations:<5d} reserved {locked:4d} locked '
+                              '{per_second:8.1f} reservations/s {latency_ms_median:8.2f} ms median'.format(**result))
+        self.stdout.write(self.style.SUCCESS('Results written to {}'.format(options['output'])))
@@ -0,0 +1,44 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from catalog.benchmark import measure_views, seed_library
+
+
+class Command(BaseCommand):
+    help = ("Seed a synthetic library in a throwaway test database and record query count, "
+            "wall time and response size of every catalog view. Fails if a view is over its query budget.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=2000)
+        parser.add_argument('--copies-per-book', type=int, default=2)
+        parser.add_argument('--users', type=int, default=300)
+        parser.add_argument('--loans', type=int, default=3000)
+        parser.add_argument('--repeat', type=int, default=5, help="Requests per view, timings are the median and max.")
+        parser.add_argument('--output', default='benchmark.json', help="Path of the JSON results file.")
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            targets = seed_library(books=options['books'], copies_per_book=options['copies_per_book'],
+                                   users=options['users'], loans=options['loans'])
+            results = measure_views(Client(), targets, repeat=options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        with open(options['output'], 'w') as output:
+            json.dump({'seed': {key: options[key] for key in ('books', 'copies_per_book', 'users', 'loans')},
+                       'results': results}, output, indent=2)
+
+        for result in results:
+            self.stdout.write('{view:32} {queries:4d}/{query_budget:<4d} queries {wall_ms_median:8.2f} ms '
+                              '{response_bytes:8d} bytes'.format(**result))
+        over_budget = [result['view'] for result in results if result['over_budget']]
+        if over_budget:
+            raise CommandError('Over query budget: {}'.format(', '.join(over_budget)))
+        self.stdout.write(self.style.SUCCESS('Results written to {}'.format(options['output'])))
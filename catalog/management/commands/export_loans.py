@@ -0,0 +1,44 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.exports import CHUNK_SIZE, FORMATS, STATUS_CHOICES, export_chunks, export_queryset
+
+
+def iso_date(value):
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise CommandError('Invalid date: {}, use YYYY-MM-DD.'.format(value))
+
+
+class Command(BaseCommand):
+    help = "Stream the loan history joined with copies, books and borrowers as CSV or JSON Lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--since', type=iso_date, default=None, help="Loans started on or after YYYY-MM-DD.")
+        parser.add_argument('--until', type=iso_date, default=None, help="Loans started on or before YYYY-MM-DD.")
+        parser.add_argument('--status', action='append', choices=[status for status, label in STATUS_CHOICES],
+                            default=[], help="Only export loans with this status, can be repeated.")
+        parser.add_argument('--gzip', action='store_true', help="Gzip the output.")
+        parser.add_argument('--output', '-o', default=None, help="Output file, standard output by default.")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Rows fetched at a time.")
+
+    def handle(self, *args, **options):
+        loans = export_queryset(since=options['since'], until=options['until'], statuses=options['status'])
+        chunks = export_chunks(loans, fmt=options['format'], compress=options['gzip'],
+                               chunk_size=options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'wb') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+        elif hasattr(self.stdout, 'buffer'):
+            for chunk in chunks:
+                self.stdout.buffer.write(chunk)
+            self.stdout.flush()
+        elif options['gzip']:
+            raise CommandError('Use --output to write gzipped output.')
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk.decode(), ending='')
@@ -0,0 +1,33 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from catalog.caching import bump_book_tiles, bump_catalog_version
+from catalog.models import Book
+from catalog.thumbnails import ensure_thumbnails
+
+
+class Command(BaseCommand):
+    help = "Build the missing thumbnails of every book cover, in parallel."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Number of worker processes, defaults to the number of CPUs.")
+        parser.add_argument('--force', action='store_true', help="Rebuild thumbnails that already exist.")
+
+    def handle(self, *args, **options):
+        covers = list(Book.objects.exclude(cover='').order_by().values_list('cover', flat=True).distinct())
+        # Workers only touch the storage, do not share the database connection with them
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=django.setup) as executor:
+            built = [cover for cover, done in zip(
+                covers, executor.map(ensure_thumbnails, covers, [options['force']] * len(covers), chunksize=8))
+                if done]
+        # Tiles and pages cached with the original cover now have thumbnails
+        book_ids = list(Book.objects.filter(cover__in=built).values_list('pk', flat=True))
+        bump_book_tiles(*book_ids)
+        bump_catalog_version(books=book_ids)
+        self.stdout.write(self.style.SUCCESS(
+            'Built thumbnails for {} of {} covers.'.format(len(built), len(covers))))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.importer import CHUNK_SIZE, import_manifest
+
+
+class Command(BaseCommand):
+    help = "Import books, copies and covers from a CSV or JSON Lines manifest, see catalog/importer.py."
+
+    def add_arguments(self, parser):
+        parser.add_argument('manifest', help="Path of the .csv or .jsonl manifest.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default=None,
+                            help="Manifest format, guessed from the extension by default.")
+        parser.add_argument('--cover-dir', default=None, help="Directory of the cover files named in the manifest.")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Rows written per transaction.")
+        parser.add_argument('--skip-thumbnails', action='store_true',
+                            help="Do not build the cover thumbnails, run generate_thumbnails later.")
+
+    def handle(self, *args, **options):
+        try:
+            result = import_manifest(options['manifest'], fmt=options['format'], cover_dir=options['cover_dir'],
+                                     chunk_size=options['chunk_size'], thumbnails=not options['skip_thumbnails'])
+        except (OSError, ValueError) as error:
+            raise CommandError(error)
+        for row_number, message in result.errors:
+            self.stderr.write('Row {}: {}'.format(row_number, message))
+        if result.error_count > len(result.errors):
+            self.stderr.write('... and {} more errors.'.format(result.error_count - len(result.errors)))
+        self.stdout.write(self.style.SUCCESS('Imported {}.'.format(result)))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from catalog.models import BookInstance, refresh_availability
+
+
+class Command(BaseCommand):
+    help = "Rebuild the book availability index (open loan of each copy, available copies of each book) from the Loan history."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            refresh_availability()
+        self.stdout.write(self.style.SUCCESS(
+            'Availability rebuilt: {} of {} copies available.'.format(
+                BookInstance.objects.filter(current_loan__isnull=True).count(),
+                BookInstance.objects.count(),
+            )
+        ))
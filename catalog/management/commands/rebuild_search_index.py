@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from catalog.models import Book
+from catalog.search import index_books, search_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of the catalog (FTS5 table on SQLite, tsvector column on PostgreSQL)."
+
+    def handle(self, *args, **options):
+        backend = search_backend()
+        if backend == 'like':
+            self.stdout.write(self.style.WARNING('No search index on this database, searches use LIKE queries.'))
+            return
+        with transaction.atomic():
+            index_books()
+        self.stdout.write(self.style.SUCCESS(
+            'Search index ({}) rebuilt for {} books.'.format(backend, Book.objects.count())))
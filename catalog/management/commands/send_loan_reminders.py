@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from catalog.reminders import CHUNK_SIZE, send_reminders
+
+
+class Command(BaseCommand):
+    help = "Email every family a digest of its overdue loans and of the loans due soon, run it daily."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.CATALOG_REMINDER_DAYS,
+                            help="Remind the loans due within this number of days.")
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Families processed at a time.")
+        parser.add_argument('--dry-run', action='store_true', help="Count the emails without sending them.")
+
+    def handle(self, *args, **options):
+        result = send_reminders(days=options['days'], chunk_size=options['chunk_size'], dry_run=options['dry_run'])
+        self.stdout.write(self.style.SUCCESS('{} {}.'.format('Would send' if options['dry_run'] else 'Sent', result)))
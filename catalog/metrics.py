@@ -0,0 +1,81 @@
+"""Prometheus metrics of the site, served at /metrics.
+
+InstrumentationMiddleware observes the latency and the number of queries of every
+request in histograms labelled with the URL name. The loan gauges are counted in the
+database when /metrics is scraped, so every worker reports the same values.
+
+Under gunicorn, PROMETHEUS_MULTIPROC_DIR is set by gunicorn.conf.py before the workers
+start: every worker writes its samples to memory-mapped files of that directory and
+/metrics aggregates the files of all the workers, whichever worker serves the scrape.
+Without it (runserver, tests) the metrics of the single process are served.
+
+/metrics is only served to the requests bearing CATALOG_METRICS_TOKEN and to the
+CATALOG_METRICS_ALLOWED_IPS (none by default, REMOTE_ADDR is the proxy's address behind
+one): it shows the traffic of every page and runs a query per scrape.
+"""
+import datetime
+import hmac
+import os
+
+from django.conf import settings
+
+from django.db.models import Count, Q
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.multiprocess import MultiProcessCollector
+
+from .models import Loan
+
+# Label of the requests that match no URL pattern, the paths of 404s are not labels
+UNRESOLVED = '<unresolved>'
+
+REQUEST_SECONDS = Histogram(
+    'catalog_request_duration_seconds', 'Time to respond to a request, by URL name.', ['view', 'method'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+REQUEST_QUERIES = Histogram(
+    'catalog_request_queries', 'SQL queries run by a request, by URL name.', ['view', 'method'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100))
+
+
+def observe_request(request, seconds, queries):
+    match = getattr(request, 'resolver_match', None)
+    view = match.view_name if match else UNRESOLVED
+    REQUEST_SECONDS.labels(view, request.method).observe(seconds)
+    REQUEST_QUERIES.labels(view, request.method).observe(queries)
+
+
+class LoanCollector:
+    """Gauges of the open loans, reservations and overdue loans, counted in one query per scrape."""
+
+    def collect(self):
+        open_loans = Loan.objects.filter(return_date__isnull=True)
+        counts = open_loans.aggregate(
+            loans=Count('pk', filter=Q(loan_date__isnull=False)),
+            reservations=Count('pk', filter=Q(loan_date__isnull=True)),
+            overdue=Count('pk', filter=Q(loan_date__isnull=False, due_date__lt=datetime.date.today())),
+        )
+        yield GaugeMetricFamily('catalog_open_loans', 'Copies on loan.', value=counts['loans'])
+        yield GaugeMetricFamily('catalog_open_reservations', 'Copies reserved and not yet lent.',
+                                value=counts['reservations'])
+        yield GaugeMetricFamily('catalog_overdue_loans', 'Copies on loan past their due date.',
+                                value=counts['overdue'])
+
+
+def may_scrape(request):
+    """Whether the request may read /metrics, see the module docstring."""
+    if request.META.get('REMOTE_ADDR') in settings.CATALOG_METRICS_ALLOWED_IPS:
+        return True
+    token = settings.CATALOG_METRICS_TOKEN
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    return bool(token) and hmac.compare_digest(authorization.encode(), 'Bearer {}'.format(token).encode())
+
+
+def render_metrics():
+    """(body, content type) of the metrics of every worker and of the loan gauges."""
+    registry = CollectorRegistry()
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        MultiProcessCollector(registry)
+    else:
+        registry.register(REGISTRY)
+    registry.register(LoanCollector())
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,173 @@
+"""Per-request instrumentation: Server-Timing headers and a slow-request log.
+
+Every request is timed and its SQL queries are counted and timed by record_query,
+an execute_wrapper installed on every database connection that records into the
+QueryRecorder of the current request (a context variable, so that it also follows
+the queries that ASGI requests run in sync_to_async threads). The template rendering
+is timed by TimedDjangoTemplates, the template backend of the site, so that every view
+is covered: TemplateResponse views, the views calling render() and the error pages.
+The numbers are sent in a Server-Timing header (shown by the network panel of the
+browsers).
+
+Requests slower than CATALOG_SLOW_REQUEST_MS are logged as JSON to the
+catalog.performance logger with their most repeated SQL statements, which is where
+N+1 query patterns show up. The same numbers feed the Prometheus histograms of
+catalog/metrics.py.
+"""
+import json
+import logging
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.template.backends.django import DjangoTemplates, Template
+from django.utils.deprecation import MiddlewareMixin
+
+from .metrics import observe_request
+
+logger = logging.getLogger('catalog.performance')
+
+# Repeated statements reported in the slow-request log
+TOP_REPEATED_QUERIES = 5
+
+
+class QueryRecorder:
+    """execute_wrapper counting and timing the queries, grouped by SQL text (parameters excluded)."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = defaultdict(lambda: [0, 0.0])
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.seconds += duration
+            statement = self.statements[sql]
+            statement[0] += 1
+            statement[1] += duration
+
+    def repeated(self, limit=TOP_REPEATED_QUERIES):
+        """The statements run more than once, most repeated first, as dicts."""
+        repeated = sorted(((count, seconds, sql) for sql, (count, seconds) in self.statements.items() if count > 1),
+                          key=lambda statement: (-statement[0], -statement[1]))
+        return [{'sql': sql, 'count': count, 'ms': round(seconds * 1000, 2)}
+                for count, seconds, sql in repeated[:limit]]
+
+
+_recorder = ContextVar('catalog_query_recorder', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    recorder = _recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    # The wrapper stays on the connection object when the database connection is reopened
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class RenderTimer:
+    """Time spent rendering the templates of a request, None until one is rendered."""
+
+    def __init__(self):
+        self.seconds = None
+        # Templates rendered while another one renders are timed with it
+        self.depth = 0
+
+
+_render_timer = ContextVar('catalog_render_timer', default=None)
+
+
+class TimedTemplate(Template):
+    """Template recording its rendering time in the RenderTimer of the current request."""
+
+    def render(self, context=None, request=None):
+        timer = _render_timer.get()
+        if timer is None or timer.depth:
+            return super().render(context, request)
+        timer.depth += 1
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            timer.seconds = (timer.seconds or 0.0) + time.perf_counter() - started
+            timer.depth -= 1
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, with the rendering times recorded for InstrumentationMiddleware."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+class InstrumentationMiddleware(MiddlewareMixin):
+    """Server-Timing headers (total, sql, render) and the slow-request log, see the module docstring.
+
+    A MiddlewareMixin, so that it runs in sync (WSGI) and async (ASGI) mode. In async mode
+    Django 3.2 still runs process_request and process_response in the thread of the views
+    (sync_to_async, thread_sensitive): a thread hop on the way in and one on the way out.
+    """
+
+    def process_request(self, request):
+        request._query_recorder = QueryRecorder()
+        _recorder.set(request._query_recorder)
+        request._render_timer = RenderTimer()
+        _render_timer.set(request._render_timer)
+        request._started = time.perf_counter()
+
+    def process_response(self, request, response):
+        recorder = getattr(request, '_query_recorder', None)
+        if recorder is None:
+            # A middleware above answered before process_request
+            return response
+        # Not a reset(token): in async mode the hooks run in different contexts
+        _recorder.set(None)
+        _render_timer.set(None)
+        total = time.perf_counter() - request._started
+        observe_request(request, total, recorder.count)
+
+        if settings.CATALOG_SERVER_TIMING:
+            metrics = [
+                'total;dur={:.1f}'.format(total * 1000),
+                'sql;dur={:.1f};desc="{} queries"'.format(recorder.seconds * 1000, recorder.count),
+            ]
+            if request._render_timer.seconds is not None:
+                metrics.append('render;dur={:.1f}'.format(request._render_timer.seconds * 1000))
+            response['Server-Timing'] = ', '.join(metrics)
+
+        if total * 1000 >= settings.CATALOG_SLOW_REQUEST_MS:
+            self.log_slow_request(request, response, total, recorder)
+        return response
+
+    def log_slow_request(self, request, response, total, recorder):
+        match = getattr(request, 'resolver_match', None)
+        render_seconds = request._render_timer.seconds
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': match.view_name if match else None,
+            'status': response.status_code,
+            'ms': round(total * 1000, 1),
+            'sql_count': recorder.count,
+            'sql_ms': round(recorder.seconds * 1000, 1),
+            'render_ms': round(render_seconds * 1000, 1) if render_seconds is not None else None,
+            'repeated_sql': recorder.repeated(),
+        }
+        logger.warning('slow request %s', json.dumps(record), extra={'request_metrics': record})
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.8 on 2026-10-18 05:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_availability(apps, schema_editor):
+    Book = apps.get_model('catalog', 'Book')
+    BookInstance = apps.get_model('catalog', 'BookInstance')
+    Loan = apps.get_model('catalog', 'Loan')
+
+    open_loan = Loan.objects.filter(book_instance=OuterRef('pk'), return_date__isnull=True).order_by('pk')
+    BookInstance.objects.update(current_loan=Subquery(open_loan.values('pk')[:1]))
+    available = (BookInstance.objects.filter(book=OuterRef('pk'), current_loan__isnull=True)
+                 .order_by().values('book').annotate(count=Count('pk')).values('count'))
+    Book.objects.update(available_copies=Coalesce(Subquery(available), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0006_auto_20211024_0837'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='available_copies',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='bookinstance',
+            name='current_loan',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='catalog.loan'),
+        ),
+        migrations.RunPython(populate_availability, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.8 on 2026-10-18 05:50
+
+import datetime
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def close_duplicate_open_loans(apps, schema_editor):
+    """Close the open loans of a copy but the oldest, which 0007 made its current loan.
+
+    Before the constraint, concurrent reservations could open several loans of the same copy.
+    """
+    Loan = apps.get_model('catalog', 'Loan')
+
+    open_loans = Loan.objects.filter(return_date__isnull=True)
+    older = open_loans.filter(book_instance=OuterRef('book_instance'), pk__lt=OuterRef('pk'))
+    open_loans.filter(Exists(older)).update(return_date=datetime.date.today())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0007_availability_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_open_loans, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='loan',
+            constraint=models.UniqueConstraint(condition=models.Q(('return_date__isnull', True)), fields=('book_instance',), name='catalog_loan_one_open_per_copy'),
+        ),
+    ]
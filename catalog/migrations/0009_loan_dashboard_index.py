@@ -0,0 +1,17 @@
+# Generated by Django 3.2.8 on 2026-10-18 05:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0008_loan_one_open_per_copy'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['return_date', 'loan_date', 'due_date'], name='catalog_loan_ret_loan_due_idx'),
+        ),
+    ]
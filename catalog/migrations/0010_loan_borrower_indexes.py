@@ -0,0 +1,21 @@
+# Generated by Django 3.2.8 on 2026-10-18 05:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0009_loan_dashboard_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(condition=models.Q(('return_date__isnull', True)), fields=['borrower', 'reserved_date'], name='catalog_loan_open_borrower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['borrower', 'due_date'], name='catalog_loan_borrower_due_idx'),
+        ),
+    ]
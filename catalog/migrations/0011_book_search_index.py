@@ -0,0 +1,57 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+# Snapshots of catalog.search.SQLITE_INDEX_SQL and POSTGRES_INDEX_SQL at the time of this migration
+SQLITE_POPULATE_SQL = (
+    "INSERT INTO catalog_book_fts (rowid, title, summary, author, genre) "
+    "SELECT b.id, b.title, b.summary, coalesce(a.first_name || ' ' || a.last_name, ''), "
+    "coalesce((SELECT group_concat(g.name, ' ') FROM catalog_genre g "
+    "JOIN catalog_book_genre bg ON bg.genre_id = g.id WHERE bg.book_id = b.id), '') "
+    "FROM catalog_book b LEFT JOIN catalog_author a ON a.id = b.author_id"
+)
+
+POSTGRES_POPULATE_SQL = (
+    "UPDATE catalog_book b SET search_vector = "
+    "setweight(to_tsvector('italian', coalesce(b.title, '')), 'A') || "
+    "setweight(to_tsvector('italian', coalesce((SELECT a.first_name || ' ' || a.last_name "
+    "FROM catalog_author a WHERE a.id = b.author_id), '')), 'B') || "
+    "setweight(to_tsvector('italian', coalesce((SELECT string_agg(g.name, ' ') FROM catalog_genre g "
+    "JOIN catalog_book_genre bg ON bg.genre_id = g.id WHERE bg.book_id = b.id), '')), 'C') || "
+    "setweight(to_tsvector('italian', coalesce(b.summary, '')), 'D')"
+)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE catalog_book_fts USING fts5("
+                "title, summary, author, genre, tokenize='unicode61 remove_diacritics 2')")
+        except OperationalError:
+            # SQLite built without FTS5, catalog.search falls back to LIKE queries
+            return
+        schema_editor.execute(SQLITE_POPULATE_SQL)
+    elif vendor == 'postgresql':
+        schema_editor.execute('ALTER TABLE catalog_book ADD COLUMN search_vector tsvector')
+        schema_editor.execute('CREATE INDEX catalog_book_search_vector_idx ON catalog_book USING GIN (search_vector)')
+        schema_editor.execute(POSTGRES_POPULATE_SQL)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS catalog_book_fts')
+    elif vendor == 'postgresql':
+        schema_editor.execute('ALTER TABLE catalog_book DROP COLUMN IF EXISTS search_vector')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0010_loan_borrower_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
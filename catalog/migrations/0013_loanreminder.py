@@ -0,0 +1,28 @@
+# Generated by Django 3.2.8 on 2026-10-18 06:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0012_list_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoanReminder',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('d', 'Due soon'), ('o', 'Overdue')], max_length=1)),
+                ('due_date', models.DateField()),
+                ('sent_at', models.DateTimeField(auto_now_add=True)),
+                ('loan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reminders', to='catalog.loan')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='loanreminder',
+            constraint=models.UniqueConstraint(fields=('loan', 'kind', 'due_date'), name='catalog_loanreminder_once'),
+        ),
+    ]
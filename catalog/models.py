@@ -1,9 +1,12 @@
 from django.db import models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from datetime import date, timedelta
 
 # Create your models here.
 
 from django.urls import reverse  # To generate URLS by reversing URL patterns
+from django.utils.functional import cached_property
 
 from django.contrib.auth.models import AbstractUser
 
@@ -34,6 +37,11 @@ class Genre(models.Model):
         help_text="Enter a book genre (e.g. Science Fiction, French Poetry etc.)"
         )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['name'], name='catalog_genre_name_idx'),
+        ]
+
     def get_absolute_url(self):
         return reverse('genre-detail', args=[str(self.id)])
 
@@ -67,8 +75,15 @@ class Book(models.Model):
     cover = models.ImageField(upload_to='covers')
     url = models.URLField(null=True)
 
+    # Denormalized number of copies without an open loan, maintained by refresh_availability()
+    available_copies = models.PositiveIntegerField(default=0, editable=False)
+
     class Meta:
         ordering = ['title', 'author']
+        indexes = [
+            # Keyset pagination of BookListView
+            models.Index(fields=['title', 'author'], name='catalog_book_title_author_idx'),
+        ]
 
     def display_genre(self):
         """Creates a string for the Genre. This is required to display genre in Admin."""
@@ -86,10 +101,7 @@ class Book(models.Model):
 
     @property
     def is_available(self):
-        for bookinstance in self.bookinstance_set.all():
-            if bookinstance.status == "Available":
-                return True
-        return False
+        return self.available_copies > 0
 
 
 
@@ -101,6 +113,9 @@ class BookInstance(models.Model):
                           help_text="Unique ID for this particular book across whole library")
     book = models.ForeignKey('Book', on_delete=models.RESTRICT, null=True)
     imprint = models.CharField(max_length=200)
+    # Denormalized pointer to the open Loan (if any), maintained by refresh_availability()
+    current_loan = models.ForeignKey('Loan', on_delete=models.SET_NULL, null=True, blank=True,
+                                     editable=False, related_name='+')
 
     @property
     def status(self):
@@ -114,8 +129,15 @@ class BookInstance(models.Model):
         else:
             return "Unknown"
 
-    @property
+    @cached_property
     def loan(self):
+        """The open Loan of this copy, or None.
+
+        Uses the open_loans list when the caller prefetched it (see BookDetailView),
+        the result is cached on the instance so status and loan cost at most one query.
+        """
+        if hasattr(self, 'open_loans'):
+            return self.open_loans[0] if self.open_loans else None
         try:
             return self.loan_set.get(return_date__isnull=True)
         except Loan.DoesNotExist:
@@ -127,12 +149,33 @@ class BookInstance(models.Model):
 
 class Loan(models.Model):
     DEFAULT_LOAN_DURATION = timedelta(days=14)
+    # Open loans counted against User.max_books: reservations, also once checked out
+    COUNTS_AGAINST_QUOTA = models.Q(reserved_date__isnull=False, return_date__isnull=True)
     reserved_date = models.DateField(blank=True, null=True)
     loan_date = models.DateField(blank=True, null=True)
     due_date = models.DateField(blank=True, null=True)
     return_date = models.DateField(blank=True, null=True)
     borrower = models.ForeignKey(User, on_delete=models.DO_NOTHING)
     book_instance = models.ForeignKey(BookInstance, on_delete=models.DO_NOTHING)
+
+    class Meta:
+        constraints = [
+            # A copy can only be reserved or on loan to one borrower at a time,
+            # this is also the partial index used by BookInstance.loan
+            models.UniqueConstraint(fields=['book_instance'], condition=models.Q(return_date__isnull=True),
+                                    name='catalog_loan_one_open_per_copy'),
+        ]
+        indexes = [
+            # Sections of the librarian dashboard (loans, reservations, past loans),
+            # open loans (index view) and LoanReservationFilter
+            models.Index(fields=['return_date', 'loan_date', 'due_date'], name='catalog_loan_ret_loan_due_idx'),
+            # Open reservations of a borrower (User.max_books check of reserve_book)
+            models.Index(fields=['borrower', 'reserved_date'], condition=models.Q(return_date__isnull=True),
+                         name='catalog_loan_open_borrower_idx'),
+            # Loans of a borrower by due date (LoanedBooksByUserListView)
+            models.Index(fields=['borrower', 'due_date'], name='catalog_loan_borrower_due_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if self.loan_date is not None and self.due_date is None:
             self.due_date = self.loan_date + self.DEFAULT_LOAN_DURATION
@@ -154,6 +197,49 @@ class Loan(models.Model):
         """String for representing the Model object."""
         return '{0} - {1}'.format(self.book_instance.book.title, self.borrower.username)
 
+
+class LoanReminder(models.Model):
+    """A due-soon or overdue reminder sent for a loan, so that send_loan_reminders sends it once per due date."""
+    DUE_SOON = 'd'
+    OVERDUE = 'o'
+    KIND_CHOICES = (
+        (DUE_SOON, 'Due soon'),
+        (OVERDUE, 'Overdue'),
+    )
+    loan = models.ForeignKey(Loan, on_delete=models.CASCADE, related_name='reminders')
+    kind = models.CharField(max_length=1, choices=KIND_CHOICES)
+    # A renewal moves the due date and makes the loan eligible for new reminders
+    due_date = models.DateField()
+    sent_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['loan', 'kind', 'due_date'], name='catalog_loanreminder_once'),
+        ]
+
+    def __str__(self):
+        return '{0} reminder of {1}'.format(self.get_kind_display(), self.loan_id)
+
+def refresh_availability(books=None):
+    """Rebuild the availability index (BookInstance.current_loan and Book.available_copies).
+
+    books can be an iterable of Book ids or a queryset of ids to limit the update,
+    by default the whole catalog is rebuilt. Runs two UPDATE queries whatever the size.
+    """
+    copies = BookInstance.objects.all()
+    titles = Book.objects.all()
+    if books is not None:
+        copies = copies.filter(book__in=books)
+        titles = titles.filter(pk__in=books)
+
+    open_loan = Loan.objects.filter(book_instance=OuterRef('pk'), return_date__isnull=True).order_by('pk')
+    copies.update(current_loan=Subquery(open_loan.values('pk')[:1]))
+
+    available = (BookInstance.objects.filter(book=OuterRef('pk'), current_loan__isnull=True)
+                 .order_by().values('book').annotate(count=Count('pk')).values('count'))
+    titles.update(available_copies=Coalesce(Subquery(available), 0))
+
+
 class Author(models.Model):
     """Model representing an author."""
     first_name = models.CharField(max_length=100)
@@ -161,6 +247,9 @@ class Author(models.Model):
 
     class Meta:
         ordering = ['last_name', 'first_name']
+        indexes = [
+            models.Index(fields=['last_name', 'first_name'], name='catalog_author_name_idx'),
+        ]
 
     def get_absolute_url(self):
         """Returns the url to access a particular author instance."""
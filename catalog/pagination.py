@@ -0,0 +1,187 @@
+"""Keyset (cursor) pagination for the catalog list views.
+
+Pages are read with WHERE (key) > (last key of the previous page) ORDER BY key LIMIT n,
+so a page costs the same on the first and on the thousandth page and no COUNT(*) is run.
+The position is carried by an opaque cursor query parameter; the ?page= numbers of the
+OFFSET paginator keep working for existing links.
+
+EstimatedCountPaginator spares the admin changelists a COUNT(*) of large tables.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+class CursorPage:
+    """A page of objects and the cursors of its neighbours, mirrors the parts of Page used by the templates."""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<CursorPage of {} objects>'.format(len(self.object_list))
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """Paginate a queryset on key_fields, ascending, the last of which must be unique (usually 'id').
+
+    Nullable fields keep the NULLs where the database puts them in an ascending index
+    (first on SQLite and MySQL, last on PostgreSQL and Oracle), so that the pages are
+    read in the order of the indexes of the key fields.
+    """
+
+    def __init__(self, queryset, key_fields, per_page):
+        self.queryset = queryset
+        self.fields = [queryset.model._meta.get_field(name) for name in key_fields]
+        self.per_page = per_page
+        self.nulls_first = not connections[queryset.db].features.nulls_order_largest
+
+    @property
+    def ordering(self):
+        return [field.attname for field in self.fields]
+
+    def encode_cursor(self, direction, obj):
+        values = [getattr(obj, field.attname) for field in self.fields]
+        data = json.dumps([direction, [field.get_prep_value(value) for field, value in zip(self.fields, values)]],
+                          separators=(',', ':'), default=str)
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            direction, values = json.loads(data)
+            if direction not in (NEXT, PREVIOUS) or len(values) != len(self.fields):
+                raise ValueError
+            return direction, [field.to_python(value) for field, value in zip(self.fields, values)]
+        except (ValueError, TypeError, ValidationError):
+            raise Http404('Invalid cursor.')
+
+    def _beyond(self, values, after):
+        """Q of the rows after (or before) the key values, in the order of self.ordering."""
+        condition = Q(pk__in=[])
+        equal = Q()
+        for field, value in zip(self.fields, values):
+            name = field.attname
+            if value is None:
+                # Every value not NULL is on one side of NULL, nothing is on the other
+                beyond = Q(**{name + '__isnull': False}) if after == self.nulls_first else Q(pk__in=[])
+                same = Q(**{name + '__isnull': True})
+            else:
+                beyond = Q(**{name + ('__gt' if after else '__lt'): value})
+                if field.null and after != self.nulls_first:
+                    beyond |= Q(**{name + '__isnull': True})
+                same = Q(**{name: value})
+            condition |= equal & beyond
+            equal &= same
+        return condition
+
+    def get_page(self, cursor=None):
+        """The page at cursor (the first page when None), in one query."""
+        queryset = self.queryset.order_by(*self.ordering)
+        if not cursor:
+            objects = list(queryset[:self.per_page + 1])
+            has_next, has_previous = len(objects) > self.per_page, False
+            objects = objects[:self.per_page]
+        else:
+            direction, values = self.decode_cursor(cursor)
+            if direction == NEXT:
+                objects = list(queryset.filter(self._beyond(values, after=True))[:self.per_page + 1])
+                has_next, has_previous = len(objects) > self.per_page, True
+                objects = objects[:self.per_page]
+            else:
+                objects = list(queryset.reverse().filter(self._beyond(values, after=False))[:self.per_page + 1])
+                has_next, has_previous = True, len(objects) > self.per_page
+                objects = objects[:self.per_page][::-1]
+        return CursorPage(
+            objects,
+            next_cursor=self.encode_cursor(NEXT, objects[-1]) if has_next and objects else None,
+            previous_cursor=self.encode_cursor(PREVIOUS, objects[0]) if has_previous and objects else None,
+        )
+
+
+class CursorPaginationMixin:
+    """ListView mixin paginating on cursor_fields with the ?cursor= parameter.
+
+    Requests with a ?page= number keep the OFFSET paginator, with the same ordering.
+    """
+    cursor_fields = ('id',)
+    cursor_kwarg = 'cursor'
+
+    def get_ordering(self):
+        return CursorPaginator(self.model.objects.none(), self.cursor_fields, None).ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.page_kwarg in self.kwargs or self.page_kwarg in self.request.GET:
+            return super().paginate_queryset(queryset, page_size)
+        page = CursorPaginator(queryset, self.cursor_fields, page_size).get_page(
+            self.request.GET.get(self.cursor_kwarg))
+        return None, page, page.object_list, page.has_other_pages()
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator counting large unfiltered tables from the database statistics instead of COUNT(*).
+
+    Used by the admin changelists. Filtered querysets and tables smaller than
+    ESTIMATE_THRESHOLD rows are counted exactly.
+    """
+    ESTIMATE_THRESHOLD = 10000
+
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list)
+        if estimate is not None and estimate >= self.ESTIMATE_THRESHOLD:
+            return estimate
+        return super().count
+
+
+def estimated_count(queryset):
+    """Number of rows of the table of an unfiltered queryset according to the planner, None when unknown.
+
+    PostgreSQL keeps it up to date in pg_class (autovacuum), SQLite only after ANALYZE (sqlite_stat1).
+    """
+    if not hasattr(queryset, 'query') or queryset.query.where or queryset.query.distinct:
+        return None
+    table = queryset.model._meta.db_table
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        sql, params = 'SELECT reltuples FROM pg_class WHERE relname = %s', [table]
+    elif connection.vendor == 'sqlite':
+        # The first number of stat is the number of rows of the table
+        sql, params = "SELECT CAST(stat AS INTEGER) FROM sqlite_stat1 WHERE tbl = %s LIMIT 1", [table]
+    else:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
@@ -0,0 +1,98 @@
+"""Digest emails of the overdue loans and of the loans due within a few days.
+
+Loans are selected in SQL on due_date and return_date, and families are processed in
+chunks: every chunk loads its loans in one query, then each family gets its email
+through a single mail connection and, right after it is sent, a LoanReminder per loan.
+Loans with a reminder of the same kind for their current due date are left out, so
+running the command again, or after an interruption, does not send the same reminder
+twice. No transaction is held open while the mail server is talked to.
+"""
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+from django.core import mail
+from django.db.models import Case, Exists, OuterRef, Value, When
+from django.template.loader import render_to_string
+
+from .models import Loan, LoanReminder
+
+CHUNK_SIZE = 200
+
+
+class ReminderResult:
+    """Counts of a reminder run."""
+
+    def __init__(self):
+        self.emails = 0
+        self.loans = 0
+        self.without_email = 0
+
+    def __str__(self):
+        text = '{} emails for {} loans'.format(self.emails, self.loans)
+        if self.without_email:
+            text += ', {} families without email address'.format(self.without_email)
+        return text
+
+
+def pending_reminders(today=None, days=None):
+    """Open loans overdue or due within days with no reminder of their kind yet, annotated with the kind."""
+    today = today or datetime.date.today()
+    days = settings.CATALOG_REMINDER_DAYS if days is None else days
+    kind = Case(When(due_date__lt=today, then=Value(LoanReminder.OVERDUE)), default=Value(LoanReminder.DUE_SOON))
+    sent = LoanReminder.objects.filter(loan=OuterRef('pk'), kind=OuterRef('reminder_kind'),
+                                       due_date=OuterRef('due_date'))
+    return (Loan.objects
+            .filter(return_date__isnull=True, loan_date__isnull=False,
+                    due_date__lte=today + datetime.timedelta(days=days))
+            .annotate(reminder_kind=kind)
+            .filter(~Exists(sent)))
+
+
+def send_reminders(today=None, days=None, chunk_size=CHUNK_SIZE, dry_run=False):
+    """Send the pending reminders, chunk_size families at a time, and return a ReminderResult."""
+    today = today or datetime.date.today()
+    result = ReminderResult()
+    loans = pending_reminders(today, days)
+    borrower_ids = list(loans.order_by('borrower_id').values_list('borrower_id', flat=True).distinct())
+    connection = None if dry_run else mail.get_connection()
+    try:
+        if connection is not None:
+            # Kept open for all the messages, send_messages() would open one per message
+            connection.open()
+        for start in range(0, len(borrower_ids), chunk_size):
+            chunk = (loans.filter(borrower_id__in=borrower_ids[start:start + chunk_size])
+                     .select_related('borrower', 'book_instance__book').order_by('borrower_id', 'due_date'))
+            _send_chunk(chunk, today, connection, result)
+    finally:
+        if connection is not None:
+            connection.close()
+    return result
+
+
+def _send_chunk(loans, today, connection, result):
+    by_borrower = defaultdict(list)
+    for loan in loans:
+        by_borrower[loan.borrower].append(loan)
+
+    for borrower, borrower_loans in by_borrower.items():
+        if not borrower.email:
+            result.without_email += 1
+            continue
+        context = {
+            'borrower': borrower,
+            'overdue': [loan for loan in borrower_loans if loan.reminder_kind == LoanReminder.OVERDUE],
+            'due_soon': [loan for loan in borrower_loans if loan.reminder_kind == LoanReminder.DUE_SOON],
+            'today': today,
+        }
+        subject = ' '.join(render_to_string('catalog/email/loan_reminder_subject.txt', context).split())
+        body = render_to_string('catalog/email/loan_reminder_body.txt', context)
+        if connection is not None:
+            connection.send_messages([mail.EmailMessage(subject, body, to=[borrower.email])])
+            # Recorded as soon as the email is out, in a transaction of its own: if a later
+            # email fails, the next run does not send this family the same reminder again
+            LoanReminder.objects.bulk_create(
+                [LoanReminder(loan=loan, kind=loan.reminder_kind, due_date=loan.due_date) for loan in borrower_loans],
+                ignore_conflicts=True)
+        result.emails += 1
+        result.loans += len(borrower_loans)
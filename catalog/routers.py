@@ -0,0 +1,102 @@
+"""Database router sending the catalog browsing reads to a read replica.
+
+Reads of Book, Author, Genre and Language (the catalog list and detail pages) go to
+the CATALOG_REPLICA_DATABASE alias when it is configured (DATABASE_REPLICA_URL), every
+other read and every write goes to the primary.
+
+A replica lags behind the primary: after a request writes to a catalog model, the rest
+of the request reads from the primary. After a write of a loan (a reservation, a loan,
+a return...) or of a model the catalog pages show (STICKY_MODELS), the requests of the
+same browser for the next CATALOG_REPLICA_LAG_SECONDS read from the primary too, so that
+families see their own reservations. A login, which saves User.last_login, does not. PrimaryStickinessMiddleware carries this with a
+cookie, the state of the current request lives in context variables.
+
+These writes also make every other request read from the primary for the same time (a
+stamp in the cache, moved when the write commits): the caches and the catalog versions
+invalidated by the write are refilled from the primary, not from rows of before the write
+still on the replica. Reads inside a transaction of the primary read the primary too.
+"""
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils.deprecation import MiddlewareMixin
+
+REPLICA_MODELS = {'book', 'author', 'genre', 'language'}
+# Writes after which the browser and every other request read from the primary for a while
+STICKY_MODELS = REPLICA_MODELS | {'bookinstance', 'loan'}
+
+# Read from the primary for the rest of the current request (or command)
+_use_primary = ContextVar('catalog_use_primary', default=False)
+# The current request wrote to the primary
+_wrote = ContextVar('catalog_wrote', default=False)
+
+
+# Every request reads from the primary until this time, see the module docstring
+PRIMARY_UNTIL_KEY = 'catalog:primary-until'
+
+
+def use_primary():
+    """Read from the primary until the end of the request."""
+    _use_primary.set(True)
+
+
+def _catalog_written():
+    cache.set(PRIMARY_UNTIL_KEY, time.time() + settings.CATALOG_REPLICA_LAG_SECONDS, None)
+
+
+def catalog_recently_written():
+    """Whether a catalog write committed less than CATALOG_REPLICA_LAG_SECONDS ago."""
+    return (cache.get(PRIMARY_UNTIL_KEY) or 0) > time.time()
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        replica = settings.CATALOG_REPLICA_DATABASE
+        if replica is None or _use_primary.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        if model._meta.app_label == 'catalog' and model._meta.model_name in REPLICA_MODELS:
+            return replica
+        return None
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == 'catalog':
+            use_primary()
+            if model._meta.model_name in STICKY_MODELS:
+                _wrote.set(True)
+                if settings.CATALOG_REPLICA_DATABASE is not None:
+                    transaction.on_commit(_catalog_written)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {'default', settings.CATALOG_REPLICA_DATABASE}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema from the primary
+        if db == settings.CATALOG_REPLICA_DATABASE:
+            return False
+        return None
+
+
+class PrimaryStickinessMiddleware(MiddlewareMixin):
+    """Read from the primary for the requests following a write, see the module docstring."""
+    cookie_name = 'catalog_primary'
+
+    def process_request(self, request):
+        _use_primary.set(self.cookie_name in request.COOKIES or (
+            settings.CATALOG_REPLICA_DATABASE is not None and catalog_recently_written()))
+        _wrote.set(False)
+
+    def process_response(self, request, response):
+        if _wrote.get() and settings.CATALOG_REPLICA_DATABASE is not None:
+            response.set_cookie(self.cookie_name, '1', max_age=settings.CATALOG_REPLICA_LAG_SECONDS,
+                                httponly=True, samesite='Lax')
+        _use_primary.set(False)
+        _wrote.set(False)
+        return response
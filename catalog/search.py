@@ -0,0 +1,129 @@
+"""Full-text search over book titles, summaries, author names and genres.
+
+SQLite keeps a FTS5 shadow table (catalog_book_fts, rowid = book id) and PostgreSQL a
+weighted tsvector column (catalog_book.search_vector) with a GIN index, both created by
+migration 0011 and kept in sync by the signals in catalog/signals.py. Other databases
+fall back to case-insensitive LIKE queries.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Book
+
+FTS_TABLE = 'catalog_book_fts'
+# Books are mostly in Italian, used for stemming on PostgreSQL
+POSTGRES_SEARCH_CONFIG = 'italian'
+# Ranked results are computed in one go, further results are not shown
+MAX_RESULTS = 1000
+
+_fts_available = None
+
+
+def search_backend():
+    """Return 'fts5', 'postgresql' or 'like'."""
+    global _fts_available
+    if connection.vendor == 'postgresql':
+        return 'postgresql'
+    if connection.vendor == 'sqlite':
+        if _fts_available is None:
+            _fts_available = FTS_TABLE in connection.introspection.table_names()
+        if _fts_available:
+            return 'fts5'
+    return 'like'
+
+
+def _terms(query):
+    return re.findall(r'\w+', query)
+
+
+def search_books(query):
+    """Return the ids of the books matching all the words of query (as prefixes), best match first."""
+    terms = _terms(query)
+    if not terms:
+        return []
+    backend = search_backend()
+    if backend == 'fts5':
+        match = ' '.join('"{}"*'.format(term) for term in terms)
+        with connection.cursor() as cursor:
+            # bm25 weights: title, summary, author, genre (lower is better)
+            cursor.execute(
+                'SELECT rowid FROM {0} WHERE {0} MATCH %s ORDER BY bm25({0}, 10.0, 1.0, 5.0, 3.0) LIMIT %s'.format(
+                    FTS_TABLE),
+                [match, MAX_RESULTS])
+            return [row[0] for row in cursor.fetchall()]
+    if backend == 'postgresql':
+        tsquery = ' & '.join('{}:*'.format(term) for term in terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT id FROM catalog_book, to_tsquery(%s, %s) query WHERE search_vector @@ query '
+                'ORDER BY ts_rank(search_vector, query) DESC, title LIMIT %s',
+                [POSTGRES_SEARCH_CONFIG, tsquery, MAX_RESULTS])
+            return [row[0] for row in cursor.fetchall()]
+
+    books = Book.objects.all()
+    for term in terms:
+        books = books.filter(Q(title__icontains=term) | Q(summary__icontains=term)
+                             | Q(author__first_name__icontains=term) | Q(author__last_name__icontains=term)
+                             | Q(genre__name__icontains=term))
+    return list(books.order_by('title').values_list('pk', flat=True).distinct()[:MAX_RESULTS])
+
+
+SQLITE_INDEX_SQL = (
+    "INSERT INTO catalog_book_fts (rowid, title, summary, author, genre) "
+    "SELECT b.id, b.title, b.summary, coalesce(a.first_name || ' ' || a.last_name, ''), "
+    "coalesce((SELECT group_concat(g.name, ' ') FROM catalog_genre g "
+    "JOIN catalog_book_genre bg ON bg.genre_id = g.id WHERE bg.book_id = b.id), '') "
+    "FROM catalog_book b LEFT JOIN catalog_author a ON a.id = b.author_id"
+)
+
+POSTGRES_INDEX_SQL = (
+    "UPDATE catalog_book b SET search_vector = "
+    "setweight(to_tsvector(%(config)s, coalesce(b.title, '')), 'A') || "
+    "setweight(to_tsvector(%(config)s, coalesce((SELECT a.first_name || ' ' || a.last_name "
+    "FROM catalog_author a WHERE a.id = b.author_id), '')), 'B') || "
+    "setweight(to_tsvector(%(config)s, coalesce((SELECT string_agg(g.name, ' ') FROM catalog_genre g "
+    "JOIN catalog_book_genre bg ON bg.genre_id = g.id WHERE bg.book_id = b.id), '')), 'C') || "
+    "setweight(to_tsvector(%(config)s, coalesce(b.summary, '')), 'D')"
+)
+
+
+def _in_clause(column, ids):
+    return ' WHERE {} IN ({})'.format(column, ', '.join(['%s'] * len(ids)))
+
+
+def index_books(book_ids=None):
+    """Add or refresh books in the search index, by default the whole catalog."""
+    backend = search_backend()
+    if book_ids is not None:
+        book_ids = list(book_ids)
+        if not book_ids:
+            return
+    with connection.cursor() as cursor:
+        if backend == 'fts5':
+            remove_books(book_ids)
+            if book_ids is None:
+                cursor.execute(SQLITE_INDEX_SQL)
+            else:
+                cursor.execute(SQLITE_INDEX_SQL + _in_clause('b.id', book_ids), book_ids)
+        elif backend == 'postgresql':
+            params = {'config': POSTGRES_SEARCH_CONFIG}
+            if book_ids is None:
+                cursor.execute(POSTGRES_INDEX_SQL, params)
+            else:
+                params['ids'] = book_ids
+                cursor.execute(POSTGRES_INDEX_SQL + ' WHERE b.id = ANY(%(ids)s)', params)
+
+
+def remove_books(book_ids=None):
+    """Remove books from the FTS5 table (the PostgreSQL column goes away with the row)."""
+    if search_backend() != 'fts5':
+        return
+    if book_ids is not None:
+        book_ids = list(book_ids)
+    with connection.cursor() as cursor:
+        if book_ids is None:
+            cursor.execute('DELETE FROM {}'.format(FTS_TABLE))
+        elif book_ids:
+            cursor.execute('DELETE FROM {}'.format(FTS_TABLE) + _in_clause('rowid', book_ids), book_ids)
@@ -0,0 +1,184 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .caching import bump_book_tiles, bump_catalog_version, bump_loan_summary, invalidate_homepage_stats
+from .models import Author, Book, BookInstance, Genre, Loan, User, refresh_availability
+from .search import index_books, remove_books
+from .thumbnails import ensure_thumbnails
+
+
+@receiver(post_save, sender=Loan)
+@receiver(post_delete, sender=Loan)
+def update_availability_for_loan(sender, instance, **kwargs):
+    """Keep the availability index in sync when a loan is opened, closed or removed."""
+    refresh_availability(BookInstance.objects.filter(pk=instance.book_instance_id).values('book'))
+
+
+@receiver(pre_save, sender=BookInstance)
+def remember_copy_book(sender, instance, raw=False, **kwargs):
+    """A copy moved to another book also changes the availability of its previous book."""
+    if not raw and not instance._state.adding:
+        instance._previous_book_id = (BookInstance.objects.filter(pk=instance.pk)
+                                      .values_list('book_id', flat=True).first())
+
+
+@receiver(post_save, sender=BookInstance)
+@receiver(post_delete, sender=BookInstance)
+def update_availability_for_copy(sender, instance, **kwargs):
+    """Copies added to or removed from a book change its number of available copies."""
+    book_ids = {instance.book_id, getattr(instance, '_previous_book_id', None)} - {None}
+    if book_ids:
+        refresh_availability(book_ids)
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=BookInstance)
+@receiver(post_delete, sender=BookInstance)
+@receiver(post_save, sender=Loan)
+@receiver(post_delete, sender=Loan)
+def invalidate_homepage_stats_on_change(sender, **kwargs):
+    """Any change to the counted models makes the cached home page counts stale."""
+    invalidate_homepage_stats()
+
+
+@receiver(post_save, sender=Book)
+def build_cover_thumbnails(sender, instance, raw=False, **kwargs):
+    """Thumbnails are named after the cover, so a new cover gets new thumbnails."""
+    if not raw:
+        ensure_thumbnails(instance.cover.name)
+
+
+@receiver(post_save, sender=Loan)
+@receiver(post_delete, sender=Loan)
+def bump_borrower_loan_summary(sender, instance, **kwargs):
+    bump_loan_summary(instance.borrower_id)
+
+
+@receiver(post_save, sender=User)
+def bump_user_loan_summary(sender, instance, **kwargs):
+    """The library card expiration date changes User.max_books."""
+    bump_loan_summary(instance.pk)
+
+
+@receiver(post_save, sender=Book)
+def bump_book_tile(sender, instance, **kwargs):
+    """Grid tiles show the title, link and cover thumbnails of the book."""
+    bump_book_tiles(instance.pk)
+
+
+@receiver(post_save, sender=Book)
+def index_book(sender, instance, **kwargs):
+    index_books([instance.pk])
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book(sender, instance, **kwargs):
+    remove_books([instance.pk])
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Genre)
+def index_books_of(sender, instance, created, raw=False, **kwargs):
+    """Renaming an author or a genre changes the indexed text of their books."""
+    if not created and not raw:
+        index_books(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Author)
+@receiver(pre_delete, sender=Genre)
+def remember_books_of(sender, instance, **kwargs):
+    """The books of an author or a genre are unlinked by the time post_delete is sent."""
+    instance._book_ids = list(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Genre)
+def reindex_books_of(sender, instance, **kwargs):
+    """Books of a deleted author or genre lose its name (or are deleted with it)."""
+    index_books(getattr(instance, '_book_ids', []))
+
+
+@receiver(pre_save, sender=Book)
+def remember_book_author(sender, instance, raw=False, **kwargs):
+    """A book changing author also changes the page of its previous author."""
+    if instance.pk is not None and not raw:
+        instance._previous_author_id = (Book.objects.filter(pk=instance.pk)
+                                        .values_list('author_id', flat=True).first())
+
+
+@receiver(pre_delete, sender=Book)
+def remember_book_genres(sender, instance, **kwargs):
+    instance._genre_ids = list(instance.genre.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def bump_book_version(sender, instance, created=False, **kwargs):
+    """The pages of a book, of its author and of its genres show the book."""
+    genre_ids = getattr(instance, '_genre_ids', None)
+    if created:
+        # Genres are added after the book is created, see book_genres_changed
+        genre_ids = []
+    elif genre_ids is None:
+        genre_ids = instance.genre.values_list('pk', flat=True)
+    bump_catalog_version(books=[instance.pk],
+                         authors={instance.author_id, getattr(instance, '_previous_author_id', None)},
+                         genres=genre_ids)
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def book_genres_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Genres are indexed and shown with their books, from both sides of the relation."""
+    if action == 'pre_clear':
+        # The other side of the relation is only known before it is cleared
+        related = instance.book_set if reverse else instance.genre
+        instance._cleared_pks = list(related.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    related_pks = instance.__dict__.pop('_cleared_pks', []) if action == 'post_clear' else pk_set
+    book_ids, genre_ids = (related_pks, [instance.pk]) if reverse else ([instance.pk], related_pks)
+    index_books(book_ids)
+    bump_catalog_version(books=book_ids, genres=genre_ids)
+
+
+@receiver(post_save, sender=BookInstance)
+@receiver(post_delete, sender=BookInstance)
+def bump_copy_version(sender, instance, **kwargs):
+    """Book pages list the copies, author pages count them."""
+    if instance.book_id is not None:
+        author_ids = Book.objects.filter(pk=instance.book_id).values_list('author_id', flat=True)
+        bump_catalog_version(books=[instance.book_id], authors=author_ids)
+
+
+@receiver(post_save, sender=Loan)
+@receiver(post_delete, sender=Loan)
+def bump_loan_version(sender, instance, **kwargs):
+    """Book pages show the status and due date of the copies."""
+    bump_catalog_version(books=BookInstance.objects.filter(pk=instance.book_instance_id)
+                         .values_list('book_id', flat=True))
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def bump_author_version(sender, instance, created=False, **kwargs):
+    book_ids = getattr(instance, '_book_ids', None)
+    if created:
+        book_ids = []
+    elif book_ids is None:
+        book_ids = instance.book_set.values_list('pk', flat=True)
+    bump_catalog_version(books=book_ids, authors=[instance.pk])
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def bump_genre_version(sender, instance, created=False, **kwargs):
+    book_ids = getattr(instance, '_book_ids', None)
+    if created:
+        book_ids = []
+    elif book_ids is None:
+        book_ids = instance.book_set.values_list('pk', flat=True)
+    bump_catalog_version(books=book_ids, genres=[instance.pk])
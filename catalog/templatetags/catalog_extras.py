@@ -0,0 +1,27 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from catalog.caching import get_book_tiles
+from catalog.thumbnails import cover_thumbnail_url
+
+register = template.Library()
+
+
+@register.simple_tag
+def cover_url(book, size='grid', fmt='jpeg'):
+    """URL of the cover of a book at one of the thumbnails.THUMBNAIL_SIZES, e.g. {% cover_url book 'detail' 'webp' %}"""
+    return cover_thumbnail_url(book.cover, size, fmt)
+
+
+@register.simple_tag
+def query_replace(request, key, value):
+    """The query string of the current request with one parameter replaced, e.g. {% query_replace request 'page' 2 %}"""
+    query = request.GET.copy()
+    query[key] = value
+    return query.urlencode()
+
+
+@register.simple_tag
+def book_tiles(books):
+    """Cover grid tiles of books, each cached until the book is saved, e.g. {% book_tiles book_list %}"""
+    return mark_safe(''.join(get_book_tiles(books)))
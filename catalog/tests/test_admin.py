@@ -0,0 +1,85 @@
+import datetime
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from catalog.models import Author, Book, BookInstance, Genre, Language, Loan, User
+from catalog.pagination import EstimatedCountPaginator, estimated_count
+
+
+class AdminChangelistQueryCountTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_superuser(username='librarian', email='librarian@example.com',
+                                                      password='1X<ISRUkw+tuK')
+        cls.language = Language.objects.create(name='Italian')
+        cls.author = Author.objects.create(first_name='Gianni', last_name='Rodari')
+        cls.genres = [Genre.objects.create(name='Genre {}'.format(number)) for number in range(4)]
+        cls.add_rows(5)
+
+    @classmethod
+    def add_rows(cls, number_of_rows):
+        start = Book.objects.count()
+        for number in range(start, start + number_of_rows):
+            book = Book.objects.create(title='Book {0:02d}'.format(number), summary='', author=cls.author,
+                                       language=cls.language)
+            book.genre.set(cls.genres)
+            copy = BookInstance.objects.create(book=book, imprint='Imprint')
+            family = User.objects.create_user(username='family{}'.format(number),
+                                              students_at_Italian_school=number % 3)
+            Loan.objects.create(book_instance=copy, borrower=family, loan_date=datetime.date.today())
+
+    def setUp(self):
+        self.client.force_login(self.librarian)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelists_do_not_query_per_row(self):
+        urls = [reverse('admin:catalog_{}_changelist'.format(name)) for name in ('loan', 'book', 'bookinstance', 'user')]
+        # Warm the cached filter lookups
+        [self.count_queries(url) for url in urls]
+        queries = [self.count_queries(url) for url in urls]
+        self.add_rows(25)
+        self.assertEqual([self.count_queries(url) for url in urls], queries)
+
+    def test_book_genres_are_prefetched(self):
+        response = self.client.get(reverse('admin:catalog_book_changelist'))
+        self.assertContains(response, 'Genre 0, Genre 1, Genre 2')
+
+    def test_user_filter_lookups_are_cached(self):
+        url = reverse('admin:catalog_user_changelist')
+        self.client.get(url)
+        User.objects.create_user(username='family9', students_at_Italian_school=9)
+        response = self.client.get(url)
+        self.assertNotContains(response, 'students_at_Italian_school=9')
+        cache.clear()
+        response = self.client.get(url)
+        self.assertContains(response, 'students_at_Italian_school=9')
+
+
+class EstimatedCountPaginatorTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Genre.objects.bulk_create([Genre(name='Genre {}'.format(number)) for number in range(30)])
+
+    def test_estimate_from_statistics(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE catalog_genre')
+        self.assertEqual(estimated_count(Genre.objects.all()), 30)
+        self.assertIsNone(estimated_count(Genre.objects.filter(name='Genre 1')))
+
+        paginator = EstimatedCountPaginator(Genre.objects.order_by('pk'), 10)
+        paginator.ESTIMATE_THRESHOLD = 20
+        Genre.objects.filter(name='Genre 1').delete()
+        self.assertEqual(paginator.count, 30)
+        # Small tables are counted
+        self.assertEqual(EstimatedCountPaginator(Genre.objects.order_by('pk'), 10).count, 29)
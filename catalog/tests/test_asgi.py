@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.test import LiveServerTestCase, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from catalog.benchmark import measure_load
+from catalog.models import Book, Language
+from locallibrary.asgi import StaticFilesApplication
+
+
+@override_settings(CATALOG_CONDITIONAL_GET=True)
+class ASGIRequestTest(TestCase):
+    """The sync views and middleware served through the ASGI handler, like locallibrary/asgi.py."""
+
+    @classmethod
+    def setUpTestData(cls):
+        language = Language.objects.create(name='Italian')
+        cls.book = Book.objects.create(title='Il Gattopardo', summary='Summary', language=language)
+
+    def setUp(self):
+        # Not the tiles and pages cached by other tests for books with the same pk
+        cache.clear()
+
+    async def test_book_list(self):
+        response = await self.async_client.get(reverse('books'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Il Gattopardo')
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+
+    async def test_book_detail(self):
+        response = await self.async_client.get(reverse('book-detail', args=[self.book.pk]))
+        self.assertContains(response, 'Il Gattopardo')
+
+    async def test_conditional_get(self):
+        response = await self.async_client.get(reverse('books'))
+        # The async client of Django 3.2 takes the header names as sent
+        response = await self.async_client.get(reverse('books'), **{'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_index(self):
+        response = await self.async_client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'index.html')
+
+
+class StaticFilesApplicationTest(SimpleTestCase):
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        os.makedirs(os.path.join(root, 'css'))
+        with open(os.path.join(root, 'css', 'styles.css'), 'w') as stream:
+            stream.write('body { color: black; }' * 10000)
+        self.application = StaticFilesApplication(root=root, prefix='/static/')
+
+    async def get(self, path, headers=()):
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request'}
+
+        async def send(message):
+            messages.append(message)
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'headers': list(headers)}
+        await self.application(scope, receive, send)
+        body = b''.join(message['body'] for message in messages[1:])
+        return messages[0]['status'], dict(messages[0]['headers']), body
+
+    async def test_file_is_served_in_chunks(self):
+        status, headers, body = await self.get('/static/css/styles.css')
+        self.assertEqual(status, 200)
+        self.assertTrue(headers[b'content-type'].startswith(b'text/css'))
+        self.assertEqual(body, b'body { color: black; }' * 10000)
+
+        status, headers, body = await self.get('/static/css/styles.css', [(b'if-none-match', headers[b'etag'])])
+        self.assertEqual((status, body), (304, b''))
+
+    async def test_missing_file(self):
+        status, headers, body = await self.get('/static/css/missing.css')
+        self.assertEqual(status, 404)
+
+
+class MeasureLoadTest(LiveServerTestCase):
+
+    def test_measure_load(self):
+        result = measure_load(self.live_server_url, ['/catalog/books/', '/missing/'], concurrency=2, duration=0.5)
+        self.assertGreater(result['requests'], 0)
+        self.assertGreater(result['errors'], 0)
+        self.assertGreaterEqual(result['latency_ms_p99'], result['latency_ms_median'])
@@ -0,0 +1,190 @@
+import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import IntegrityError, OperationalError, connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+
+from catalog.circulation import CirculationError, reserve_copy
+from catalog.models import Book, BookInstance, Language, Loan, User
+
+
+def create_copy():
+    language = Language.objects.create(name='Italian')
+    book = Book.objects.create(title='Pinocchio', summary='Un burattino', language=language,
+                               cover='covers/pinocchio.jpg')
+    return BookInstance.objects.create(book=book, imprint='Giunti, 2001')
+
+
+def create_family(username):
+    return User.objects.create_user(username=username, password='1X<ISRUkw+tuK',
+                                    library_card_until=datetime.date.today() + datetime.timedelta(days=30))
+
+
+class ReserveBookTest(TestCase):
+
+    def setUp(self):
+        self.copy = create_copy()
+        self.family = create_family('family')
+
+    def test_reserve_available_copy(self):
+        self.client.login(username='family', password='1X<ISRUkw+tuK')
+        response = self.client.get(reverse('reserve-book', args=[self.copy.pk]))
+        self.assertRedirects(response, reverse('my-borrowed'))
+        loan = Loan.objects.get(book_instance=self.copy)
+        self.assertEqual(loan.borrower, self.family)
+        self.assertTrue(loan.is_reservation)
+
+    def test_reserved_copy_is_not_available(self):
+        reserve_copy(create_family('other'), self.copy.pk)
+        with self.assertRaisesMessage(CirculationError, 'Book not available'):
+            reserve_copy(self.family, self.copy.pk)
+
+    def test_max_books_is_enforced(self):
+        reserve_copy(self.family, self.copy.pk)
+        with self.assertRaisesMessage(CirculationError, 'maximum number of 1 Reserved books'):
+            reserve_copy(self.family, create_copy().pk)
+
+    def test_expired_card_cannot_reserve(self):
+        expired = User.objects.create_user(username='expired', password='1X<ISRUkw+tuK')
+        with self.assertRaises(CirculationError):
+            reserve_copy(expired, self.copy.pk)
+
+    def test_database_allows_one_open_loan_per_copy(self):
+        Loan.objects.create(book_instance=self.copy, borrower=self.family, loan_date=datetime.date.today())
+        with self.assertRaises(IntegrityError):
+            Loan.objects.create(book_instance=self.copy, borrower=self.family, reserved_date=datetime.date.today())
+
+
+class ConcurrentReservationTest(TransactionTestCase):
+
+    def test_only_one_concurrent_reservation_succeeds(self):
+        copy = create_copy()
+        families = [create_family('family{0}'.format(number)) for number in range(8)]
+
+        def reserve(family):
+            # SQLite refuses concurrent writers with "database is locked", the family clicks again
+            try:
+                for attempt in range(100):
+                    try:
+                        reserve_copy(family, copy.pk)
+                        return True
+                    except CirculationError:
+                        return False
+                    except OperationalError:
+                        time.sleep(0.01)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=len(families)) as executor:
+            results = list(executor.map(reserve, families))
+
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(Loan.objects.filter(book_instance=copy, return_date__isnull=True).count(), 1)
+
+
+from catalog.circulation import check_out_copies, return_copies
+
+
+class LoanDeskTest(TestCase):
+
+    def setUp(self):
+        self.family = create_family('family')
+        book = create_copy().book
+        self.copies = [BookInstance.objects.create(book=book, imprint='Imprint {0}'.format(number))
+                       for number in range(50)]
+        self.reserved = self.copies[:25]
+        for copy in self.reserved:
+            Loan.objects.create(book_instance=copy, borrower=self.family, reserved_date=datetime.date.today())
+
+    def test_check_out_converts_reservations(self):
+        # savepoint, lock copies, lock loans, update loans, books of the copies, refresh availability (2), release
+        with self.assertNumQueries(8):
+            result = check_out_copies([copy.pk for copy in self.copies])
+        self.assertEqual(len(result.processed), 25)
+        self.assertEqual(len(result.skipped), 25)
+        for loan in Loan.objects.filter(book_instance__in=self.reserved):
+            self.assertTrue(loan.is_loan)
+            self.assertEqual(loan.due_date, datetime.date.today() + Loan.DEFAULT_LOAN_DURATION)
+
+    def test_check_out_to_borrower(self):
+        result = check_out_copies([copy.pk for copy in self.copies], borrower=self.family)
+        self.assertEqual(len(result.processed), 50)
+        self.assertEqual(Loan.objects.filter(return_date__isnull=True, loan_date__isnull=False).count(), 50)
+        self.assertEqual(Book.objects.get().available_copies, 1)
+
+    def test_return_copies(self):
+        unknown = BookInstance(book=self.copies[0].book).pk
+        with self.assertNumQueries(8):
+            result = return_copies([copy.pk for copy in self.copies] + [unknown])
+        self.assertEqual(len(result.processed), 25)
+        self.assertEqual(result.not_found, [unknown])
+        self.assertFalse(Loan.objects.filter(return_date__isnull=True).exists())
+        self.assertEqual(Book.objects.get().available_copies, 51)
+
+    def test_loan_desk_view(self):
+        User.objects.create_superuser(username='librarian', email='librarian@example.com', password='1X<ISRUkw+tuK')
+        self.client.login(username='librarian', password='1X<ISRUkw+tuK')
+        copies = '\n'.join(str(copy.pk) for copy in self.reserved)
+        response = self.client.post(reverse('loan-desk'), {'action': 'checkout', 'copies': copies})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Loan desk: 25 processed.')
+        self.assertEqual(Loan.objects.filter(loan_date=datetime.date.today()).count(), 25)
+
+    def test_loan_desk_rejects_invalid_ids(self):
+        User.objects.create_superuser(username='librarian', email='librarian@example.com', password='1X<ISRUkw+tuK')
+        self.client.login(username='librarian', password='1X<ISRUkw+tuK')
+        response = self.client.post(reverse('loan-desk'), {'action': 'return', 'copies': 'not-a-copy'})
+        self.assertFormError(response, 'form', 'copies', 'Invalid copy IDs: not-a-copy')
+
+    def test_loan_desk_forbidden_to_families(self):
+        self.client.login(username='family', password='1X<ISRUkw+tuK')
+        response = self.client.get(reverse('loan-desk'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_loan_desk_link_needs_the_permission(self):
+        staff = User.objects.create_user(username='volunteer', password='1X<ISRUkw+tuK', is_staff=True)
+        self.client.force_login(staff)
+        self.assertNotContains(self.client.get(reverse('books')), reverse('loan-desk'))
+        staff.is_superuser = True
+        staff.save()
+        self.assertContains(self.client.get(reverse('books')), reverse('loan-desk'))
+
+
+class OneOpenLoanMigrationTest(TransactionTestCase):
+    """0008 closes the duplicate open loans left by the old race before adding its constraint."""
+    before = [('catalog', '0007_availability_index')]
+    after = [('catalog', '0008_loan_one_open_per_copy')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_duplicate_open_loans_are_closed(self):
+        apps = self.migrate(self.before)
+        Language = apps.get_model('catalog', 'Language')
+        Book = apps.get_model('catalog', 'Book')
+        BookInstance = apps.get_model('catalog', 'BookInstance')
+        Loan = apps.get_model('catalog', 'Loan')
+        User = apps.get_model('catalog', 'User')
+        book = Book.objects.create(title='Pinocchio', summary='Un burattino',
+                                   language=Language.objects.create(name='Italian'))
+        copy = BookInstance.objects.create(book=book, imprint='Giunti, 2001')
+        other_copy = BookInstance.objects.create(book=book, imprint='Mondadori, 2010')
+        today = datetime.date.today()
+        loans = [Loan.objects.create(book_instance=copy, reserved_date=today,
+                                     borrower=User.objects.create(username='family{}'.format(number)))
+                 for number in range(3)]
+        other = Loan.objects.create(book_instance=other_copy, borrower_id=loans[0].borrower_id, loan_date=today)
+
+        apps = self.migrate(self.after)
+        Loan = apps.get_model('catalog', 'Loan')
+        open_pks = set(Loan.objects.filter(return_date__isnull=True).values_list('pk', flat=True))
+        self.assertEqual(open_pks, {loans[0].pk, other.pk})
@@ -0,0 +1,66 @@
+from unittest import mock
+
+from django.db import OperationalError, connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+
+from catalog.benchmark import measure_reservations, seed_reservations
+from catalog.database import retry_on_locked
+from catalog.models import Loan
+
+
+class SQLitePragmasTest(TestCase):
+
+    def test_pragmas_are_applied(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -20000)
+
+
+class RetryOnLockedTest(SimpleTestCase):
+
+    def flaky(self, *errors):
+        return mock.Mock(side_effect=list(errors) + ['done'])
+
+    @mock.patch('catalog.database.random.uniform', return_value=1)
+    @mock.patch('catalog.database.time.sleep')
+    def test_locked_transactions_are_retried(self, sleep, uniform):
+        func = self.flaky(OperationalError('database is locked'), OperationalError('database is locked'))
+        self.assertEqual(retry_on_locked(func)(), 'done')
+        self.assertEqual(func.call_count, 3)
+        first, second = [call.args[0] for call in sleep.call_args_list]
+        self.assertLess(first, second)
+
+    @mock.patch('catalog.database.time.sleep')
+    def test_gives_up(self, sleep):
+        func = self.flaky(*[OperationalError('database is locked')] * 3)
+        with self.assertRaises(OperationalError):
+            retry_on_locked(func, attempts=2)()
+        self.assertEqual(func.call_count, 3)
+
+    def test_other_errors_are_not_retried(self):
+        func = self.flaky(OperationalError('no such table: catalog_loan'))
+        with self.assertRaises(OperationalError):
+            retry_on_locked(func)()
+        self.assertEqual(func.call_count, 1)
+
+
+class RetryInTransactionTest(TestCase):
+
+    def test_not_retried_inside_a_transaction(self):
+        func = mock.Mock(side_effect=[OperationalError('database is locked'), 'done'])
+        with transaction.atomic(), self.assertRaises(OperationalError):
+            retry_on_locked(func)()
+        self.assertEqual(func.call_count, 1)
+
+
+class ReservationBenchmarkTest(TransactionTestCase):
+
+    def test_concurrent_reservations(self):
+        pairs = seed_reservations(10)
+        result = measure_reservations(pairs, workers=2)
+        self.assertEqual(result['succeeded'] + result['locked'], 10)
+        self.assertEqual(Loan.objects.count(), result['succeeded'])
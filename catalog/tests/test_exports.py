@@ -0,0 +1,82 @@
+import csv
+import datetime
+import gzip
+import io
+import json
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+
+from catalog.exports import HEADER, export_chunks, export_queryset
+from catalog.models import Book, BookInstance, Language, Loan, User
+
+TODAY = datetime.date.today()
+
+
+class LoanExportTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.family = User.objects.create_user(username='family', email='family@example.com',
+                                              password='1X<ISRUkw+tuK')
+        language = Language.objects.create(name='Italian')
+        book = Book.objects.create(title='Pinocchio', summary='Un burattino', language=language)
+        copies = [BookInstance.objects.create(book=book, imprint='Imprint {}'.format(number)) for number in range(4)]
+        days = datetime.timedelta(days=1)
+        cls.returned = Loan.objects.create(book_instance=copies[0], borrower=cls.family, loan_date=TODAY - 400 * days,
+                                           return_date=TODAY - 390 * days)
+        cls.overdue = Loan.objects.create(book_instance=copies[1], borrower=cls.family, loan_date=TODAY - 30 * days)
+        cls.on_loan = Loan.objects.create(book_instance=copies[2], borrower=cls.family, loan_date=TODAY)
+        cls.reserved = Loan.objects.create(book_instance=copies[3], borrower=cls.family, reserved_date=TODAY)
+
+    def export(self, fmt='csv', **filters):
+        return b''.join(export_chunks(export_queryset(**filters), fmt=fmt, chunk_size=2)).decode()
+
+    def test_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.export())))
+        self.assertEqual(list(rows[0]), HEADER)
+        self.assertEqual([row['status'] for row in rows], ['returned', 'overdue', 'on_loan', 'reserved'])
+        self.assertEqual(rows[0]['title'], 'Pinocchio')
+        self.assertEqual(rows[0]['borrower_email'], 'family@example.com')
+        self.assertEqual(rows[3]['loan_date'], '')
+
+    def test_filters(self):
+        rows = [json.loads(line) for line in self.export('jsonl', since=TODAY - datetime.timedelta(days=60)).splitlines()]
+        self.assertEqual([row['loan_id'] for row in rows], [self.overdue.pk, self.on_loan.pk, self.reserved.pk])
+        rows = [json.loads(line) for line in self.export('jsonl', statuses=['overdue', 'reserved']).splitlines()]
+        self.assertEqual([row['loan_id'] for row in rows], [self.overdue.pk, self.reserved.pk])
+        self.assertEqual(self.export('jsonl', until=TODAY - datetime.timedelta(days=365), statuses=['overdue']), '')
+
+    def test_rows_are_fetched_in_chunks(self):
+        # One query whatever the number of loans: no per-row lookups of the copy, book or borrower
+        with self.assertNumQueries(1):
+            self.export()
+
+    def test_view_streams_gzip(self):
+        librarian = User.objects.create_superuser(username='librarian', email='librarian@example.com',
+                                                  password='1X<ISRUkw+tuK')
+        self.client.force_login(librarian)
+        self.assertContains(self.client.get(reverse('export-loans')), 'Download')
+        response = self.client.get(reverse('export-loans'), {'format': 'csv', 'status': 'returned', 'gzip': 'on'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('loans.csv.gz', response['Content-Disposition'])
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+
+    def test_view_forbidden_to_families(self):
+        self.client.force_login(self.family)
+        self.assertEqual(self.client.get(reverse('export-loans'), {'format': 'csv'}).status_code, 403)
+
+    def test_command(self):
+        stdout = io.StringIO()
+        call_command('export_loans', '--format', 'jsonl', '--status', 'on_loan', stdout=stdout)
+        self.assertEqual(json.loads(stdout.getvalue())['loan_id'], self.on_loan.pk)
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'loans.csv.gz')
+            call_command('export_loans', '--gzip', '--output', output, '--since', TODAY.isoformat())
+            with gzip.open(output, 'rt') as stream:
+                self.assertEqual(len(stream.read().splitlines()), 3)
@@ -0,0 +1,143 @@
+import functools
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from catalog.importer import CatalogImporter, import_manifest, read_manifest
+from catalog.models import Author, Book, BookInstance, Genre, Language, User
+from catalog.search import search_books
+from catalog.thumbnails import thumbnail_name
+
+CSV_MANIFEST = '''title,summary,author_first_name,author_last_name,genres,language,copies,imprint,cover
+Le avventure di Pinocchio,Un burattino,Carlo,Collodi,Fiabe|Classici,Italian,2,Giunti,
+Il romanzo di Cipollino,Una cipolla,Gianni,Rodari,Fiabe,Italian,1,Einaudi,
+,Senza titolo,Gianni,Rodari,,,1,,
+Favole al telefono,,Gianni,Rodari,Fiabe,Italian,tre,Einaudi,
+'''
+
+
+class CatalogImporterTest(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.cover_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+        shutil.rmtree(self.cover_dir)
+
+    def import_csv(self, manifest=CSV_MANIFEST, **options):
+        return CatalogImporter(**options).run(read_manifest(io.StringIO(manifest), 'csv'))
+
+    def test_import_csv(self):
+        Author.objects.create(first_name='Gianni', last_name='Rodari')
+        result = self.import_csv(chunk_size=1)
+        self.assertEqual((result.rows, result.books, result.copies, result.error_count), (4, 2, 3, 2))
+        self.assertEqual([row_number for row_number, message in result.errors], [3, 4])
+
+        pinocchio = Book.objects.get(title='Le avventure di Pinocchio')
+        self.assertEqual(str(pinocchio.author), 'Collodi, Carlo')
+        self.assertEqual(pinocchio.language.name, 'Italian')
+        self.assertEqual(sorted(genre.name for genre in pinocchio.genre.all()), ['Classici', 'Fiabe'])
+        self.assertEqual(pinocchio.available_copies, 2)
+        # Lookups are shared between chunks and with the existing rows
+        self.assertEqual(Author.objects.filter(last_name='Rodari').count(), 1)
+        self.assertEqual(Genre.objects.filter(name='Fiabe').count(), 1)
+        self.assertEqual(Language.objects.count(), 1)
+        self.assertEqual(search_books('cipolla'), [Book.objects.get(title='Il romanzo di Cipollino').pk])
+
+    def test_chunk_query_count_does_not_depend_on_rows(self):
+        rows = [{'title': 'Libro {}'.format(number), 'author_first_name': 'Gianni', 'author_last_name': 'Rodari',
+                 'genres': ['Fiabe'], 'language': 'Italian', 'copies': 2} for number in range(200)]
+        importer = CatalogImporter(chunk_size=100)
+        importer.run(rows[:1])
+        # savepoint, books and their ids, genres, copies (2 batches of chunk_size), availability (2),
+        # search index (2), release: the lookups are cached
+        with self.assertNumQueries(11):
+            result = importer.run(rows[:100])
+        self.assertEqual(result.copies, 200)
+        importer.run(rows[100:])
+        self.assertEqual(BookInstance.objects.count(), 402)
+
+    def test_import_jsonl_with_covers(self):
+        Image.new('RGB', (400, 600), 'blue').save(os.path.join(self.cover_dir, 'pinocchio.jpg'))
+        manifest = os.path.join(self.cover_dir, 'manifest.jsonl')
+        with open(manifest, 'w') as stream:
+            for row in ({'title': 'Pinocchio', 'genres': ['Fiabe'], 'cover': 'pinocchio.jpg'},
+                        {'title': 'Cuore', 'cover': 'missing.jpg'}):
+                stream.write(json.dumps(row) + '\n')
+        result = import_manifest(manifest, cover_dir=self.cover_dir)
+        self.assertEqual((result.books, result.covers, result.error_count), (1, 1, 1))
+        book = Book.objects.get()
+        self.assertEqual(book.cover.name, 'covers/pinocchio.jpg')
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, thumbnail_name(book.cover.name, 'grid', 'webp'))))
+
+    def test_covers_outside_the_cover_dir_are_rejected(self):
+        secret = os.path.join(self.media_root, 'secret.jpg')
+        Image.new('RGB', (40, 60), 'red').save(secret)
+        os.symlink(self.media_root, os.path.join(self.cover_dir, 'link'))
+        rows = [{'title': 'Absolute', 'cover': secret},
+                {'title': 'Parent', 'cover': os.path.join('..', os.path.basename(self.media_root), 'secret.jpg')},
+                {'title': 'Symbolic link', 'cover': 'link/secret.jpg'}]
+        result = CatalogImporter(cover_dir=self.cover_dir).run(rows)
+        self.assertEqual((result.books, result.error_count), (0, 3))
+        self.assertTrue(all(message.startswith('Invalid cover name') for row_number, message in result.errors))
+
+    def test_unreadable_rows_are_reported(self):
+        manifest = '\n'.join(['{"title": "Pinocchio"}', '{"title": ', '["Cuore"]', '{"title": {"it": "Cuore"}}',
+                               '{"title": "Cuore", "genres": "Romanzi"}', '{"title": 1984}'])
+        result = CatalogImporter().run(read_manifest(io.StringIO(manifest), 'jsonl'))
+        self.assertEqual([row_number for row_number, message in result.errors], [2, 3, 4, 5])
+        self.assertEqual(sorted(Book.objects.values_list('title', flat=True)), ['1984', 'Pinocchio'])
+
+    def test_admin_upload_not_utf8(self):
+        User.objects.create_superuser(username='librarian', email='librarian@example.com', password='1X<ISRUkw+tuK')
+        self.client.login(username='librarian', password='1X<ISRUkw+tuK')
+        manifest = SimpleUploadedFile('books.jsonl', '{"title": "Pinocchio"}\n{"title": "Città"}\n'.encode('latin-1'))
+        response = self.client.post(reverse('admin:catalog_book_import'), {'manifest': manifest}, follow=True)
+        self.assertContains(response, 'Not UTF-8 text')
+        self.assertEqual(Book.objects.count(), 0)
+
+    def test_admin_upload_reports_partial_import(self):
+        User.objects.create_superuser(username='librarian', email='librarian@example.com', password='1X<ISRUkw+tuK')
+        self.client.login(username='librarian', password='1X<ISRUkw+tuK')
+        Image.new('RGB', (40, 60), 'red').save(os.path.join(self.cover_dir, 'cuore.jpg'))
+        manifest = SimpleUploadedFile('books.jsonl',
+                                      b'{"title": "Pinocchio"}\n{"title": "Cuore", "cover": "cuore.jpg"}\n')
+        with mock.patch('catalog.admin.import_manifest', functools.partial(import_manifest, chunk_size=1)), \
+                mock.patch('catalog.importer.CatalogImporter.save_cover', side_effect=OSError('Disk full')), \
+                override_settings(CATALOG_IMPORT_COVER_DIR=self.cover_dir):
+            response = self.client.post(reverse('admin:catalog_book_import'), {'manifest': manifest}, follow=True)
+        self.assertContains(response, 'Import stopped after row 1: Disk full')
+        self.assertContains(response, 'Imported 1 rows: 1 books')
+        self.assertEqual(Book.objects.get().title, 'Pinocchio')
+
+    def test_command_reports_throughput(self):
+        manifest = os.path.join(self.cover_dir, 'manifest.csv')
+        with open(manifest, 'w') as stream:
+            stream.write(CSV_MANIFEST)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command('import_catalog', manifest, stdout=stdout, stderr=stderr)
+        self.assertIn('rows/s', stdout.getvalue())
+        self.assertIn('Row 3: Missing title.', stderr.getvalue())
+
+    def test_admin_upload(self):
+        User.objects.create_superuser(username='librarian', email='librarian@example.com', password='1X<ISRUkw+tuK')
+        self.client.login(username='librarian', password='1X<ISRUkw+tuK')
+        self.assertEqual(self.client.get(reverse('admin:catalog_book_import')).status_code, 200)
+        manifest = SimpleUploadedFile('books.csv', CSV_MANIFEST.encode(), content_type='text/csv')
+        response = self.client.post(reverse('admin:catalog_book_import'), {'manifest': manifest})
+        self.assertRedirects(response, reverse('admin:catalog_book_changelist'))
+        self.assertEqual(Book.objects.count(), 2)
@@ -0,0 +1,76 @@
+import datetime
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from prometheus_client import REGISTRY
+
+from catalog.models import Book, BookInstance, Language, Loan, User
+
+
+@override_settings(CATALOG_METRICS_TOKEN='s3cret')
+class MetricsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        family = User.objects.create_user(username='family')
+        book = Book.objects.create(title='Pinocchio', summary='Un burattino',
+                                   language=Language.objects.create(name='Italian'))
+        today = datetime.date.today()
+        for loan_date, due_date, reserved_date in ((today, None, None), (today - datetime.timedelta(days=30), None, None),
+                                                   (None, None, today)):
+            Loan.objects.create(book_instance=BookInstance.objects.create(book=book), borrower=family,
+                                loan_date=loan_date, due_date=due_date, reserved_date=reserved_date)
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_request_histograms_by_url_name(self):
+        count = self.sample('catalog_request_duration_seconds_count', view='books', method='GET')
+        queries = self.sample('catalog_request_queries_sum', view='books', method='GET')
+        self.client.get(reverse('books'))
+        self.assertEqual(self.sample('catalog_request_duration_seconds_count', view='books', method='GET'), count + 1)
+        self.assertEqual(self.sample('catalog_request_queries_sum', view='books', method='GET'), queries + 1)
+        self.client.get('/no-such-page/')
+        self.assertGreater(self.sample('catalog_request_queries_count', view='<unresolved>', method='GET'), 0)
+
+    def scrape(self):
+        return self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer s3cret')
+
+    def test_loan_gauges(self):
+        # A request observed, so that its histogram has samples
+        self.client.get(reverse('books'))
+        response = self.scrape()
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'catalog_open_loans 2.0')
+        self.assertContains(response, 'catalog_open_reservations 1.0')
+        self.assertContains(response, 'catalog_overdue_loans 1.0')
+        self.assertContains(response, 'catalog_request_duration_seconds_bucket')
+
+    def test_local_requests_need_the_token(self):
+        # Behind a reverse proxy on the same host, every request comes from 127.0.0.1
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1').status_code, 403)
+
+    @override_settings(CATALOG_METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_restricted_to_allowed_ips_and_token(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+    @override_settings(CATALOG_METRICS_ALLOWED_IPS=[], CATALOG_METRICS_TOKEN='')
+    def test_no_token_set(self):
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+    def test_multiprocess_files_are_aggregated(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': directory}):
+            response = self.scrape()
+        # No worker wrote samples to the directory, the gauges are counted anyway
+        self.assertNotContains(response, 'catalog_request_duration_seconds_bucket')
+        self.assertContains(response, 'catalog_open_loans 2.0')
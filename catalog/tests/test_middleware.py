@@ -0,0 +1,53 @@
+import json
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from catalog.middleware import QueryRecorder
+from catalog.models import Book, Language
+
+
+class InstrumentationMiddlewareTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        language = Language.objects.create(name='Italian')
+        for number in range(3):
+            Book.objects.create(title='Book {}'.format(number), summary='Summary', language=language)
+
+    def test_server_timing(self):
+        response = self.client.get(reverse('books'))
+        metrics = {metric.split(';')[0]: metric for metric in response['Server-Timing'].split(', ')}
+        self.assertEqual(set(metrics), {'total', 'sql', 'render'})
+        self.assertIn('desc="1 queries"', metrics['sql'])
+
+    def test_render_is_timed_without_template_response(self):
+        # index calls render()
+        self.assertIn('render;dur=', self.client.get(reverse('index'))['Server-Timing'])
+
+    @override_settings(CATALOG_SERVER_TIMING=False)
+    def test_server_timing_can_be_disabled(self):
+        self.assertFalse(self.client.get(reverse('books')).has_header('Server-Timing'))
+
+    @override_settings(CATALOG_SLOW_REQUEST_MS=0)
+    def test_slow_request_log_reports_repeated_queries(self):
+        book = Book.objects.first()
+        with self.assertLogs('catalog.performance', 'WARNING') as logs:
+            self.client.get(reverse('book-detail', args=[book.pk]))
+        record = json.loads(logs.records[0].getMessage().split(' ', 2)[2])
+        self.assertEqual(record['view'], 'book-detail')
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['sql_count'], 0)
+        self.assertIsNotNone(record['render_ms'])
+        self.assertEqual(record['repeated_sql'], [])
+
+    def test_repeated_queries_are_grouped(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for book in Book.objects.all():
+                Language.objects.get(pk=book.language_id)
+        self.assertEqual(recorder.count, 4)
+        [repeated] = recorder.repeated()
+        self.assertEqual(repeated['count'], 3)
+        self.assertIn('FROM "catalog_language"', repeated['sql'])
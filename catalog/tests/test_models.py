@@ -52,3 +52,107 @@ class AuthorModelTest(TestCase):
         author = Author.objects.get(id=1)
         # This will also fail if the urlconf is not defined.
         self.assertEquals(author.get_absolute_url(), '/catalog/author/1')
+
+
+import datetime
+
+from catalog.models import Book, BookInstance, Language, Loan, User, refresh_availability
+
+
+class BookAvailabilityTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='family', password='1X<ISRUkw+tuK')
+        language = Language.objects.create(name='Italian')
+        cls.book = Book.objects.create(title='Pinocchio', summary='Un burattino', language=language,
+                                       cover='covers/pinocchio.jpg')
+        cls.copy1 = BookInstance.objects.create(book=cls.book, imprint='Giunti, 2001')
+        cls.copy2 = BookInstance.objects.create(book=cls.book, imprint='Mondadori, 2010')
+
+    def test_new_copies_are_available(self):
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 2)
+        self.assertTrue(self.book.is_available)
+
+    def test_open_loan_updates_index(self):
+        loan = Loan.objects.create(book_instance=self.copy1, borrower=self.user, reserved_date=datetime.date.today())
+        self.copy1.refresh_from_db()
+        self.book.refresh_from_db()
+        self.assertEqual(self.copy1.current_loan_id, loan.pk)
+        self.assertEqual(self.book.available_copies, 1)
+
+        Loan.objects.create(book_instance=self.copy2, borrower=self.user, loan_date=datetime.date.today())
+        self.book.refresh_from_db()
+        self.assertFalse(self.book.is_available)
+
+    def test_returned_loan_updates_index(self):
+        loan = Loan.objects.create(book_instance=self.copy1, borrower=self.user, loan_date=datetime.date.today())
+        loan.return_date = datetime.date.today()
+        loan.save()
+        self.copy1.refresh_from_db()
+        self.book.refresh_from_db()
+        self.assertIsNone(self.copy1.current_loan)
+        self.assertEqual(self.book.available_copies, 2)
+
+    def test_copy_moved_to_another_book(self):
+        other = Book.objects.create(title='Cuore', summary='Un diario', language=self.book.language)
+        self.copy2.book = other
+        self.copy2.save()
+        self.book.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 1)
+        self.assertEqual(other.available_copies, 1)
+
+    def test_rebuild_from_loan_history(self):
+        Loan.objects.create(book_instance=self.copy1, borrower=self.user, loan_date=datetime.date.today())
+        Book.objects.update(available_copies=0)
+        BookInstance.objects.update(current_loan=None)
+        refresh_availability()
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.available_copies, 1)
+
+
+import uuid
+from unittest import skipUnless
+
+from django.db import connection
+
+
+@skipUnless(connection.vendor in ('sqlite', 'postgresql'), 'EXPLAIN output checked on SQLite and PostgreSQL only')
+class LoanIndexTest(TestCase):
+    """Check the query planner uses the Loan indexes for the hot path predicates."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='family', password='1X<ISRUkw+tuK')
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # Tiny test tables are faster to scan, make the planner show what it does on big ones
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, index_name):
+        self.assertIn(index_name, queryset.explain())
+
+    def test_open_loan_of_copy(self):
+        self.assertUsesIndex(Loan.objects.filter(book_instance=uuid.uuid4(), return_date__isnull=True),
+                             'catalog_loan_one_open_per_copy')
+
+    def test_open_reservations_of_borrower(self):
+        self.assertUsesIndex(
+            Loan.objects.filter(borrower=self.user, reserved_date__isnull=False, return_date__isnull=True),
+            'catalog_loan_open_borrower_idx')
+
+    def test_loans_of_borrower_by_due_date(self):
+        self.assertUsesIndex(Loan.objects.filter(borrower=self.user).order_by('due_date'),
+                             'catalog_loan_borrower_due_idx')
+
+    def test_open_loans_and_reservations(self):
+        self.assertUsesIndex(Loan.objects.filter(return_date__isnull=True), 'catalog_loan_ret_loan_due_idx')
+        self.assertUsesIndex(Loan.objects.filter(return_date__isnull=True, loan_date__isnull=False),
+                             'catalog_loan_ret_loan_due_idx')
+        self.assertUsesIndex(
+            Loan.objects.filter(return_date__isnull=True, loan_date__isnull=True, reserved_date__isnull=False),
+            'catalog_loan_ret_loan_due_idx')
@@ -0,0 +1,98 @@
+from django.db.models import F
+from django.test import TestCase
+from django.urls import reverse
+
+from catalog.models import Author, Book, Genre, Language
+from catalog.pagination import CursorPaginator
+
+
+class CursorPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        language = Language.objects.create(name='Italian')
+        authors = [Author.objects.create(first_name='Nome', last_name='Cognome {}'.format(number))
+                   for number in range(3)]
+        genre = Genre.objects.create(name='Fiabe')
+        # Repeated titles and books without author exercise every column of the key
+        for number in range(30):
+            book = Book.objects.create(title='Libro {}'.format(number % 7), summary='', language=language,
+                                       author=authors[number % 3] if number % 4 else None)
+            book.genre.add(genre)
+
+    def walk(self, url):
+        """The books of every page following the next links, then back following the previous links."""
+        forward, pages = [], []
+        response = self.client.get(url)
+        while True:
+            page = response.context['page_obj']
+            forward.extend(page.object_list)
+            pages.append([book.pk for book in page.object_list])
+            if not page.has_next():
+                break
+            response = self.client.get(url, {'cursor': page.next_cursor})
+
+        backward = [[book.pk for book in page.object_list]]
+        while page.has_previous():
+            response = self.client.get(url, {'cursor': page.previous_cursor})
+            page = response.context['page_obj']
+            backward.append([book.pk for book in page.object_list])
+        return forward, pages, backward[::-1]
+
+    def test_pages_follow_the_offset_ordering(self):
+        forward, pages, backward = self.walk(reverse('books'))
+        # NULLs where the database puts them, as in the cursor ordering
+        offset_ordering = list(Book.objects.order_by('title', 'author_id', 'id'))
+        self.assertEqual(forward, offset_ordering)
+        self.assertEqual([len(page) for page in pages], [12, 12, 6])
+        self.assertEqual(backward, pages)
+
+    def test_nulls_last(self):
+        # The NULLs of PostgreSQL, emulated on every database
+        class NullsLastPaginator(CursorPaginator):
+            @property
+            def ordering(self):
+                return [F(field.attname).asc(nulls_last=True) for field in self.fields]
+
+        paginator = NullsLastPaginator(Book.objects.all(), ['title', 'author', 'id'], 4)
+        paginator.nulls_first = False
+        page = paginator.get_page()
+        forward, pages = list(page), [list(page)]
+        while page.has_next():
+            page = paginator.get_page(page.next_cursor)
+            forward.extend(page)
+            pages.append(list(page))
+        backward = [list(page)]
+        while page.has_previous():
+            page = paginator.get_page(page.previous_cursor)
+            backward.append(list(page))
+        expected = sorted(Book.objects.all(),
+                          key=lambda book: (book.title, book.author_id is None, book.author_id or 0, book.pk))
+        self.assertEqual(forward, expected)
+        self.assertEqual(backward[::-1], pages)
+
+    def test_one_query_per_page(self):
+        response = self.client.get(reverse('books'))
+        cursor = response.context['page_obj'].next_cursor
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('books'), {'cursor': cursor})
+        self.assertTrue(response.context['is_paginated'])
+        self.assertIsNone(response.context['paginator'])
+        self.assertContains(response, '?cursor={}'.format(response.context['page_obj'].previous_cursor))
+
+    def test_page_numbers_still_supported(self):
+        response = self.client.get(reverse('books'), {'page': 3})
+        self.assertEqual(response.context['paginator'].count, 30)
+        self.assertEqual(len(response.context['book_list']), 6)
+
+    def test_invalid_cursor(self):
+        for cursor in ('garbage', 'WyJuIiwgWzFdXQ', 'WyJuIixbIngiLCJ5IiwieiJdXQ'):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse('books'), {'cursor': cursor})
+                self.assertEqual(response.status_code, 404)
+
+    def test_counts_of_the_page(self):
+        response = self.client.get(reverse('authors'))
+        self.assertEqual([author.book_count for author in response.context['author_list']], [7, 7, 8])
+        response = self.client.get(reverse('genres'))
+        self.assertEqual([genre.book_count for genre in response.context['genre_list']], [30])
@@ -0,0 +1,20 @@
+from django.test import TestCase
+
+# Query budgets of the catalog views, see catalog/benchmark.py
+
+from catalog.benchmark import VIEW_BUDGETS, measure_views, seed_library
+
+
+class ViewQueryBudgetTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.targets = seed_library(books=60, copies_per_book=2, users=10, loans=120)
+
+    def test_views_within_query_budget(self):
+        results = measure_views(self.client, self.targets, repeat=1)
+        self.assertEqual(len(results), len(VIEW_BUDGETS))
+        for result in results:
+            with self.subTest(view=result['view']):
+                self.assertEqual(result['status_code'], 200)
+                self.assertLessEqual(result['queries'], result['query_budget'])
@@ -0,0 +1,93 @@
+import datetime
+import io
+from unittest import mock
+
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.formats import date_format
+
+from catalog.models import Book, BookInstance, Language, Loan, LoanReminder, User
+from catalog.reminders import pending_reminders, send_reminders
+
+TODAY = datetime.date.today()
+DAY = datetime.timedelta(days=1)
+
+
+class LoanReminderTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        language = Language.objects.create(name='Italian')
+        cls.book = Book.objects.create(title='Pinocchio', summary='Un burattino', language=language)
+        cls.family = User.objects.create_user(username='family', email='family@example.com')
+        cls.overdue = cls.lend(cls.family, TODAY - 2 * DAY)
+        cls.due_soon = cls.lend(cls.family, TODAY + 2 * DAY)
+        cls.lend(cls.family, TODAY + 10 * DAY)
+        Loan.objects.create(book_instance=BookInstance.objects.create(book=cls.book), borrower=cls.family,
+                            loan_date=TODAY - 30 * DAY, due_date=TODAY - 20 * DAY, return_date=TODAY - DAY)
+
+    @classmethod
+    def lend(cls, borrower, due_date):
+        return Loan.objects.create(book_instance=BookInstance.objects.create(book=cls.book), borrower=borrower,
+                                   loan_date=due_date - Loan.DEFAULT_LOAN_DURATION, due_date=due_date)
+
+    def test_one_digest_per_family(self):
+        other = User.objects.create_user(username='other', email='other@example.com')
+        self.lend(other, TODAY - DAY)
+        result = send_reminders(days=3)
+        self.assertEqual((result.emails, result.loans), (2, 3))
+        family_email = next(email for email in mail.outbox if email.to == ['family@example.com'])
+        self.assertEqual(family_email.subject, 'Overdue books at the library')
+        self.assertIn('Pinocchio (due {})'.format(date_format(self.overdue.due_date)), family_email.body)
+        self.assertEqual(family_email.body.count('Pinocchio'), 2)
+        self.assertEqual(set(LoanReminder.objects.filter(loan__borrower=self.family).values_list('loan', 'kind')),
+                         {(self.overdue.pk, LoanReminder.OVERDUE), (self.due_soon.pk, LoanReminder.DUE_SOON)})
+
+    def test_reminders_are_sent_once(self):
+        send_reminders(days=3)
+        self.assertEqual(send_reminders(days=3).emails, 0)
+        self.assertEqual(len(mail.outbox), 1)
+        # The due-soon loan becomes overdue, and a renewal moves the due date
+        self.assertEqual(list(pending_reminders(today=TODAY + 3 * DAY, days=0)), [self.due_soon])
+        Loan.objects.filter(pk=self.overdue.pk).update(due_date=TODAY + DAY)
+        self.assertEqual(list(pending_reminders(days=3)), [self.overdue])
+
+    def test_loans_are_loaded_per_chunk(self):
+        for number in range(20):
+            self.lend(User.objects.create_user(username='family{}'.format(number),
+                                               email='family{}@example.com'.format(number)), TODAY - DAY)
+        # families, the loans of each of the 3 chunks, then the reminders of each of the 21 families
+        with self.assertNumQueries(1 + 3 + 21):
+            result = send_reminders(days=3, chunk_size=10)
+        self.assertEqual(result.emails, 21)
+
+    def test_failure_keeps_the_reminders_already_sent(self):
+        for number in range(3):
+            self.lend(User.objects.create_user(username='family{}'.format(number),
+                                               email='family{}@example.com'.format(number)), TODAY - DAY)
+        send_messages = EmailBackend.send_messages
+
+        def fail_third(backend, messages):
+            if len(mail.outbox) == 2:
+                raise ConnectionError('mail server went away')
+            return send_messages(backend, messages)
+
+        with mock.patch.object(EmailBackend, 'send_messages', fail_third):
+            with self.assertRaises(ConnectionError):
+                send_reminders(days=3)
+        sent = {email.to[0] for email in mail.outbox}
+        self.assertEqual(len(sent), 2)
+        self.assertEqual(LoanReminder.objects.values('loan__borrower').distinct().count(), 2)
+
+        send_reminders(days=3)
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertFalse(sent & {email.to[0] for email in mail.outbox[2:]})
+
+    def test_command_dry_run(self):
+        User.objects.filter(pk=self.family.pk).update(email='')
+        stdout = io.StringIO()
+        call_command('send_loan_reminders', '--dry-run', stdout=stdout)
+        self.assertIn('Would send 0 emails for 0 loans, 1 families without email address.', stdout.getvalue())
+        self.assertFalse(LoanReminder.objects.exists())
@@ -0,0 +1,146 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from django.core.cache import cache
+from django.db import connection, connections, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from catalog import routers
+from catalog.importer import CatalogImporter
+from catalog.models import Author, Book, BookInstance, Genre, Language, Loan, User
+from catalog.routers import PrimaryStickinessMiddleware, ReplicaRouter
+
+
+@override_settings(CATALOG_REPLICA_DATABASE='replica')
+class ReplicaRouterTest(TransactionTestCase):
+    """Routing checked with QuerySet.db, which runs no query, see ReplicaDatabaseTest for the queries.
+
+    Not in a TestCase transaction, where every read goes to the primary.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.response = HttpResponse()
+
+    def request(self, view, **cookies):
+        request = RequestFactory().get('/catalog/books/')
+        request.COOKIES.update(cookies)
+        return PrimaryStickinessMiddleware(view)(request)
+
+    def read_databases(self, request):
+        self.databases_read = {model.__name__: model.objects.all().db
+                               for model in (Book, Author, Genre, Language, BookInstance, Loan, User)}
+        return self.response
+
+    def test_catalog_reads_go_to_the_replica(self):
+        response = self.request(self.read_databases)
+        self.assertEqual(self.databases_read, {'Book': 'replica', 'Author': 'replica', 'Genre': 'replica',
+                                               'Language': 'replica', 'BookInstance': 'default', 'Loan': 'default',
+                                               'User': 'default'})
+        self.assertNotIn('catalog_primary', response.cookies)
+
+    def test_writes_go_to_the_primary_and_stick(self):
+        def write_then_read(request):
+            self.assertEqual(Book.objects.all().db, 'replica')
+            Loan.objects.filter(pk=0).update(return_date=None)
+            self.assertEqual(Book.objects.all().db, 'default')
+            return self.response
+
+        response = self.request(write_then_read)
+        self.assertEqual(response.cookies['catalog_primary']['max-age'], 10)
+        # The next requests of the browser, within the replication lag
+        self.request(self.read_databases, catalog_primary='1')
+        self.assertEqual(self.databases_read['Book'], 'default')
+
+    def test_logins_do_not_stick(self):
+        user = User.objects.create_user(username='family')
+
+        def login(request):
+            User.objects.filter(pk=user.pk).update(last_login=None)
+            self.assertEqual(Book.objects.all().db, 'default')
+            return self.response
+
+        response = self.request(login)
+        self.assertNotIn('catalog_primary', response.cookies)
+        self.assertFalse(routers.catalog_recently_written())
+
+    def test_replica_is_not_migrated(self):
+        router = ReplicaRouter()
+        self.assertFalse(router.allow_migrate('replica', 'catalog'))
+        self.assertIsNone(router.allow_migrate('default', 'catalog'))
+        self.assertEqual(router.db_for_write(Book), 'default')
+
+    @override_settings(CATALOG_REPLICA_DATABASE=None)
+    def test_without_replica(self):
+        def write_then_read(request):
+            Loan.objects.filter(pk=0).update(return_date=None)
+            return self.read_databases(request)
+
+        response = self.request(write_then_read)
+        self.assertEqual(self.databases_read['Book'], 'default')
+        self.assertNotIn('catalog_primary', response.cookies)
+
+
+class ReplicaDatabaseTest(TransactionTestCase):
+    """A real replica: a second SQLite database copied from the primary before its last write."""
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        language = Language.objects.create(name='Italian')
+        Book.objects.create(title='Pinocchio', summary='Un burattino', language=language)
+        self.add_replica()
+        Book.objects.create(title='Cuore', summary='Un diario', language=language)
+        # As for a new request, long after the writes
+        cache.clear()
+        routers._use_primary.set(False)
+
+    def add_replica(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'replica.sqlite3')
+        connection.ensure_connection()
+        replica = sqlite3.connect(path)
+        connection.connection.backup(replica)
+        replica.close()
+
+        connections.settings['replica'] = dict(connections.settings['default'], NAME=path, TEST={'NAME': path})
+        self.addCleanup(connections.settings.pop, 'replica')
+        self.addCleanup(self.remove_replica)
+        settings_override = override_settings(CATALOG_REPLICA_DATABASE='replica')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def remove_replica(self):
+        connections['replica'].close()
+        del connections['replica']
+
+    def test_replica_lags(self):
+        self.assertEqual(Book.objects.count(), 1)
+        self.assertEqual(Book.objects.using('default').count(), 2)
+        self.assertNotContains(self.client.get(reverse('books')), 'Cuore')
+
+    def test_reads_in_a_transaction_of_the_primary(self):
+        with transaction.atomic():
+            self.assertEqual(Book.objects.count(), 2)
+
+    def test_lookups_of_the_importer_read_the_primary(self):
+        Author.objects.using('default').create(first_name='Edmondo', last_name='De Amicis')
+        routers._use_primary.set(False)
+        CatalogImporter(thumbnails=False).run([
+            {'title': 'Il romanzo di un maestro', 'author_first_name': 'Edmondo', 'author_last_name': 'De Amicis'}])
+        self.assertEqual(Author.objects.using('default').count(), 1)
+
+    def test_writes_make_every_request_read_the_primary(self):
+        self.assertNotContains(self.client.get(reverse('books')), 'Cuore')
+        # Another user writes, and refills the caches it invalidated from the primary
+        Author.objects.create(first_name='Edmondo', last_name='De Amicis')
+        routers._use_primary.set(False)
+        self.assertContains(self.client.get(reverse('books')), 'Cuore')
+        with override_settings(CATALOG_REPLICA_LAG_SECONDS=0):
+            Author.objects.create(first_name='Carlo', last_name='Collodi')
+        self.assertNotContains(self.client.get(reverse('books')), 'Cuore')
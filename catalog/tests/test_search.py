@@ -0,0 +1,90 @@
+from django.test import TestCase
+from django.urls import reverse
+
+from catalog.models import Author, Book, Genre, Language
+from catalog.search import search_backend, search_books
+
+
+class SearchIndexTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.language = Language.objects.create(name='Italian')
+        cls.collodi = Author.objects.create(first_name='Carlo', last_name='Collodi')
+        cls.rodari = Author.objects.create(first_name='Gianni', last_name='Rodari')
+        cls.fiabe = Genre.objects.create(name='Fiabe')
+        cls.pinocchio = Book.objects.create(title='Le avventure di Pinocchio', summary='Un burattino di legno.',
+                                            author=cls.collodi, language=cls.language)
+        cls.pinocchio.genre.add(cls.fiabe)
+        cls.cipollino = Book.objects.create(title='Il romanzo di Cipollino', summary='Pinocchio non c\'entra.',
+                                            author=cls.rodari, language=cls.language)
+
+    def test_uses_fts5_on_sqlite(self):
+        self.assertEqual(search_backend(), 'fts5')
+
+    def test_matches_title_summary_author_and_genre(self):
+        self.assertEqual(search_books('cipollino'), [self.cipollino.pk])
+        self.assertEqual(search_books('burattino'), [self.pinocchio.pk])
+        self.assertEqual(search_books('Collodi'), [self.pinocchio.pk])
+        self.assertEqual(search_books('fiabe'), [self.pinocchio.pk])
+
+    def test_prefixes_and_all_words(self):
+        self.assertEqual(search_books('rod cip'), [self.cipollino.pk])
+        self.assertEqual(search_books('rodari pinocchio'), [self.cipollino.pk])
+        self.assertEqual(search_books('rodari burattino'), [])
+        self.assertEqual(search_books('  "*( '), [])
+
+    def test_title_match_ranks_first(self):
+        self.assertEqual(search_books('pinocchio'), [self.pinocchio.pk, self.cipollino.pk])
+
+    def test_index_follows_edits(self):
+        self.cipollino.title = 'Gip nel televisore'
+        self.cipollino.save()
+        self.assertEqual(search_books('cipollino'), [])
+        self.assertEqual(search_books('televisore'), [self.cipollino.pk])
+
+        self.rodari.last_name = 'Rodari Gianni'
+        self.rodari.first_name = 'Maestro'
+        self.rodari.save()
+        self.assertEqual(search_books('maestro'), [self.cipollino.pk])
+
+        self.cipollino.genre.add(self.fiabe)
+        self.assertCountEqual(search_books('fiabe'), [self.pinocchio.pk, self.cipollino.pk])
+        self.fiabe.book_set.clear()
+        self.assertEqual(search_books('fiabe'), [])
+
+    def test_index_follows_deletes(self):
+        self.fiabe.delete()
+        self.assertEqual(search_books('fiabe'), [])
+        self.collodi.delete()
+        self.assertEqual(search_books('collodi'), [])
+        self.assertEqual(search_books('burattino'), [self.pinocchio.pk])
+        self.pinocchio.delete()
+        self.assertEqual(search_books('burattino'), [])
+
+
+class BookSearchViewTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        language = Language.objects.create(name='Italian')
+        author = Author.objects.create(first_name='Gianni', last_name='Rodari')
+        for number in range(15):
+            Book.objects.create(title='Favola {}'.format(number), summary='', author=author, language=language)
+
+    def test_empty_query(self):
+        response = self.client.get(reverse('search'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'catalog/book_search.html')
+        self.assertEqual(list(response.context['book_list']), [])
+
+    def test_paginates_ranked_results(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('search'), {'q': 'rodari'})
+        self.assertEqual(len(response.context['book_list']), 12)
+        self.assertTrue(response.context['is_paginated'])
+        self.assertContains(response, 'q=rodari&amp;page=2')
+
+        response = self.client.get(reverse('search'), {'q': 'rodari', 'page': 2})
+        self.assertEqual(len(response.context['book_list']), 3)
+        self.assertTrue(all(isinstance(book, Book) for book in response.context['book_list']))
@@ -0,0 +1,67 @@
+import io
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from catalog.models import Book, Language
+from catalog.thumbnails import THUMBNAIL_FORMATS, THUMBNAIL_SIZES, cover_thumbnail_url, thumbnail_name
+
+
+def make_cover(width=800, height=1000):
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), 'red').save(buffer, 'JPEG')
+    return ContentFile(buffer.getvalue(), name='cover.jpg')
+
+
+class CoverThumbnailTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.language = Language.objects.create(name='Italian')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def create_book(self):
+        book = Book(title='Pinocchio', summary='Un burattino', language=self.language)
+        book.cover.save('cover.jpg', make_cover(), save=False)
+        book.save()
+        return book
+
+    def test_thumbnails_built_on_save(self):
+        book = self.create_book()
+        for size, (width, height, crop) in THUMBNAIL_SIZES.items():
+            for fmt in THUMBNAIL_FORMATS:
+                name = thumbnail_name(book.cover.name, size, fmt)
+                self.assertTrue(default_storage.exists(name))
+                with default_storage.open(name) as thumbnail:
+                    image = Image.open(thumbnail)
+                    self.assertLessEqual(image.width, width)
+                    self.assertLessEqual(image.height, height)
+                    if crop:
+                        self.assertEqual(image.size, (width, height))
+
+    def test_covers_with_the_same_file_name(self):
+        names = {thumbnail_name(cover, 'grid', 'jpeg') for cover in ('covers/a/x.jpg', 'covers/b/x.png', 'covers/x.jpg')}
+        self.assertEqual(len(names), 3)
+
+    def test_url_falls_back_to_original_cover(self):
+        book = self.create_book()
+        self.assertTrue(cover_thumbnail_url(book.cover, 'grid', 'webp').endswith('.webp'))
+        default_storage.delete(thumbnail_name(book.cover.name, 'grid', 'webp'))
+        self.assertEqual(cover_thumbnail_url(book.cover, 'grid', 'webp'), book.cover.url)
+
+    def test_book_list_uses_grid_thumbnails(self):
+        book = self.create_book()
+        response = self.client.get('/catalog/books/')
+        self.assertContains(response, cover_thumbnail_url(book.cover, 'grid', 'jpeg'))
+        self.assertNotContains(response, 'url({0})'.format(book.cover.url))
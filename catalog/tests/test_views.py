@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 # Create your tests here.
 
@@ -355,3 +355,437 @@ class AuthorCreateViewTest(TestCase):
         # Manually check redirect because we don't know what author was created
         self.assertEqual(response.status_code, 302)
         self.assertTrue(response.url.startswith('/catalog/author/'))
+
+
+from catalog.models import Loan
+from catalog.models import User as LibraryUser
+from django.conf import settings
+from django.contrib.sessions.models import Session
+
+
+class BookListViewAvailableOnlyTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        borrower = LibraryUser.objects.create_user(username='family', password='1X<ISRUkw+tuK')
+        language = Language.objects.create(name='Italian')
+        for book_id in range(15):
+            book = Book.objects.create(title='Book {0:02d}'.format(book_id), summary='Summary',
+                                       language=language, cover='covers/book.jpg')
+            copy = BookInstance.objects.create(book=book, imprint='Imprint')
+            if book_id % 2:
+                Loan.objects.create(book_instance=copy, borrower=borrower, loan_date=datetime.date.today())
+
+    def set_available_only(self):
+        self.client.get(reverse('books') + '?available_only=1')
+
+    def test_lists_all_books_by_default(self):
+        response = self.client.get(reverse('books') + '?page=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['paginator'].count, 15)
+
+    def test_available_only_filters_before_paginating(self):
+        self.set_available_only()
+        response = self.client.get(reverse('books') + '?page=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['paginator'].count, 8)
+        self.assertEqual(len(response.context['book_list']), 8)
+        self.assertTrue(all(book.is_available for book in response.context['book_list']))
+
+    def test_available_only_query_count_does_not_depend_on_page_size(self):
+        self.set_available_only()
+        # page of books
+        with self.assertNumQueries(1):
+            self.client.get(reverse('books'))
+
+    def test_toggle_writes_no_session(self):
+        response = self.client.get(reverse('books') + '?available_only=1')
+        self.assertContains(response, 'href="/catalog/books/?available_only=0"')
+        self.assertContains(response, 'button-on.png')
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertFalse(Session.objects.exists())
+        response = self.client.get(reverse('books') + '?available_only=0')
+        self.assertContains(response, 'button-off.png')
+        self.assertEqual(response.context['paginator'], None)
+        self.assertEqual(len(response.context['book_list']), 12)
+
+    def test_tampered_cookie_is_ignored(self):
+        self.client.cookies['available_only'] = '1'
+        response = self.client.get(reverse('books') + '?page=1')
+        self.assertEqual(response.context['paginator'].count, 15)
+
+    def test_old_toggle_links_set_the_cookie(self):
+        response = self.client.get(reverse('toggle-available-only') + '?next=/catalog/books/')
+        self.assertRedirects(response, reverse('books'))
+        self.assertEqual(self.client.get(reverse('books') + '?page=1').context['paginator'].count, 8)
+
+
+class BookDetailViewQueryCountTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.borrower = LibraryUser.objects.create_user(username='family', password='1X<ISRUkw+tuK')
+        language = Language.objects.create(name='Italian')
+        cls.book = Book.objects.create(title='Pinocchio', summary='Un burattino', language=language,
+                                       author=Author.objects.create(first_name='Carlo', last_name='Collodi'),
+                                       cover='covers/pinocchio.jpg')
+        cls.book.genre.add(Genre.objects.create(name='Fiabe'))
+
+    def add_copies(self, number_of_copies):
+        for copy_id in range(number_of_copies):
+            copy = BookInstance.objects.create(book=self.book, imprint='Imprint {0}'.format(copy_id))
+            if copy_id % 3 == 1:
+                Loan.objects.create(book_instance=copy, borrower=self.borrower, loan_date=datetime.date.today())
+            elif copy_id % 3 == 2:
+                Loan.objects.create(book_instance=copy, borrower=self.borrower, reserved_date=datetime.date.today())
+
+    def test_copies_status_is_rendered(self):
+        self.add_copies(3)
+        response = self.client.get(self.book.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Available')
+        self.assertContains(response, 'On loan')
+        self.assertContains(response, 'Reserved')
+
+    def test_query_count_does_not_depend_on_copies(self):
+        self.add_copies(1)
+        # book with author and language, genres, copies, open loans
+        with self.assertNumQueries(4):
+            self.client.get(self.book.get_absolute_url())
+        self.add_copies(9)
+        with self.assertNumQueries(4):
+            self.client.get(self.book.get_absolute_url())
+
+
+from django.core.cache import cache
+
+
+class IndexViewStatsCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.language = Language.objects.create(name='Italian')
+        self.book = Book.objects.create(title='Pinocchio', summary='Un burattino', language=self.language,
+                                        cover='covers/pinocchio.jpg')
+        BookInstance.objects.create(book=self.book, imprint='Giunti, 2001')
+
+    def test_cache_hit_does_no_database_work(self):
+        with self.assertNumQueries(4):
+            self.client.get(reverse('index'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['num_books'], 1)
+        self.assertEqual(response.context['num_instances_available'], 1)
+
+    def test_stats_invalidated_on_writes(self):
+        self.client.get(reverse('index'))
+        with self.captureOnCommitCallbacks(execute=True):
+            copy = BookInstance.objects.create(book=self.book, imprint='Mondadori, 2010')
+            borrower = LibraryUser.objects.create_user(username='family', password='1X<ISRUkw+tuK')
+            Loan.objects.create(book_instance=copy, borrower=borrower, loan_date=datetime.date.today())
+            Author.objects.create(first_name='Carlo', last_name='Collodi')
+            # Until the commit, the cached counts stay
+            self.assertEqual(self.client.get(reverse('index')).context['num_instances'], 1)
+
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['num_instances'], 2)
+        self.assertEqual(response.context['num_instances_available'], 1)
+        self.assertEqual(response.context['num_authors'], 1)
+
+
+class LoanedBooksAllListViewTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        LibraryUser.objects.create_superuser(username='librarian', email='librarian@example.com',
+                                             password='1X<ISRUkw+tuK')
+        borrower = LibraryUser.objects.create_user(username='family', password='2HJ1vRV0Z&3iD')
+        language = Language.objects.create(name='Italian')
+        book = Book.objects.create(title='Pinocchio', summary='Un burattino', language=language,
+                                   cover='covers/pinocchio.jpg')
+        today = datetime.date.today()
+        for number in range(36):
+            copy = BookInstance.objects.create(book=book, imprint='Imprint {0}'.format(number))
+            if number % 3 == 0:
+                Loan.objects.create(book_instance=copy, borrower=borrower, loan_date=today)
+            elif number % 3 == 1:
+                Loan.objects.create(book_instance=copy, borrower=borrower, reserved_date=today)
+            else:
+                Loan.objects.create(book_instance=copy, borrower=borrower, loan_date=today - datetime.timedelta(days=20),
+                                    return_date=today)
+
+    def setUp(self):
+        cache.clear()
+        self.client.login(username='librarian', password='1X<ISRUkw+tuK')
+
+    def test_sections_are_filtered_and_paginated_separately(self):
+        response = self.client.get(reverse('all-borrowed'))
+        self.assertEqual(response.status_code, 200)
+        for section, check in (('loans_page', 'is_loan'), ('reservations_page', 'is_reservation')):
+            page = response.context[section]
+            self.assertEqual(page.paginator.count, 12)
+            self.assertEqual(len(page.object_list), 10)
+            self.assertTrue(all(getattr(loan, check) for loan in page))
+        self.assertTrue(all(loan.return_date for loan in response.context['past_loans_page']))
+
+        response = self.client.get(reverse('all-borrowed') + '?reservations_page=2')
+        self.assertEqual(len(response.context['reservations_page'].object_list), 2)
+        self.assertEqual(len(response.context['loans_page'].object_list), 10)
+
+    def test_query_count_does_not_depend_on_rows(self):
+        # session, user, loan summary (cold cache), count and page of each of the three sections
+        with self.assertNumQueries(9):
+            self.client.get(reverse('all-borrowed'))
+
+
+from catalog.caching import get_loan_summary
+from catalog.circulation import CirculationError, check_out_copies, reserve_copy
+
+
+class LoanSummaryTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.family = LibraryUser.objects.create_user(
+            username='family', password='1X<ISRUkw+tuK',
+            library_card_until=datetime.date.today() + datetime.timedelta(days=30))
+        language = Language.objects.create(name='Italian')
+        self.book = Book.objects.create(title='Pinocchio', summary='Un burattino', language=language,
+                                        cover='covers/pinocchio.jpg')
+        self.copies = [BookInstance.objects.create(book=self.book, imprint='Imprint {0}'.format(number))
+                       for number in range(3)]
+        today = datetime.date.today()
+        Loan.objects.create(book_instance=self.copies[0], borrower=self.family,
+                            loan_date=today - datetime.timedelta(days=30))
+        Loan.objects.create(book_instance=self.copies[1], borrower=self.family, loan_date=today)
+
+    def test_summary_counts(self):
+        summary = get_loan_summary(self.family)
+        self.assertEqual(summary.open_loans, 2)
+        self.assertEqual(summary.open_reservations, 0)
+        self.assertEqual(summary.overdue, 1)
+        self.assertEqual(summary.remaining_quota, 1)
+
+    def test_cache_hit_costs_no_query(self):
+        get_loan_summary(self.family)
+        with self.assertNumQueries(0):
+            get_loan_summary(self.family)
+
+    def test_loan_changes_bump_the_summary(self):
+        get_loan_summary(self.family)
+        with self.captureOnCommitCallbacks(execute=True):
+            Loan.objects.create(book_instance=self.copies[2], borrower=self.family,
+                                reserved_date=datetime.date.today())
+            # Until the commit, the cached summary stays
+            self.assertEqual(get_loan_summary(self.family).open_reservations, 0)
+        summary = get_loan_summary(self.family)
+        self.assertEqual(summary.open_reservations, 1)
+        self.assertEqual(summary.remaining_quota, 0)
+
+    def test_checked_out_reservation_counts_against_quota(self):
+        reservation = Loan.objects.create(book_instance=self.copies[2], borrower=self.family,
+                                          reserved_date=datetime.date.today())
+        with self.captureOnCommitCallbacks(execute=True):
+            check_out_copies([self.copies[2].pk])
+        reservation.refresh_from_db()
+        self.assertIsNotNone(reservation.loan_date)
+        summary = get_loan_summary(self.family)
+        self.assertEqual((summary.open_reservations, summary.remaining_quota), (0, 0))
+        with self.assertRaisesMessage(CirculationError, 'Already reached the maximum number of 1 Reserved books.'):
+            reserve_copy(self.family, self.copies[2].pk)
+
+    def test_reserve_refused_over_quota(self):
+        Loan.objects.create(book_instance=self.copies[2], borrower=self.family,
+                            reserved_date=datetime.date.today())
+        self.client.login(username='family', password='1X<ISRUkw+tuK')
+        response = self.client.get(reverse('reserve-book', args=[self.copies[2].pk]), follow=True)
+        self.assertContains(response, 'Already reached the maximum number of 1 Reserved books.')
+
+    def test_reserve_not_refused_from_stale_summary(self):
+        reservation = Loan.objects.create(book_instance=self.copies[2], borrower=self.family,
+                                          reserved_date=datetime.date.today())
+        self.assertEqual(get_loan_summary(self.family).remaining_quota, 0)
+        # Cancelled without bumping the cached summary, like by a worker with another cache
+        Loan.objects.filter(pk=reservation.pk).update(return_date=datetime.date.today())
+        self.client.login(username='family', password='1X<ISRUkw+tuK')
+        self.client.get(reverse('reserve-book', args=[self.copies[2].pk]))
+        self.assertTrue(Loan.objects.filter(book_instance=self.copies[2], return_date__isnull=True).exists())
+
+    def test_navigation_badge(self):
+        self.client.login(username='family', password='1X<ISRUkw+tuK')
+        response = self.client.get(reverse('index'))
+        self.assertContains(response, 'My Borrowed (2)')
+
+
+from django.core.cache import cache
+
+
+@override_settings(CATALOG_CONDITIONAL_GET=True)
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        language = Language.objects.create(name='Italian')
+        self.author = Author.objects.create(first_name='Carlo', last_name='Collodi')
+        self.genre = Genre.objects.create(name='Fiabe')
+        self.book = Book.objects.create(title='Pinocchio', summary='Un burattino', author=self.author,
+                                        language=language, cover='covers/pinocchio.jpg')
+        self.book.genre.add(self.genre)
+        self.copy = BookInstance.objects.create(book=self.book, imprint='Giunti')
+        self.family = LibraryUser.objects.create_user(username='family', password='1X<ISRUkw+tuK')
+
+    def assertNotModified(self, url, response):
+        with self.assertNumQueries(0):
+            again = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+
+    def assertModified(self, url, response):
+        again = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 200)
+
+    def test_unchanged_pages_are_not_modified(self):
+        for url in (reverse('books'), self.book.get_absolute_url(), self.author.get_absolute_url(),
+                    self.genre.get_absolute_url(), reverse('authors'), reverse('genres')):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertTrue(response.has_header('Last-Modified'))
+                self.assertNotModified(url, response)
+                again = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+                self.assertEqual(again.status_code, 304)
+
+    def test_loan_changes_book_page(self):
+        url = self.book.get_absolute_url()
+        book_page = self.client.get(url)
+        genre_page = self.client.get(self.genre.get_absolute_url())
+        with self.captureOnCommitCallbacks(execute=True):
+            Loan.objects.create(book_instance=self.copy, borrower=self.family, loan_date=datetime.date.today())
+            # Until the commit, other requests still see the page as it was
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=book_page['ETag']).status_code, 304)
+        self.assertModified(url, book_page)
+        self.assertNotModified(self.genre.get_absolute_url(), genre_page)
+
+    def test_author_and_genre_changes(self):
+        book_page = self.client.get(self.book.get_absolute_url())
+        author_page = self.client.get(self.author.get_absolute_url())
+        genre_page = self.client.get(self.genre.get_absolute_url())
+
+        self.author.first_name = 'C.'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.save()
+        self.assertModified(self.book.get_absolute_url(), book_page)
+        self.assertModified(self.author.get_absolute_url(), author_page)
+        self.assertNotModified(self.genre.get_absolute_url(), genre_page)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.genre.clear()
+        self.assertModified(self.genre.get_absolute_url(), genre_page)
+
+    def test_copies_change_author_page(self):
+        author_page = self.client.get(self.author.get_absolute_url())
+        with self.captureOnCommitCallbacks(execute=True):
+            BookInstance.objects.create(book=self.book, imprint='Feltrinelli')
+        self.assertModified(self.author.get_absolute_url(), author_page)
+
+    def test_etag_depends_on_user(self):
+        url = self.book.get_absolute_url()
+        anonymous = self.client.get(url)
+        self.client.force_login(self.family)
+        response = self.client.get(url)
+        self.assertNotEqual(response['ETag'], anonymous['ETag'])
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Loan.objects.create(book_instance=BookInstance.objects.create(book=Book.objects.create(
+                title='Cuore', summary='', language=self.book.language)), borrower=self.family,
+                loan_date=datetime.date.today())
+        # The navigation counts the loans of the user
+        self.assertModified(url, response)
+
+    @override_settings(CATALOG_CONDITIONAL_GET=False)
+    def test_disabled_without_a_shared_cache(self):
+        response = self.client.get(reverse('books'))
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+
+
+import time
+from unittest import mock
+
+from catalog.caching import PER_WORKER_TIMEOUT
+
+
+class BookTileCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        language = Language.objects.create(name='Italian')
+        cls.genre = Genre.objects.create(name='Fiabe')
+        for number in range(15):
+            book = Book.objects.create(title='Fiaba {0:02d}'.format(number), summary='', language=language,
+                                       cover='covers/fiaba.jpg')
+            book.genre.add(cls.genre)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_tiles_are_cached_until_the_book_is_saved(self):
+        book = Book.objects.get(title='Fiaba 00')
+        self.assertContains(self.client.get(reverse('books')), 'title="Fiaba 00"')
+        # Not seen by the cache: no signal sent
+        Book.objects.filter(pk=book.pk).update(title='Fiaba 00 bis')
+        self.assertContains(self.client.get(reverse('books')), 'title="Fiaba 00"')
+
+        book.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            book.save()
+        self.assertContains(self.client.get(reverse('books')), 'title="Fiaba 00 bis"')
+
+    @override_settings(CATALOG_SHARED_CACHE=False)
+    def test_per_worker_cache_keeps_tiles_minutes(self):
+        self.assertContains(self.client.get(reverse('books')), 'title="Fiaba 00"')
+        # Changed by another worker: this worker's cache is not told
+        Book.objects.filter(title='Fiaba 00').update(title='Fiaba 00 bis')
+        later = time.time() + PER_WORKER_TIMEOUT + 1
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later):
+            self.assertContains(self.client.get(reverse('books')), 'title="Fiaba 00 bis"')
+
+    @override_settings(CATALOG_SHARED_CACHE=True)
+    def test_shared_cache_keeps_tiles_until_the_book_is_saved(self):
+        self.assertContains(self.client.get(reverse('books')), 'title="Fiaba 00"')
+        Book.objects.filter(title='Fiaba 00').update(title='Fiaba 00 bis')
+        later = time.time() + PER_WORKER_TIMEOUT + 1
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later):
+            self.assertContains(self.client.get(reverse('books')), 'title="Fiaba 00"')
+
+    def test_genre_books_are_paginated(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(self.genre.get_absolute_url())
+        self.assertEqual(len(response.context['book_list']), 12)
+        self.assertTrue(response.context['is_paginated'])
+        response = self.client.get(self.genre.get_absolute_url(), {'cursor': response.context['page_obj'].next_cursor})
+        self.assertEqual([book.title for book in response.context['book_list']], ['Fiaba 12', 'Fiaba 13', 'Fiaba 14'])
+        self.assertContains(response, 'title="Fiaba 14"')
+
+
+class AuthorDetailViewQueryCountTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        language = Language.objects.create(name='Italian')
+        cls.author = Author.objects.create(first_name='Gianni', last_name='Rodari')
+        Book.objects.bulk_create([
+            Book(title='Favola {0:03d}'.format(number), summary='', author=cls.author, language=language)
+            for number in range(200)
+        ])
+        books = Book.objects.filter(author=cls.author).order_by('title')
+        BookInstance.objects.bulk_create([BookInstance(book=book, imprint='Einaudi')
+                                          for number, book in enumerate(books) for _ in range(number % 3)])
+
+    def test_prolific_author_in_two_queries(self):
+        # author, books with their number of copies
+        with self.assertNumQueries(2):
+            response = self.client.get(self.author.get_absolute_url())
+        self.assertEqual(len(response.context['author'].books), 200)
+        self.assertContains(response, 'Favola 002</a> (2)')
+        self.assertContains(response, 'Favola 003</a> (0)')
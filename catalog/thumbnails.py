@@ -0,0 +1,95 @@
+"""Fixed size thumbnails of Book.cover, in WebP and JPEG.
+
+Thumbnails are stored next to the covers as covers/thumbnails/<size>/<cover name>-<hash>.<ext>,
+they are built when a book is saved (see catalog/signals.py) and can be backfilled
+with the generate_thumbnails management command.
+"""
+import hashlib
+import io
+import logging
+import os
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_DIR = 'covers/thumbnails'
+
+# name: (width, height, crop), crop fills the box like the 4x6 tiles of the book grids,
+# otherwise the cover keeps its aspect ratio. Sizes are twice the CSS size for high-DPI screens.
+THUMBNAIL_SIZES = {
+    'grid': (384, 576, True),
+    'detail': (600, 900, False),
+}
+
+# format: (PIL format, file extension, save options)
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def thumbnail_name(cover_name, size, fmt):
+    """Storage name of the thumbnail of a cover.
+
+    The hash of the whole cover name keeps covers of the same file name in different
+    directories (or with different extensions) from sharing thumbnails.
+    """
+    stem = os.path.splitext(os.path.basename(cover_name))[0]
+    digest = hashlib.md5(cover_name.encode()).hexdigest()[:8]
+    return '{0}/{1}/{2}-{3}.{4}'.format(THUMBNAIL_DIR, size, stem, digest, THUMBNAIL_FORMATS[fmt][1])
+
+
+def has_thumbnails(cover_name, storage=default_storage):
+    return all(storage.exists(thumbnail_name(cover_name, size, fmt))
+               for size in THUMBNAIL_SIZES for fmt in THUMBNAIL_FORMATS)
+
+
+def generate_thumbnails(cover_name, storage=default_storage):
+    """Build every size and format of the thumbnails of a cover, replacing existing ones."""
+    with storage.open(cover_name) as cover:
+        image = Image.open(cover)
+        image = ImageOps.exif_transpose(image).convert('RGB')
+
+    for size, (width, height, crop) in THUMBNAIL_SIZES.items():
+        if crop:
+            thumbnail = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        else:
+            thumbnail = image.copy()
+            thumbnail.thumbnail((width, height), Image.LANCZOS)
+        for fmt, (pil_format, _, options) in THUMBNAIL_FORMATS.items():
+            buffer = io.BytesIO()
+            thumbnail.save(buffer, pil_format, **options)
+            name = thumbnail_name(cover_name, size, fmt)
+            if storage.exists(name):
+                storage.delete(name)
+            storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def ensure_thumbnails(cover_name, force=False):
+    """Build the thumbnails of a cover if they are missing, logging rather than raising on bad images.
+
+    Returns True when thumbnails were built.
+    """
+    if not cover_name or not default_storage.exists(cover_name):
+        return False
+    if not force and has_thumbnails(cover_name):
+        return False
+    try:
+        generate_thumbnails(cover_name)
+    except (OSError, ValueError):
+        logger.exception("Cannot build the thumbnails of %s", cover_name)
+        return False
+    return True
+
+
+def cover_thumbnail_url(cover, size='grid', fmt='jpeg'):
+    """URL of a cover thumbnail, falling back to the original cover while it is not built."""
+    if not cover:
+        return ''
+    name = thumbnail_name(cover.name, size, fmt)
+    if cover.storage.exists(name):
+        return cover.storage.url(name)
+    return cover.url
@@ -7,6 +7,7 @@ urlpatterns = [
     # path('', views.index, name='index'),
     path('books/', views.BookListView.as_view(), name='books'),
     path('toggle-available-only/', views.toggle_available_only, name='toggle-available-only'),
+    path('search/', views.BookSearchView.as_view(), name='search'),
     path('book/<int:pk>', views.BookDetailView.as_view(), name='book-detail'),
     path('authors/', views.AuthorListView.as_view(), name='authors'),
     path('author/<int:pk>',
@@ -28,4 +29,6 @@ urlpatterns += [
     path('loan/<int:pk>/renew/', views.renew_book_librarian, name='renew-book-librarian'),
     path('loan/<uuid:pk>/reserve/', views.reserve_book, name='reserve-book'),
     path('loan/<int:pk>/cancel/', views.cancel_reservation, name='cancel-reservation'),
+    path('loan-desk/', views.loan_desk, name='loan-desk'),
+    path('loans/export/', views.export_loans, name='export-loans'),
 ]
@@ -1,71 +1,213 @@
+import datetime
+import hashlib
 from datetime import date
+from functools import wraps
+from django.conf import settings
 from django.shortcuts import render
-from django.db.models import Count
+from django.db.models import Count, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
 from django.http import HttpResponseRedirect
 
 # Create your views here.
 
 from .models import Book, Author, BookInstance, Genre, Loan
+from .caching import get_catalog_version, get_homepage_stats, get_loan_summary_version
+from .pagination import CursorPaginationMixin, CursorPaginator
+from .search import search_books
+
+# The "show only available books" preference: the ?available_only=1 (or 0) parameter of
+# BookListView, remembered in a signed cookie so that browsing needs no session
+AVAILABLE_ONLY = 'available_only'
+AVAILABLE_ONLY_SALT = 'catalog.available_only'
+AVAILABLE_ONLY_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def get_available_only(request):
+    """The preference of the request: its query parameter, else its cookie."""
+    if AVAILABLE_ONLY in request.GET:
+        return request.GET[AVAILABLE_ONLY] == '1'
+    return request.get_signed_cookie(AVAILABLE_ONLY, default='0', salt=AVAILABLE_ONLY_SALT) == '1'
+
+
+def set_available_only_cookie(response, available_only):
+    response.set_signed_cookie(AVAILABLE_ONLY, '1' if available_only else '0', salt=AVAILABLE_ONLY_SALT,
+                               max_age=AVAILABLE_ONLY_MAX_AGE, httponly=True, samesite='Lax')
+
+
+def remember_available_only(view_func):
+    """Store the ?available_only= parameter in the cookie, on 304 Not Modified responses too."""
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        response = view_func(request, *args, **kwargs)
+        if AVAILABLE_ONLY in request.GET:
+            set_available_only_cookie(response, get_available_only(request))
+        return response
+    return wrapper
+
 
 def toggle_available_only(request):
-    if "available_only" in request.session:
-        request.session["available_only"] = not request.session["available_only"]
-    else:
-        request.session["available_only"] = True
-    return HttpResponseRedirect(request.GET.get('next', "/books"))
+    """Links from before the ?available_only= parameter: flip the cookie and go back."""
+    response = HttpResponseRedirect(request.GET.get('next', "/books"))
+    set_available_only_cookie(response, not get_available_only(request))
+    return response
 
 def index(request):
     """View function for home page of site."""
-    # Generate counts of some of the main objects
-    num_books = Book.objects.all().count()
-    num_instances = BookInstance.objects.all().count()
-    # Available copies of books
-    num_instances_available = num_instances - Loan.objects.filter(return_date__isnull=True).count()
-    num_authors = Author.objects.count()  # The 'all()' is implied by default.
+    # Counts of some of the main objects, cached until one of them changes
+    stats = get_homepage_stats()
 
     # Render the HTML template index.html with the data in the context variable.
     return render(
         request,
         'index.html',
-        context={'num_books': num_books, 'num_instances': num_instances,
-                 'num_instances_available': num_instances_available, 'num_authors': num_authors,
-                 },
+        context=stats,
     )
 
 
+from django.contrib import messages
+from django.utils.decorators import method_decorator
 from django.views import generic
+from django.views.decorators.http import condition
+
+
+def catalog_page_condition(model_name=None):
+    """Conditional GET of a catalog page, on the version of the catalog or of the model_name object.
+
+    A 304 Not Modified runs no query when the user is anonymous (one session lookup
+    otherwise) and renders no template. Disabled unless CATALOG_CONDITIONAL_GET, that
+    is with a cache shared by every worker.
+    """
+    def versions(request, pk=None):
+        if model_name is None:
+            return [get_catalog_version()]
+        return [get_catalog_version(model_name, pk)]
+
+    def etag(request, pk=None, **kwargs):
+        if not settings.CATALOG_CONDITIONAL_GET or len(messages.get_messages(request)):
+            # Pending messages are shown, and consumed, by the next page rendered
+            return None
+        parts = versions(request, pk) + [get_available_only(request)]
+        if request.user.is_authenticated:
+            # The navigation shows the user and the counts of their loan summary
+            parts += [request.user.pk, get_loan_summary_version(request.user), date.today()]
+        return hashlib.md5(repr(parts).encode()).hexdigest()
+
+    def last_modified(request, pk=None, **kwargs):
+        # Only anonymous pages depend on nothing but the catalog
+        if (not settings.CATALOG_CONDITIONAL_GET or request.user.is_authenticated
+                or len(messages.get_messages(request))):
+            return None
+        return datetime.datetime.fromtimestamp(max(versions(request, pk)), datetime.timezone.utc)
 
+    return method_decorator(condition(etag_func=etag, last_modified_func=last_modified), name='dispatch')
 
-class BookListView(generic.ListView):
+
+
+@method_decorator(remember_available_only, name='dispatch')
+@catalog_page_condition()
+class BookListView(CursorPaginationMixin, generic.ListView):
     """Generic class-based view for a list of books."""
     model = Book
     paginate_by = 12
+    # Book.Meta.ordering, with the id to break ties
+    cursor_fields = ('title', 'author', 'id')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if get_available_only(self.request):
+            # Filter before paginating so that every page is full
+            queryset = queryset.filter(available_copies__gt=0)
+        return queryset
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['available_only'] = get_available_only(self.request)
+        return context
 
+
+@catalog_page_condition('book')
 class BookDetailView(generic.DetailView):
     """Generic class-based detail view for a book."""
     model = Book
 
+    def get_queryset(self):
+        # Load the copies and their open loan in one go, BookInstance.loan reads open_loans
+        open_loans = Prefetch('bookinstance_set__loan_set',
+                              queryset=Loan.objects.filter(return_date__isnull=True),
+                              to_attr='open_loans')
+        return (Book.objects.select_related('author', 'language')
+                .prefetch_related('genre', 'bookinstance_set', open_loans))
+
+
+class BookSearchView(generic.ListView):
+    """Books matching the q query parameter, best match first."""
+    template_name = 'catalog/book_search.html'
+    context_object_name = 'book_list'
+    paginate_by = 12
 
-class AuthorListView(generic.ListView):
+    def get_queryset(self):
+        # Ranked ids from the search index, only the books of the current page are loaded
+        return search_books(self.request.GET.get('q', ''))
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator, page, book_ids, is_paginated = super().paginate_queryset(queryset, page_size)
+        books = Book.objects.in_bulk(book_ids)
+        page.object_list = [books[pk] for pk in book_ids if pk in books]
+        return paginator, page, page.object_list, is_paginated
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['query'] = self.request.GET.get('q', '')
+        return context
+
+
+def book_count(field):
+    """Number of books of the outer author or genre, only computed for the rows of the page."""
+    books = (Book.objects.filter(**{field: OuterRef('pk')}).order_by()
+             .values(field).annotate(count=Count('pk')).values('count'))
+    return Coalesce(Subquery(books), 0)
+
+
+@catalog_page_condition()
+class AuthorListView(CursorPaginationMixin, generic.ListView):
     """Generic class-based list view for a list of authors."""
     model = Author
     paginate_by = 20
-    queryset = Author.objects.all().annotate(book_count=Count("book"))
+    queryset = Author.objects.all().annotate(book_count=book_count('author'))
+    cursor_fields = ('last_name', 'first_name', 'id')
 
 
+@catalog_page_condition('author')
 class AuthorDetailView(generic.DetailView):
     """Generic class-based detail view for an author."""
     model = Author
 
-class GenreListView(generic.ListView):
+    def get_queryset(self):
+        # The books of the author with their number of copies in one query, whatever their number
+        books = Book.objects.annotate(copy_count=Count('bookinstance')).order_by('title', 'pk')
+        return Author.objects.prefetch_related(Prefetch('book_set', queryset=books, to_attr='books'))
+
+@catalog_page_condition()
+class GenreListView(CursorPaginationMixin, generic.ListView):
     model = Genre
     paginate_by = 20
-    queryset = Genre.objects.all().annotate(book_count=Count("book"))
+    queryset = Genre.objects.all().annotate(book_count=book_count('genre'))
+    cursor_fields = ('name', 'id')
 
 
+@catalog_page_condition('genre')
 class GenreDetailView(generic.DetailView):
     model = Genre
+    paginate_by = 12
+
+    def get_context_data(self, **kwargs):
+        # The books of the genre are paginated like BookListView, with cached tiles
+        context = super().get_context_data(**kwargs)
+        page = CursorPaginator(self.object.book_set.all(), BookListView.cursor_fields, self.paginate_by).get_page(
+            self.request.GET.get('cursor'))
+        context.update(paginator=None, page_obj=page, is_paginated=page.has_other_pages(),
+                       book_list=page.object_list)
+        return context
 
 from django.contrib.auth.mixins import LoginRequiredMixin
 
@@ -77,22 +219,40 @@ class LoanedBooksByUserListView(LoginRequiredMixin, generic.ListView):
     paginate_by = 10
 
     def get_queryset(self):
-        return Loan.objects.filter(borrower=self.request.user).order_by('due_date')
+        return (Loan.objects.filter(borrower=self.request.user)
+                .select_related('book_instance__book').order_by('due_date'))
 
 
 # Added as part of challenge!
 from django.contrib.auth.mixins import PermissionRequiredMixin
+from django.core.paginator import Paginator
+
 
+class LoanedBooksAllListView(PermissionRequiredMixin, generic.TemplateView):
+    """Generic class-based view listing all books on loan. Only visible to users with can_mark_returned permission.
 
-class LoanedBooksAllListView(PermissionRequiredMixin, generic.ListView):
-    """Generic class-based view listing all books on loan. Only visible to users with can_mark_returned permission."""
-    model = BookInstance
+    Loans, reservations and past loans are filtered in SQL and paginated separately,
+    with the <section>_page query parameters.
+    """
     permission_required = 'catalog.can_mark_returned'
     template_name = 'catalog/bookinstance_list_borrowed_all.html'
     paginate_by = 10
 
-    def get_queryset(self):
-        return Loan.objects.order_by('due_date')
+    def get_sections(self):
+        loans = Loan.objects.select_related('book_instance__book', 'borrower')
+        return {
+            'loans': loans.filter(return_date__isnull=True, loan_date__isnull=False).order_by('due_date'),
+            'reservations': loans.filter(return_date__isnull=True, loan_date__isnull=True,
+                                         reserved_date__isnull=False).order_by('reserved_date'),
+            'past_loans': loans.filter(return_date__isnull=False, loan_date__isnull=False).order_by('-return_date'),
+        }
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        for name, queryset in self.get_sections().items():
+            page_kwarg = '{}_page'.format(name)
+            context[page_kwarg] = Paginator(queryset, self.paginate_by).get_page(self.request.GET.get(page_kwarg))
+        return context
 
 
 from django.shortcuts import get_object_or_404
@@ -138,26 +298,88 @@ def renew_book_librarian(request, pk):
 
     return render(request, 'catalog/book_renew_librarian.html', context)
 
-from django.contrib import messages
+from .circulation import CirculationError, cancel_copy_reservation, check_out_copies, reserve_copy, return_copies
 
 @login_required
 def reserve_book(request, pk):
     """View function for reserving a book."""
-    if request.user.loan_set.filter(reserved_date__isnull=False, return_date__isnull=True).count() >= request.user.max_books:
-        messages.error(request, 'Already reached the maximum number of {} Reserved books.'.format(request.user.max_books))
-    else:
-        book_instance= get_object_or_404(BookInstance, pk=pk)
-        if book_instance.status != "Available":
-            messages.error(request, 'Book not available')
-        else:
-            loan = Loan(book_instance=book_instance, borrower=request.user, reserved_date=date.today())
-            loan.save()
+    # Not refused from the cached LoanSummary, which can lag behind: reserve_copy checks under lock
+    try:
+        reserve_copy(request.user, pk)
+    except CirculationError as error:
+        messages.error(request, str(error))
     return HttpResponseRedirect(reverse('my-borrowed'))
 
 @login_required
 def cancel_reservation(request, pk):
-    loan = get_object_or_404(Loan, pk=pk)
-    if loan.borrower == request.user and loan.is_reservation:
-        loan.return_date = date.today()
-        loan.save()
+    cancel_copy_reservation(request.user, pk)
     return HttpResponseRedirect(reverse('my-borrowed'))
+
+
+from catalog.forms import LoanDeskForm
+
+
+@login_required
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+def loan_desk(request):
+    """View function for the librarian to check out or return a batch of copies."""
+    result = None
+    if request.method == 'POST':
+        form = LoanDeskForm(request.POST)
+        if form.is_valid():
+            copies = form.cleaned_data['copies']
+            try:
+                if form.cleaned_data['action'] == LoanDeskForm.CHECK_OUT:
+                    result = check_out_copies(copies, borrower=form.cleaned_data['borrower'])
+                else:
+                    result = return_copies(copies)
+            except CirculationError as error:
+                messages.error(request, str(error))
+            else:
+                messages.success(request, 'Loan desk: {}.'.format(result))
+                form = LoanDeskForm(initial={'action': form.cleaned_data['action']})
+    else:
+        form = LoanDeskForm()
+
+    return render(request, 'catalog/loan_desk.html', {'form': form, 'result': result})
+
+
+from django.http import StreamingHttpResponse
+
+from catalog.forms import LoanExportForm
+from .exports import export_chunks, export_filename, export_queryset
+
+
+@login_required
+@permission_required('catalog.can_mark_returned', raise_exception=True)
+def export_loans(request):
+    """View function streaming the loan history as CSV or JSON Lines, the form is shown without parameters."""
+    form = LoanExportForm(request.GET or None)
+    if not form.is_valid():
+        return render(request, 'catalog/loan_export.html', {'form': form})
+    data = form.cleaned_data
+    loans = export_queryset(since=data['since'], until=data['until'], statuses=data['status'])
+    if data['gzip']:
+        # A .gz file, not Content-Encoding: browsers would save it decompressed
+        content_type = 'application/gzip'
+    else:
+        content_type = 'text/csv; charset=utf-8' if data['format'] == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(export_chunks(loans, fmt=data['format'], compress=data['gzip']),
+                                     content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(
+        export_filename(data['format'], data['gzip'], data['since'], data['until']))
+    return response
+
+
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
+
+from .metrics import may_scrape, render_metrics
+
+
+def metrics(request):
+    """View function of the Prometheus metrics, see catalog/metrics.py."""
+    if not may_scrape(request):
+        raise PermissionDenied
+    body, content_type = render_metrics()
+    return HttpResponse(body, content_type=content_type)
@@ -0,0 +1,23 @@
+"""gunicorn settings, read from the working directory (see the Procfile).
+
+The Prometheus metrics (catalog/metrics.py) of the workers are aggregated through
+the files of PROMETHEUS_MULTIPROC_DIR, which must exist before the workers import
+prometheus_client and must be emptied when gunicorn starts.
+"""
+import os
+import shutil
+import tempfile
+
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'locallibrary-metrics'))
+
+
+def on_starting(server):
+    # Samples of a previous run would be added to the new ones
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,80 @@
+"""
+ASGI config for locallibrary project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Run it with the uvicorn workers of gunicorn:
+
+    gunicorn locallibrary.asgi -k uvicorn.workers.UvicornWorker
+
+The static files are served by StaticFilesApplication in front of Django, so they never
+reach WhiteNoiseMiddleware. The views stay sync: Django 3.2 has no async ORM, and its
+ASGI handler already runs every sync view in the thread it keeps for database access.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
+"""
+
+import asyncio
+import os
+
+from django.core.asgi import get_asgi_application
+from whitenoise import WhiteNoise
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'locallibrary.settings')
+
+django_application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+
+
+class StaticFilesApplication:
+    """ASGI application serving the files of STATIC_ROOT.
+
+    WhiteNoise finds the files and builds the responses (compressed variants, caching
+    headers, conditional and range requests), the files are read in the default thread
+    pool of the event loop. Not WhiteNoise wrapped by WsgiToAsgi: Django 3.2 runs every
+    sync_to_async(thread_sensitive=True) call, the WSGI application of WsgiToAsgi
+    included, in the single thread of the views, which a slow download would hold.
+    """
+    chunk_size = 64 * 1024
+
+    def __init__(self, root, prefix):
+        self.whitenoise = WhiteNoise(None, root=root, prefix=prefix)
+
+    async def __call__(self, scope, receive, send):
+        static_file = self.whitenoise.files.get(scope['path'])
+        if static_file is None:
+            await send({'type': 'http.response.start', 'status': 404,
+                        'headers': [(b'content-type', b'text/plain')]})
+            await send({'type': 'http.response.body', 'body': b'Not Found'})
+            return
+
+        # The request headers as WhiteNoise reads them, from a WSGI environ
+        environ = {'HTTP_' + name.decode('latin1').upper().replace('-', '_'): value.decode('latin1')
+                   for name, value in scope['headers']}
+        loop = asyncio.get_running_loop()
+        response = await loop.run_in_executor(None, static_file.get_response, scope['method'], environ)
+        await send({'type': 'http.response.start', 'status': int(response.status),
+                    'headers': [(name.lower().encode('latin1'), value.encode('latin1'))
+                                for name, value in response.headers]})
+        if response.file is None:
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        try:
+            while True:
+                chunk = await loop.run_in_executor(None, response.file.read, self.chunk_size)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': bool(chunk)})
+                if not chunk:
+                    break
+        finally:
+            response.file.close()
+
+
+static_application = StaticFilesApplication(root=settings.STATIC_ROOT, prefix=settings.STATIC_URL)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'].startswith(settings.STATIC_URL):
+        await static_application(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -47,6 +47,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so that it times and counts the queries of the whole stack
+    'catalog.middleware.InstrumentationMiddleware',
+    # Before the middleware and views that write, see catalog/routers.py
+    'catalog.routers.PrimaryStickinessMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -61,7 +65,8 @@ ROOT_URLCONF = 'locallibrary.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates timing the rendering for the Server-Timing header (catalog/middleware.py)
+        'BACKEND': 'catalog.middleware.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -70,6 +75,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'catalog.context_processors.loan_summary',
             ],
         },
     },
@@ -88,6 +94,18 @@ DATABASES = {
     }
 }
 
+# Applied to every SQLite connection (catalog/database.py): WAL lets readers run while
+# a reservation is written, busy_timeout (ms) makes writers wait for the lock
+CATALOG_SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -20000,  # KiB
+}
+# Retries of the circulation transactions that still find the database locked
+CATALOG_SQLITE_WRITE_RETRIES = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -123,6 +141,69 @@ USE_TZ = True
 
 
 
+# Cache used for the home page statistics and other catalog data.
+# The default in-memory cache is per process, set DJANGO_CACHE_DIR to use a file based
+# cache shared by all the gunicorn workers so that invalidations reach every worker.
+# https://docs.djangoproject.com/en/3.1/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+if os.environ.get('DJANGO_CACHE_DIR'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ['DJANGO_CACHE_DIR'],
+    }
+
+# Invalidations only reach every worker with a shared cache. Without one, the cached book
+# tiles and loan summaries are kept for minutes only (see catalog/caching.py).
+CATALOG_SHARED_CACHE = CACHES['default']['BACKEND'] not in (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# Conditional GETs of the catalog pages (ETag and Last-Modified, see catalog_page_condition)
+# are answered from version stamps kept in the cache. Only with a cache shared by every
+# worker: a worker missing a change would answer 304 Not Modified for stale pages.
+CATALOG_CONDITIONAL_GET = CATALOG_SHARED_CACHE
+
+# Directory of the cover files named by the manifests uploaded to the book admin (catalog/importer.py)
+CATALOG_IMPORT_COVER_DIR = os.environ.get('CATALOG_IMPORT_COVER_DIR')
+
+# send_loan_reminders also reminds the loans due within this number of days (catalog/reminders.py)
+CATALOG_REMINDER_DAYS = int(os.environ.get('CATALOG_REMINDER_DAYS', 3))
+
+# Request instrumentation (catalog/middleware.py): Server-Timing headers, and requests slower
+# than CATALOG_SLOW_REQUEST_MS logged to catalog.performance with their repeated queries
+CATALOG_SERVER_TIMING = os.environ.get('CATALOG_SERVER_TIMING', '') != 'False'
+CATALOG_SLOW_REQUEST_MS = int(os.environ.get('CATALOG_SLOW_REQUEST_MS', 500))
+
+# Scrapers of /metrics (catalog/metrics.py): requests with the "Authorization: Bearer
+# <CATALOG_METRICS_TOKEN>" header when the token is set, or from these addresses. None by
+# default: behind a reverse proxy on the same host every request comes from 127.0.0.1.
+CATALOG_METRICS_ALLOWED_IPS = os.environ.get('CATALOG_METRICS_ALLOWED_IPS', '').split()
+CATALOG_METRICS_TOKEN = os.environ.get('CATALOG_METRICS_TOKEN', '')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'catalog.performance': {
+            'handlers': ['console'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
+
 # Redirect to home URL after login (Default redirects to /accounts/profile/)
 LOGIN_REDIRECT_URL = '/'
 
@@ -136,6 +217,18 @@ import dj_database_url
 db_from_env = dj_database_url.config(conn_max_age=500)
 DATABASES['default'].update(db_from_env)
 
+# Read replica of the primary database: the catalog browsing reads go to it (catalog/routers.py).
+# To try it locally with SQLite: cp db.sqlite3 replica.sqlite3; DATABASE_REPLICA_URL=sqlite:///replica.sqlite3
+CATALOG_REPLICA_DATABASE = None
+if os.environ.get('DATABASE_REPLICA_URL'):
+    CATALOG_REPLICA_DATABASE = 'replica'
+    DATABASES['replica'] = dj_database_url.parse(os.environ['DATABASE_REPLICA_URL'], conn_max_age=500)
+    # The tests read and write the same database
+    DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+DATABASE_ROUTERS = ['catalog.routers.ReplicaRouter']
+# Seconds a browser reads from the primary after writing, longer than the replication lag
+CATALOG_REPLICA_LAG_SECONDS = int(os.environ.get('CATALOG_REPLICA_LAG_SECONDS', 10))
+
 
 
 # Static files (CSS, JavaScript, Images)
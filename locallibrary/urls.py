@@ -40,10 +40,12 @@ urlpatterns+= static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
 
 #Add URL maps to redirect the base URL to our application
 from django.views.generic import RedirectView
-from catalog.views import index
+from catalog.views import index, metrics
 urlpatterns += [
     # path('', RedirectView.as_view(url='/catalog/', permanent=True)),
     path('', index, name='index'),
+    # Scraped by Prometheus
+    path('metrics', metrics, name='metrics'),
 ]
 
 from django_registration.backends.activation.views import RegistrationView